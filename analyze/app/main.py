@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from typing import Literal
+from fastapi import FastAPI, File, Query, UploadFile, HTTPException, Response, status
+from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from prometheus_fastapi_instrumentator import Instrumentator
+
+from caption_app import model_loader as caption_model_loader
+from object_app import model_loader as object_model_loader
+from object_app.shared import ingest as object_ingest
+from service_common.executor import QueueFullError
+from service_common.ingest import RequestSizeLimitMiddleware, UploadTooLargeError
+from service_common.startup import STARTUP_BACKGROUND
+
+from . import pipeline, schemas
+from .shared import instrumentation, startup
+
+# --- Logging Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def _load_models():
+    """
+    Loads and warms up both models.
+
+    This service's startup goes starting -> loading -> ready, or failed: its
+    "load" phase (analyze_startup_phase_seconds) covers both loaders, whose
+    own import/load/warmup phases are exported as object_* and caption_*.
+    """
+    with startup.phase("load"):
+        object_model_loader.load_model()
+        caption_model_loader.load_model()
+    instrumentation.set_model_labels(f"{object_model_loader.MODEL_NAME}+{caption_model_loader.MODEL_NAME}",
+                                     f"{object_model_loader.runtime}+{caption_model_loader.backend}")
+
+# --- Lifespan Management (loads both models into this process) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the models in the background, so health checks and metrics are served meanwhile (see service_common/startup.py)
+    logger.info("Application startup: Loading Object Detection and captioning models...")
+    startup_task = asyncio.create_task(startup.run(_load_models, pipeline.start))
+    if not STARTUP_BACKGROUND:
+        await startup_task
+    yield
+    logger.info("Application shutdown: Cleaning up resources...")
+    startup_task.cancel()
+    await pipeline.stop()
+
+
+# --- FastAPI App Initialization ---
+app = FastAPI(
+    title="Image Analysis API",
+    description="API to detect objects in and caption an uploaded image in one request.",
+    version="0.1.0",
+    lifespan=lifespan
+)
+
+Instrumentator().instrument(app).expose(app)
+# Routes declared below report per-stage timings (Server-Timing header and analyze_stage_seconds)
+app.router.route_class = instrumentation.TimedRoute
+
+# Bounds request bodies before they are parsed; added before CORS so 413 answers carry CORS headers too
+app.add_middleware(RequestSizeLimitMiddleware, ingest=object_ingest)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Server-Timing"], # So the frontend can read per-stage timings
+)
+
+# --- API Endpoints ---
+@app.get("/api/analyze/health", response_model=schemas.HealthCheckResponse, tags=["Health"])
+async def health_check():
+    """Reports the startup state; ready once both models are loaded and warmed up."""
+    status_msg = "model_loading_failed" if startup.state == "failed" else startup.state
+    logger.info(f"Health check requested. Model status: {status_msg}")
+    return schemas.HealthCheckResponse(status=status_msg)
+
+@app.get("/api/analyze/health/live", response_model=schemas.HealthCheckResponse, tags=["Health"])
+async def liveness_check():
+    """Liveness probe: answers as soon as the server runs, also while the models load."""
+    return schemas.HealthCheckResponse(status=startup.state)
+
+@app.get("/api/analyze/health/ready", response_model=schemas.HealthCheckResponse, tags=["Health"],
+         responses={503: {"model": schemas.HealthCheckResponse, "description": "Still loading the models, or failed."}})
+async def readiness_check(response: Response):
+    """Readiness probe: 503 until both models are loaded and warmed up, so no traffic arrives before then."""
+    if not startup.is_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return schemas.HealthCheckResponse(status=startup.state)
+
+@app.post("/api/analyze", response_model=schemas.AnalyzeResponse, tags=["Analysis"])
+async def analyze_endpoint(
+    file: UploadFile = File(...),
+    caption: Literal["always", "if_objects", "never"] = Query(
+        pipeline.ANALYZE_CAPTION_MODE,
+        description="Caption alongside detection, only when objects were found, or not at all."),
+):
+    """
+    Uploads an image once and returns both detected objects and a caption.
+
+    - **file**: The image file to upload (e.g., JPEG, PNG).
+    - **caption**: `if_objects` skips captioning when detection finds nothing.
+
+    The image is decoded once and shared by both models. Per-stage durations
+    are returned in the `Server-Timing` header.
+    """
+    logger.info(f"Received request for image analysis: {file.filename}")
+    if not file.content_type or not file.content_type.startswith("image/"):
+        logger.warning(f"Invalid file type received: {file.content_type}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file type. Please upload an image.",
+        )
+    if not startup.is_ready():
+        logger.error(f"Analysis request failed: Models are not ready (state: {startup.state}).")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Models are not ready or failed to load. Please try again later.",
+        )
+
+    try:
+        image_bytes = await object_ingest.read_upload(file)
+        analysis = await pipeline.analyze(image_bytes, caption)
+        logger.info(f"Successfully analyzed {file.filename}: {len(analysis.objects)} objects, "
+                    f"skipped={analysis.skipped}")
+        return schemas.AnalyzeResponse(
+            filename=file.filename,
+            objects=[schemas.DetectedObject(**obj) for obj in analysis.objects],
+            caption=analysis.caption,
+            skipped=analysis.skipped,
+        )
+
+    except UploadTooLargeError as too_large:
+        logger.warning(f"Rejecting analysis for {file.filename}: {too_large}")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(too_large),
+        )
+    except QueueFullError as qf: # Either service can shed load; answer quickly instead of queueing without bound
+        logger.warning(f"Rejecting analysis for {file.filename}: {qf}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Analysis queue is full. Please retry later.",
+            headers={"Retry-After": str(qf.retry_after)},
+        )
+    except ValueError as ve:
+        logger.error(f"Value error during analysis for {file.filename}: {ve}", exc_info=True)
+        return schemas.AnalyzeResponse(filename=file.filename, error=f"Analysis error: {ve}")
+    except Exception as e:
+        logger.error(f"Unexpected error during analysis for {file.filename}: {e}", exc_info=True)
+        return schemas.AnalyzeResponse(filename=file.filename,
+                                       error="An unexpected error occurred during image analysis.")
+    finally:
+        await file.close()
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+
+from prometheus_client import Counter
+
+from caption_app import model_loader as caption_model_loader, pipeline as caption_pipeline
+from object_app import model_loader as object_model_loader, pipeline as object_pipeline
+from object_app.shared import ingest as object_ingest
+
+from .shared import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# "always" runs captioning alongside detection; "if_objects" waits for detection
+# and skips captioning when nothing was found; "never" only detects.
+CAPTION_MODES = ("always", "if_objects", "never")
+ANALYZE_CAPTION_MODE = os.getenv("ANALYZE_CAPTION_MODE", "always").lower()
+# One decode serves both models, so it has to be large enough for the bigger input
+DECODE_SIZE = max(object_model_loader.INPUT_SIZE, caption_model_loader.INPUT_SIZE)
+
+# --- Metrics ---
+# Stage durations are exported as analyze_stage_seconds (see shared.py); detect and caption
+# are wall times that include waiting for the shared decode
+STAGES_SKIPPED = Counter("analyze_stage_skipped_total", "Stages skipped because of earlier results.", ["stage"])
+DECODES_SAVED = Counter("analyze_decodes_saved_total", "Decodes avoided because detection and captioning shared one.")
+
+
+@dataclass
+class Analysis:
+    objects: list
+    caption: str | None
+    skipped: list = field(default_factory=list)
+
+
+class SharedDecode:
+    """Decodes an upload at most once, on first use, for every model that needs its pixels."""
+
+    def __init__(self, image_bytes: bytes):
+        self.image_bytes = image_bytes
+        self._task = None
+
+    def __call__(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._decode())
+            # A failed decode is re-raised to every waiter; don't also log it as never retrieved
+            self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        else:
+            DECODES_SAVED.inc()
+        return asyncio.shield(self._task)
+
+    async def _decode(self):
+        # Admission control goes through the detector's executor, the first model to need the image;
+        # the decode is timed there, as the request's "decode" stage
+        return await object_pipeline.inference_executor.run(object_ingest.decode_image, self.image_bytes, DECODE_SIZE)
+
+
+async def start():
+    await object_pipeline.start()
+    await caption_pipeline.start()
+
+
+async def stop():
+    await caption_pipeline.stop()
+    await object_pipeline.stop()
+
+
+async def _timed(stage: str, work):
+    with instrumentation.stage(stage):
+        return await work
+
+
+async def analyze(image_bytes: bytes, caption_mode: str = ANALYZE_CAPTION_MODE) -> Analysis:
+    """
+    Detects objects in and captions one image, decoding it once for both models.
+
+    Both results go through their service's result cache, so an image either
+    service has already seen is not decoded at all. In "always" mode detection
+    and captioning run concurrently; in "if_objects" mode captioning only
+    starts once detection has found something.
+    """
+    if caption_mode not in CAPTION_MODES:
+        raise ValueError(f"Unknown caption mode '{caption_mode}'. Use one of {', '.join(CAPTION_MODES)}.")
+
+    decode = SharedDecode(image_bytes)
+    analysis = Analysis(objects=[], caption=None)
+
+    detect = _timed("detect", object_pipeline.detect_decoded(image_bytes, decode))
+    if caption_mode == "always":
+        caption = _timed("caption", caption_pipeline.caption_decoded(image_bytes, decode))
+        detect_job, caption_job = asyncio.ensure_future(detect), asyncio.ensure_future(caption)
+        try:
+            analysis.objects, analysis.caption = await asyncio.gather(detect_job, caption_job)
+        except BaseException:
+            for job in (detect_job, caption_job):
+                job.cancel()
+            raise
+    else:
+        analysis.objects = await detect
+        if caption_mode == "if_objects" and analysis.objects:
+            analysis.caption = await _timed("caption", caption_pipeline.caption_decoded(image_bytes, decode))
+        else:
+            analysis.skipped.append("caption")
+            STAGES_SKIPPED.labels(stage="caption").inc()
+    return analysis
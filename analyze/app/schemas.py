@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field
+from typing import List
+
+from object_app.schemas import DetectedObject
+
+class AnalyzeResponse(BaseModel):
+    """Response schema for the combined detection and captioning endpoint."""
+    filename: str
+    objects: List[DetectedObject] = []
+    caption: str | None = Field(None, description="Generated caption, or null if captioning was skipped.")
+    skipped: List[str] = Field([], description="Stages skipped because of earlier results, e.g. caption.")
+    error: str | None = None
+
+class HealthCheckResponse(BaseModel):
+    """Response schema for health check."""
+    status: str
@@ -0,0 +1,13 @@
+"""
+This service's instances of the shared serving components (see service_common).
+
+Metrics of every component are exported as analyze_*; the models' own stages
+are also exported by their services' components, as object_* and caption_*.
+"""
+from service_common.instrumentation import Instrumentation
+from service_common.startup import Startup
+
+SERVICE = "analyze"
+
+instrumentation = Instrumentation.for_service(SERVICE)
+startup = Startup(SERVICE)
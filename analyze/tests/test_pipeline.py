@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from caption_app import pipeline as caption_pipeline
+from object_app import pipeline as object_pipeline
+from service_common.executor import QueueFullError
+
+from app import main, pipeline
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Stands in for both models; each decodes through the shared decode, like the real ones on a cache miss."""
+    decodes, calls = [], []
+
+    def decode_image(image_bytes, size):
+        decodes.append(image_bytes)
+        return "pixels"
+
+    async def run(fn, *args):
+        return fn(*args)
+
+    async def detect_decoded(image_bytes, decode):
+        calls.append("detect")
+        assert await decode() == "pixels"
+        return [{"label": "cat", "score": 0.9, "box": [0, 0, 1, 1]}] if image_bytes == b"cat" else []
+
+    async def caption_decoded(image_bytes, decode):
+        calls.append("caption")
+        assert await decode() == "pixels"
+        return "a cat"
+
+    monkeypatch.setattr(pipeline.object_ingest, "decode_image", decode_image)
+    monkeypatch.setattr(object_pipeline.inference_executor, "run", run)
+    monkeypatch.setattr(object_pipeline, "detect_decoded", detect_decoded)
+    monkeypatch.setattr(caption_pipeline, "caption_decoded", caption_decoded)
+    return decodes, calls
+
+
+def test_both_models_share_one_decode(models):
+    decodes, calls = models
+    analysis = asyncio.run(pipeline.analyze(b"cat", "always"))
+    assert analysis.objects[0]["label"] == "cat" and analysis.caption == "a cat"
+    assert sorted(calls) == ["caption", "detect"]
+    assert decodes == [b"cat"]
+
+
+@pytest.mark.parametrize("image_bytes, mode, caption", [
+    (b"cat", "if_objects", "a cat"),
+    (b"empty", "if_objects", None),
+    (b"cat", "never", None),
+])
+def test_caption_only_runs_when_the_mode_asks_for_it(models, image_bytes, mode, caption):
+    decodes, calls = models
+    analysis = asyncio.run(pipeline.analyze(image_bytes, mode))
+    assert analysis.caption == caption
+    assert analysis.skipped == ([] if caption else ["caption"])
+    assert decodes == [image_bytes]
+
+
+def test_unknown_caption_mode_is_rejected(models):
+    with pytest.raises(ValueError):
+        asyncio.run(pipeline.analyze(b"cat", "sometimes"))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main.startup, "state", "ready")
+    return TestClient(main.app) # Without the lifespan, so no model is loaded
+
+
+def test_analyze_returns_both_results_with_stage_timings(client, models):
+    response = client.post("/api/analyze", files={"file": ("a.jpg", b"cat", "image/jpeg")})
+    assert response.status_code == 200
+    assert response.json()["caption"] == "a cat"
+    stages = [entry.split(";")[0] for entry in response.headers["server-timing"].split(", ")]
+    assert {"detect", "caption", "total"} <= set(stages)
+
+
+def test_analyze_answers_503_until_the_models_are_ready(client, monkeypatch):
+    monkeypatch.setattr(main.startup, "state", "loading")
+    response = client.post("/api/analyze", files={"file": ("a.jpg", b"cat", "image/jpeg")})
+    assert response.status_code == 503
+    assert client.get("/api/analyze/health/ready").status_code == 503
+    assert client.get("/api/analyze/health/live").status_code == 200
+
+
+def test_full_queue_answers_429_with_retry_after(client, monkeypatch):
+    async def analyze(*args, **kwargs):
+        raise QueueFullError("Inference queue is full (32 interactive jobs waiting).", retry_after=7)
+
+    monkeypatch.setattr(pipeline, "analyze", analyze)
+    response = client.post("/api/analyze", files={"file": ("a.jpg", b"cat", "image/jpeg")})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
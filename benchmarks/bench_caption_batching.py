@@ -0,0 +1,58 @@
+"""
+Measures caption throughput of one batched generate call at several batch sizes.
+
+Usage (from the repository root, with caption/requirements.txt installed):
+    python benchmarks/bench_caption_batching.py --batch-sizes 1 4 8 16 --iterations 5
+"""
+import argparse
+import json
+import time
+
+from common import import_service_module, synthetic_images
+
+
+def run(batch_sizes, iterations, image_size):
+    model_loader = import_service_module("caption", "model_loader")
+    model_loader.load_model()
+    model_loader.encoder_outputs.max_entries = 0 # Repeated batches must still pay for the encoder
+
+    images = synthetic_images(max(batch_sizes), size=image_size)
+    results = []
+    for batch_size in batch_sizes:
+        batch = images[:batch_size]
+        model_loader.generate_captions(batch) # Warm-up, not timed
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            model_loader.generate_captions(batch)
+            latencies.append(time.perf_counter() - start)
+
+        total = sum(latencies)
+        results.append({
+            "batch_size": batch_size,
+            "iterations": iterations,
+            "mean_batch_latency_s": round(total / iterations, 4),
+            "captions_per_second": round(batch_size * iterations / total, 2),
+        })
+        print(f"batch_size={batch_size:>3}  mean_latency={total / iterations:.3f}s  "
+              f"captions/sec={batch_size * iterations / total:.2f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 480], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results = run(args.batch_sizes, args.iterations, tuple(args.image_size))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compares the caption decoding strategies on latency and caption quality.
+
+Every strategy captions the same image set twice, one image per call:
+
+    cold - the encoder cache is off, so each call runs the ViT encoder and the decoder
+    warm - the image's encoder output is cached, so only decoding is timed (a retry,
+           or the same image requested with another strategy)
+
+Quality is measured against the beam-search captions the service returns by
+default, with exact match and corpus BLEU-4 (see caption_backend_parity.py).
+"speculative" should match "greedy" exactly; its speed-up depends on how often
+the draft layers guess the full decoder's next token, so measure it with the
+real model (--standin captions are meaningless and the draft rarely agrees).
+
+Usage (from the repository root, with caption/requirements.txt installed):
+    python benchmarks/bench_caption_decoding.py --images photos/ --count 50 --output decoding.json
+    python benchmarks/bench_caption_decoding.py --standin --full-size --strategies beam greedy early-exit
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from caption_backend_parity import corpus_bleu, _load_images
+from common import import_service_module
+
+STRATEGIES = ["beam", "greedy", "speculative", "early-exit"]
+
+
+def _timed_captions(model_loader, images, decoding):
+    captions, latencies = [], []
+    for image in images:
+        start = time.perf_counter()
+        captions.append(model_loader.generate_captions([image], decoding)[0])
+        latencies.append(time.perf_counter() - start)
+    return captions, latencies
+
+
+def _summary(latencies):
+    ordered = sorted(latencies)
+    return {"mean_ms": round(statistics.fmean(ordered) * 1e3, 1),
+            "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95) - 1)] * 1e3, 1)}
+
+
+def run(strategies, images):
+    model_loader = import_service_module("caption", "model_loader")
+    encoder_cache = import_service_module("caption", "encoder_cache")
+    model_loader.load_model()
+    available = model_loader.available_decoding()
+    model_loader.generate_captions(images[:1], available[0]) # Warm-up, not timed
+
+    results = {}
+    for decoding in strategies:
+        if decoding not in available:
+            print(f"{decoding}: not available with this configuration ({', '.join(available)})")
+            continue
+        model_loader.encoder_outputs = encoder_cache.EncoderCache(max_entries=0)
+        captions, cold = _timed_captions(model_loader, images, decoding)
+        model_loader.encoder_outputs = encoder_cache.EncoderCache(max_entries=len(images))
+        for image in images: # Fill the encoder cache, not timed
+            model_loader.generate_captions([image], decoding)
+        _, warm = _timed_captions(model_loader, images, decoding)
+        results[decoding] = {"captions": captions, "cold": _summary(cold), "warm": _summary(warm),
+                             "mean_words": round(statistics.fmean(len(c.split()) for c in captions), 2)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=STRATEGIES)
+    parser.add_argument("--images", help="Directory of images to use instead of the synthetic set.")
+    parser.add_argument("--count", type=int, default=12, help="Number of images in the set.")
+    parser.add_argument("--standin", action="store_true", help="Use a randomly initialised stand-in model.")
+    parser.add_argument("--full-size", action="store_true", help="Give the stand-in the real model's dimensions.")
+    parser.add_argument("--standin-dir", default=os.path.join(tempfile.gettempdir(), "bench-standins"))
+    parser.add_argument("--output", help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+
+    if args.standin:
+        import standins
+        caption_model = standins.install(args.standin_dir, services=("caption",), full_size=args.full_size)
+        import_service_module("caption", "model_loader").MODEL_NAME = caption_model
+
+    strategies = ["beam"] + [s for s in args.strategies if s != "beam"] # The quality reference comes first
+    results = run(strategies, _load_images(args.images, args.count))
+    reference = results["beam"]["captions"]
+    print(f"{'strategy':<12} {'cold mean':>10} {'cold p95':>9} {'warm mean':>10} {'warm p95':>9} "
+          f"{'bleu':>6} {'exact':>6} {'words':>6}")
+    for decoding, result in results.items():
+        result["bleu"] = round(corpus_bleu(reference, result["captions"]), 3)
+        result["exact_match"] = round(sum(a == b for a, b in zip(reference, result["captions"])) / len(reference), 3)
+        cold, warm = result["cold"], result["warm"]
+        print(f"{decoding:<12} {cold['mean_ms']:>8.1f}ms {cold['p95_ms']:>7.1f}ms {warm['mean_ms']:>8.1f}ms "
+              f"{warm['p95_ms']:>7.1f}ms {result['bleu']:>6.3f} {result['exact_match']:>6.2f} {result['mean_words']:>6}")
+    if "greedy" in results and "speculative" in results:
+        same = results["greedy"]["captions"] == results["speculative"]["captions"]
+        print(f"speculative captions {'match' if same else 'DIFFER FROM'} greedy")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
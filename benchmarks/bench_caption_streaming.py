@@ -0,0 +1,93 @@
+"""
+Compares time-to-first-token of streamed captions with total caption latency.
+
+For every image the streamed decode (greedy and/or sampling) records when the
+first text chunk arrives and when the caption is complete; the blocking
+beam-search caption used by /caption is timed alongside for reference.
+
+Usage (from the repository root, with caption/requirements.txt installed):
+    python benchmarks/bench_caption_streaming.py --images 20 --decoding greedy sample
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+
+from transformers import TextIteratorStreamer
+
+from common import import_service_module, synthetic_images
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def summarize(values):
+    return {
+        "mean_s": round(statistics.fmean(values), 4),
+        "p50_s": round(percentile(values, 50), 4),
+        "p95_s": round(percentile(values, 95), 4),
+    }
+
+
+def time_streamed(model_loader, image, decoding):
+    """Returns (time_to_first_token, total_latency) for one streamed caption."""
+    streamer = TextIteratorStreamer(model_loader.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    start = time.perf_counter()
+    worker = threading.Thread(target=model_loader.generate_caption_streamed, args=(image, streamer, decoding))
+    worker.start()
+    first_token = None
+    for text in streamer:
+        if text and first_token is None:
+            first_token = time.perf_counter() - start
+    worker.join()
+    total = time.perf_counter() - start
+    return (first_token if first_token is not None else total), total
+
+
+def run(image_count, decodings, image_size):
+    model_loader = import_service_module("caption", "model_loader")
+    model_loader.load_model()
+    model_loader.encoder_outputs.max_entries = 0 # The warm-up image must still pay for the encoder
+    images = synthetic_images(image_count, size=image_size)
+
+    # Warm-up, not timed
+    model_loader.generate_captions(images[:1])
+    for decoding in decodings:
+        time_streamed(model_loader, images[0], decoding)
+
+    results = {}
+    blocking = []
+    for image in images:
+        start = time.perf_counter()
+        model_loader.generate_captions([image])
+        blocking.append(time.perf_counter() - start)
+    results["blocking_beam"] = {"total": summarize(blocking)}
+    print(f"blocking beam (num_beams={model_loader.NUM_BEAMS}): total mean={statistics.fmean(blocking):.3f}s")
+
+    for decoding in decodings:
+        ttft, totals = zip(*(time_streamed(model_loader, image, decoding) for image in images))
+        results[f"stream_{decoding}"] = {"time_to_first_token": summarize(ttft), "total": summarize(totals)}
+        print(f"stream {decoding:<7}: ttft mean={statistics.fmean(ttft):.3f}s p95={percentile(ttft, 95):.3f}s  "
+              f"total mean={statistics.fmean(totals):.3f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--decoding", nargs="+", choices=["greedy", "sample"], default=["greedy", "sample"])
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 480], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results = run(args.images, args.decoding, tuple(args.image_size))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compares near-duplicate index lookup cost against model inference cost.
+
+Fills a NearDuplicateIndex with random 64-bit hashes (1M by default), then
+times lookups that hit (query within the hamming radius of a stored hash)
+and lookups that miss. With --service, one batch-of-one inference on a
+synthetic image is timed for comparison (requires that service's model).
+
+Usage (from the repository root):
+    python benchmarks/bench_near_duplicate.py --entries 1000000 --service object
+"""
+import argparse
+import json
+import random
+import resource
+import statistics
+import time
+
+from service_common import near_duplicate
+
+from common import import_service_module, synthetic_images
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _time_lookups(index, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.lookup("bench", query)
+        timings.append(time.perf_counter() - start)
+    return {
+        "mean_us": round(statistics.fmean(timings) * 1e6, 2),
+        "p99_us": round(_percentile(timings, 99) * 1e6, 2),
+    }
+
+
+def _time_inference(service, iterations):
+    model_loader = import_service_module(service, "model_loader")
+    model_loader.load_model()
+    image = synthetic_images(1)[0]
+    if service == "object":
+        import numpy as np
+        run = lambda: model_loader.detect_objects_batch([np.array(image)])
+    else:
+        model_loader.encoder_outputs.max_entries = 0 # Time the whole inference, not just decoding
+        run = lambda: model_loader.generate_captions([image])
+    run() # Warm-up, not timed
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return {"mean_ms": round(statistics.fmean(timings) * 1e3, 2)}
+
+
+def run(entries, queries, max_distance, service, inference_iterations, seed):
+    rng = random.Random(seed)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    index = near_duplicate.NearDuplicateIndex("bench", max_distance=max_distance, max_entries=entries)
+    stored = [rng.getrandbits(64) for _ in range(entries)]
+    start = time.perf_counter()
+    for value in stored:
+        index.add("bench", value, None)
+    build_seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    hit_queries = []
+    for value in rng.sample(stored, queries):
+        for bit in rng.sample(range(64), rng.randint(0, max_distance)):
+            value ^= 1 << bit
+        hit_queries.append(value)
+    miss_queries = [rng.getrandbits(64) for _ in range(queries)]
+
+    report = {
+        "entries": entries,
+        "max_distance": max_distance,
+        "build_seconds": round(build_seconds, 2),
+        "index_max_rss_growth_mb": round((rss_after - rss_before) / 1024, 1), # ru_maxrss is KiB on Linux
+        "lookup_hit": _time_lookups(index, hit_queries),
+        "lookup_miss": _time_lookups(index, miss_queries),
+    }
+    if service:
+        report["inference"] = _time_inference(service, inference_iterations)
+        report["inference_to_lookup_ratio"] = round(
+            report["inference"]["mean_ms"] * 1e3 / report["lookup_hit"]["mean_us"], 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=near_duplicate.MAX_DISTANCE_LIMIT)
+    parser.add_argument("--service", choices=["object", "caption"], help="Also time inference for this service.")
+    parser.add_argument("--inference-iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+
+    report = run(args.entries, args.queries, args.max_distance, args.service, args.inference_iterations, args.seed)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures tiled detection throughput as the number of tiles per image grows.
+
+Each image size is sliced with the same tile size and overlap, so larger
+images mean more tiles. Reports images/sec and tiles/sec for every
+combination of image size and tile batch size.
+
+Usage (from the repository root, with object/requirements.txt installed and
+YOLO_MODEL_PATH pointing at a checkpoint):
+    python benchmarks/bench_object_tiling.py --image-sizes 1280x960 2560x1920 5120x3840 --batch-sizes 1 8 16
+"""
+import argparse
+import json
+import time
+
+from common import import_service_module, synthetic_images
+
+
+def parse_size(text: str) -> tuple:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def run(image_sizes, batch_sizes, tile_size, overlap, merge, iterations):
+    model_loader = import_service_module("object", "model_loader")
+    tiling = import_service_module("object", "tiling")
+    model_loader.load_model()
+
+    results = []
+    for size in image_sizes:
+        image = synthetic_images(1, size=size)[0]
+        tiles = len(tiling.make_tiles(*size, tile_size, overlap))
+        for batch_size in batch_sizes:
+            tiling.detect_tiled(image, tile_size, overlap, batch_size, merge) # Warm-up, not timed
+
+            latencies = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                tiling.detect_tiled(image, tile_size, overlap, batch_size, merge)
+                latencies.append(time.perf_counter() - start)
+
+            mean = sum(latencies) / iterations
+            results.append({
+                "image_size": f"{size[0]}x{size[1]}",
+                "tiles": tiles,
+                "batch_size": batch_size,
+                "iterations": iterations,
+                "mean_latency_s": round(mean, 4),
+                "images_per_second": round(1 / mean, 3),
+                "tiles_per_second": round(tiles / mean, 2),
+            })
+            print(f"image={size[0]}x{size[1]:<5}  tiles={tiles:>4}  batch_size={batch_size:>3}  "
+                  f"mean_latency={mean:.3f}s  tiles/sec={tiles / mean:.2f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-sizes", type=parse_size, nargs="+",
+                        default=[(1280, 960), (2560, 1920), (5120, 3840)], metavar="WxH")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--tile-size", type=int, default=640)
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--merge", choices=["nms", "wbf"], default="nms")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results = run(args.image_sizes, args.batch_sizes, args.tile_size, args.overlap, args.merge, args.iterations)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
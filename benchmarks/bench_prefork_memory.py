@@ -0,0 +1,150 @@
+"""
+Measures the memory of app/serve.py with 1..N workers against one pod per worker.
+
+Each configuration is started on a local port with stand-in models (see
+standins.py; --full-size gives them the real models' dimensions), sent a few
+requests per worker so every worker has run inference, and then measured
+from /proc/<pid>/smaps_rollup:
+
+    pss_total     - proportional set size of the master and all workers; pages
+                    shared copy-on-write are split between the processes, so
+                    this is what the pod really costs
+    uss_per_worker - memory private to each worker (what one more worker adds)
+    separate_pods - N x the RSS of a single-worker server, i.e. the same
+                    capacity spread over N pods
+
+Usage (from the repository root, Linux only, with the service's requirements installed):
+    python benchmarks/bench_prefork_memory.py --service caption --workers 1 2 4 --full-size
+    python benchmarks/bench_prefork_memory.py --service object --workers 1 2 4 --output prefork.json
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from common import encode_image, import_service_module, synthetic_images
+
+ENDPOINTS = {"caption": ("/caption", "/health"), "object": ("/api/object", "/api/health")}
+
+
+def serve(service: str, workers: int, port: int, standin_dir: str, full_size: bool):
+    """Runs in the child process: starts app/serve.py with stand-in models."""
+    import standins
+
+    caption_model = standins.install(standin_dir, services=(service,), full_size=full_size)
+    if workers > 1: # Must be set before prometheus_client is imported
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+    if service == "caption":
+        import_service_module("caption", "model_loader").MODEL_NAME = caption_model
+    server = import_service_module(service, "serve")
+    sys.argv = ["serve", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    server.main()
+
+
+def smaps(pid: int) -> dict:
+    """Returns the smaps_rollup fields of a process, in bytes."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return fields
+
+
+def process_tree(pid: int) -> list:
+    """The server process and its worker processes."""
+    children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+    return [pid] + [int(child) for child in children]
+
+
+def wait_until_ready(client: httpx.Client, health_path: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before becoming ready.")
+        try:
+            if client.get(health_path).json().get("status") == "ready":
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(1.0)
+    raise RuntimeError(f"Server was not ready within {timeout}s.")
+
+
+def measure(args, workers: int, images: list) -> dict:
+    request_path, health_path = ENDPOINTS[args.service]
+    command = [sys.executable, __file__, "--serve", "--service", args.service, "--port", str(args.port),
+               "--standin-dir", args.standin_dir] + (["--full-size"] if args.full_size else [])
+    process = subprocess.Popen(command + ["--workers", str(workers)], env=dict(os.environ, SERVE_WORKERS=str(workers)))
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=120.0) as client:
+            wait_until_ready(client, health_path, process, args.startup_timeout)
+            # New connections are spread over the workers by the kernel, so send plenty of them
+            for image_bytes in images[:args.requests_per_worker * workers]:
+                response = client.post(request_path, files={"file": ("bench.jpg", image_bytes, "image/jpeg")},
+                                       headers={"Connection": "close"})
+                response.raise_for_status()
+        pids = process_tree(process.pid)
+        usage = {pid: smaps(pid) for pid in pids}
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    worker_pids = pids[1:] or pids
+    return {
+        "workers": workers,
+        "rss_total": sum(u["Rss"] for u in usage.values()),
+        "pss_total": sum(u["Pss"] for u in usage.values()),
+        "uss_per_worker": round(sum(usage[pid]["Private_Clean"] + usage[pid]["Private_Dirty"]
+                                    for pid in worker_pids) / len(worker_pids)),
+        "rss_per_worker": round(sum(usage[pid]["Rss"] for pid in worker_pids) / len(worker_pids)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=sorted(ENDPOINTS), required=True)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--full-size", action="store_true", help="Use stand-ins as large as the real models.")
+    parser.add_argument("--standin-dir", default=os.path.join(tempfile.gettempdir(), "bench-standins"))
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--requests-per-worker", type=int, default=8)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS) # Child process mode
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.service, args.workers[0], args.port, args.standin_dir, args.full_size)
+        return
+
+    images = [encode_image(image) for image in synthetic_images(args.requests_per_worker * max(args.workers))]
+    results = [measure(args, workers, images) for workers in args.workers]
+    single_rss = next((r["rss_total"] for r in results if r["workers"] == 1), None)
+
+    mib = 2 ** 20
+    print(f"{'workers':>8} {'PSS total':>12} {'USS/worker':>12} {'RSS/worker':>12} {'separate pods':>14}")
+    for r in results:
+        r["separate_pods"] = single_rss * r["workers"] if single_rss else None
+        pods = f"{r['separate_pods'] / mib:>11.0f}MiB" if single_rss else f"{'n/a':>14}"
+        print(f"{r['workers']:>8} {r['pss_total'] / mib:>9.0f}MiB {r['uss_per_worker'] / mib:>9.0f}MiB "
+              f"{r['rss_per_worker'] / mib:>9.0f}MiB {pods}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"service": args.service, "full_size": args.full_size,
+                                                 "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Compares the encoded-image upload path with the pre-decoded (raw) path.
+
+Synthetic frames are sent one at a time, in each of these forms:
+
+    jpeg - multipart upload to POST /caption or /api/object (decoded by the service)
+    png  - as jpeg, but lossless, so it has exactly the raw frame's pixels
+    raw  - packed uint8 pixels to the /raw endpoint, with an X-Image-Shape header
+    npy  - the frame as a NumPy .npy file to the /raw endpoint
+
+Every request uses a distinct frame, so the result cache never answers (for
+--transport http, start the service with NEAR_DUPLICATE_ENABLED=false so
+the near-duplicate index doesn't either). For
+each form the report has the client-side latency, the body size, and the
+service's read, decode and preprocess stages from its Server-Timing header.
+
+The JPEG path decodes straight to about the model's input size, while a raw
+frame is resized by the model's preprocessing, so raw only wins when clients
+send frames close to the input size (try --image-size 224x224 for caption,
+640x640 for object). Raw bodies are also much larger than JPEGs, so over a
+real network the saved decode time has to pay for the extra transfer; compare
+with --transport http.
+
+Usage (from the repository root, with the service's requirements and httpx installed):
+    python benchmarks/bench_raw_ingest.py --service object --standin --count 50 --image-size 1920x1080
+    python benchmarks/bench_raw_ingest.py --service caption --transport http --url http://localhost:8000 --output raw.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from service_common import near_duplicate
+
+from bench_services import ENDPOINTS, parse_size, percentile
+from common import encode_image, import_service_module, synthetic_images
+
+FORMS = ["jpeg", "png", "raw", "npy"]
+STAGES = ["read", "decode", "preprocess"]
+
+
+def _request(form, image, path):
+    """Returns the path, httpx keyword arguments and body size of one request in the given form."""
+    if form in ("jpeg", "png"):
+        body = encode_image(image, form.upper())
+        return path, {"files": {"file": (f"bench.{form}", body, f"image/{form}")}}, len(body)
+    pixels = np.asarray(image)
+    if form == "raw":
+        height, width, _ = pixels.shape
+        body = pixels.tobytes()
+        headers = {"content-type": "application/octet-stream", "x-image-shape": f"{height},{width},3"}
+    else:
+        buffer = BytesIO()
+        np.save(buffer, pixels)
+        body, headers = buffer.getvalue(), {"content-type": "application/x-npy"}
+    return f"{path}/raw", {"content": body, "headers": headers}, len(body)
+
+
+def _server_timing(header):
+    """Parses a Server-Timing header into {stage: milliseconds}."""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, duration = entry.partition(";dur=")
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+
+def _summary(values):
+    return {"mean": round(statistics.fmean(values), 2), "p50": round(percentile(values, 50), 2),
+            "p95": round(percentile(values, 95), 2)}
+
+
+async def run_form(client, form, images, path, warmup):
+    requests = [_request(form, image, path) for image in images]
+    for url, kwargs, _ in requests[:warmup]: # Untimed
+        (await client.post(url, **kwargs)).raise_for_status()
+
+    latencies, stages, errors = [], {stage: [] for stage in STAGES}, 0
+    for url, kwargs, _ in requests[warmup:]:
+        start = time.perf_counter()
+        response = await client.post(url, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1e3
+        if response.status_code != 200 or response.json().get("error"):
+            errors += 1
+            continue
+        timings = _server_timing(response.headers.get("server-timing"))
+        latencies.append(elapsed)
+        for stage in STAGES:
+            stages[stage].append(timings.get(stage, 0.0))
+    if not latencies:
+        return {"errors": errors}
+    return {"body_bytes": round(statistics.fmean(size for _, _, size in requests)), "errors": errors,
+            "latency_ms": _summary(latencies), **{f"{stage}_ms": _summary(stages[stage]) for stage in STAGES}}
+
+
+async def run(args, client):
+    path = ENDPOINTS[args.service]
+    results = {}
+    for index, form in enumerate(args.forms):
+        # Each form gets its own frames, so none is answered from the result cache filled by another
+        frames = synthetic_images(args.count + args.warmup, size=args.image_size, seed=args.seed + index)
+        results[form] = await run_form(client, form, frames, path, args.warmup)
+    return results
+
+
+async def run_asgi(args):
+    if args.standin:
+        import standins
+        caption_model = standins.install(args.standin_dir, services=(args.service,))
+        if args.service == "caption":
+            import_service_module("caption", "model_loader").MODEL_NAME = caption_model
+    # Raw frames skip the near-duplicate index, so the encoded forms must not be answered from it either
+    near_duplicate.NEAR_DUPLICATE_ENABLED = False
+    app = import_service_module(args.service, "main").app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            return await run(args, client)
+
+
+async def run_http(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        return await run(args, client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=sorted(ENDPOINTS), required=True)
+    parser.add_argument("--forms", nargs="+", choices=FORMS, default=FORMS)
+    parser.add_argument("--transport", choices=["asgi", "http"], default="asgi")
+    parser.add_argument("--url", help="Base URL of the service for --transport http, e.g. http://localhost:8000.")
+    parser.add_argument("--standin", action="store_true", help="Use tiny random models (asgi transport only).")
+    parser.add_argument("--standin-dir", default=os.path.join(tempfile.gettempdir(), "bench-standins"))
+    parser.add_argument("--count", type=int, default=30, help="Timed requests per form.")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed requests sent first, per form.")
+    parser.add_argument("--image-size", type=parse_size, default=(1280, 720), metavar="WxH")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+    if args.transport == "http" and not args.url:
+        parser.error("--transport http needs --url")
+
+    results = asyncio.run(run_asgi(args) if args.transport == "asgi" else run_http(args))
+
+    print(f"{'form':<6} {'body':>10} {'mean':>10} {'p50':>10} {'p95':>10} "
+          + "".join(f"{stage:>11}" for stage in STAGES) + f" {'errors':>7}")
+    for form, result in results.items():
+        if "latency_ms" not in result:
+            print(f"{form:<6} all {result['errors']} requests failed")
+            continue
+        latency = result["latency_ms"]
+        print(f"{form:<6} {result['body_bytes'] / 1024:>8.0f}KB {latency['mean']:>8.1f}ms {latency['p50']:>8.1f}ms "
+              f"{latency['p95']:>8.1f}ms" + "".join(f"{result[f'{stage}_ms']['mean']:>9.2f}ms" for stage in STAGES)
+              + f" {result['errors']:>7}")
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ("output", "url")}
+        Path(args.output).write_text(json.dumps({"config": config, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+End-to-end load benchmark for the caption and object detection APIs.
+
+Sends synthetic images to POST /caption or /api/object and reports latency
+percentiles, throughput, error counts and server CPU/RSS.
+
+Transports:
+    asgi  - runs the FastAPI app in this process (no network; CPU/RSS are the app's)
+    http  - sends requests to --url (CPU/RSS are scraped from the service's /metrics)
+
+Load models:
+    closed - --concurrency clients each send their next request as soon as the last returns
+    open   - requests arrive at a fixed --rate regardless of completions; latency is
+             measured from the scheduled arrival, so queueing delay is not hidden
+
+With --standin, tiny randomly initialised models replace the real ones
+(see standins.py), so the asgi transport needs no network and no GPU. Every
+request uses a distinct image unless --corpus is set, so the result cache
+only helps when you ask it to.
+
+Usage (from the repository root, with the service's requirements and httpx installed):
+    python benchmarks/bench_services.py --service object --standin --mode open --rate 20 --requests 200
+    python benchmarks/bench_services.py --service caption --transport http --url http://localhost:8000 \\
+        --mode closed --concurrency 8 --requests 500 --output caption.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+from common import ROOT, encode_image, import_service_module, synthetic_images
+
+ENDPOINTS = {"caption": "/caption", "object": "/api/object"}
+FORMATS = {"jpeg": ("JPEG", "image/jpeg", "jpg"), "png": ("PNG", "image/png", "png"), "webp": ("WEBP", "image/webp", "webp")}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def build_corpus(count, size, fmt, seed):
+    """Encodes `count` distinct synthetic images once, up front, so encoding is never timed."""
+    pil_format, _, _ = FORMATS[fmt]
+    return [encode_image(image, pil_format) for image in synthetic_images(count, size=size, seed=seed)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- Resource usage ---
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class LocalUsage:
+    """CPU time and RSS of this process, i.e. of the app under the asgi transport."""
+
+    async def snapshot(self):
+        return {"cpu_seconds": time.process_time(), "rss_bytes": _rss_bytes()}
+
+    @staticmethod
+    def peak_rss_bytes():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # ru_maxrss is KiB on Linux
+
+
+class RemoteUsage:
+    """CPU time and RSS of the remote service, from the standard process metrics on /metrics."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def snapshot(self):
+        try:
+            response = await self.client.get("/metrics")
+            response.raise_for_status()
+        except httpx.HTTPError:
+            return {"cpu_seconds": None, "rss_bytes": None}
+        values = {}
+        for line in response.text.splitlines():
+            name, _, value = line.partition(" ")
+            if name in ("process_cpu_seconds_total", "process_resident_memory_bytes"):
+                values[name] = float(value)
+        return {"cpu_seconds": values.get("process_cpu_seconds_total"),
+                "rss_bytes": values.get("process_resident_memory_bytes")}
+
+    @staticmethod
+    def peak_rss_bytes():
+        return None
+
+
+# --- Load generation ---
+async def send(client, path, image_bytes, fmt, samples, statuses, scheduled=None):
+    _, content_type, extension = FORMATS[fmt]
+    start = time.perf_counter()
+    try:
+        response = await client.post(path, files={"file": (f"bench.{extension}", image_bytes, content_type)})
+        status = response.status_code
+        if status == 200 and response.json().get("error"):
+            status = "error_in_body"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    end = time.perf_counter()
+    statuses[status] += 1
+    samples.append((end - (scheduled if scheduled is not None else start), status))
+
+
+async def closed_loop(client, path, corpus, fmt, requests, concurrency):
+    samples, statuses = [], Counter()
+    counter = iter(range(requests))
+
+    async def user():
+        for index in counter:
+            await send(client, path, corpus[index % len(corpus)], fmt, samples, statuses)
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples, statuses
+
+
+async def open_loop(client, path, corpus, fmt, requests, rate, arrivals, seed):
+    samples, statuses = [], Counter()
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    tasks = []
+    next_arrival = time.perf_counter()
+    for index in range(requests):
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(loop.create_task(send(client, path, corpus[index % len(corpus)], fmt, samples, statuses,
+                                           scheduled=next_arrival)))
+        next_arrival += rng.expovariate(rate) if arrivals == "poisson" else 1.0 / rate
+    await asyncio.gather(*tasks)
+    return samples, statuses
+
+
+def summarize(samples, statuses, wall, usage_before, usage_after, peak_rss):
+    ok = [latency for latency, status in samples if status == 200]
+    summary = {
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+    }
+    if ok:
+        summary["latency_ms"] = {
+            "mean": round(sum(ok) / len(ok) * 1000, 2),
+            "p50": round(percentile(ok, 50) * 1000, 2),
+            "p95": round(percentile(ok, 95) * 1000, 2),
+            "p99": round(percentile(ok, 99) * 1000, 2),
+            "max": round(max(ok) * 1000, 2),
+        }
+    if usage_before["cpu_seconds"] is not None and usage_after["cpu_seconds"] is not None:
+        cpu = usage_after["cpu_seconds"] - usage_before["cpu_seconds"]
+        summary["cpu_seconds"] = round(cpu, 3)
+        summary["cpu_utilization"] = round(cpu / wall, 3) if wall else None # 1.0 = one core busy
+    summary["rss_bytes"] = usage_after["rss_bytes"]
+    if peak_rss:
+        summary["peak_rss_bytes"] = peak_rss
+    return summary
+
+
+async def run_load(client, usage, args, corpus):
+    path = args.path or ENDPOINTS[args.service]
+    if args.warmup:
+        await closed_loop(client, path, corpus, args.format, args.warmup, min(args.warmup, args.concurrency))
+
+    before = await usage.snapshot()
+    start = time.perf_counter()
+    if args.mode == "closed":
+        samples, statuses = await closed_loop(client, path, corpus, args.format, args.requests, args.concurrency)
+    else:
+        samples, statuses = await open_loop(client, path, corpus, args.format, args.requests, args.rate,
+                                            args.arrivals, args.seed)
+    wall = time.perf_counter() - start
+    after = await usage.snapshot()
+    return summarize(samples, statuses, wall, before, after, usage.peak_rss_bytes())
+
+
+async def run_asgi(args, corpus):
+    caption_model = None
+    if args.standin:
+        import standins
+        caption_model = standins.install(args.standin_dir, services=(args.service,))
+    if args.service == "caption" and caption_model:
+        import_service_module("caption", "model_loader").MODEL_NAME = caption_model
+    app = import_service_module(args.service, "main").app
+
+    # ASGITransport doesn't run lifespan events, so load the model and start the pipeline here
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            return await run_load(client, LocalUsage(), args, corpus)
+
+
+async def run_http(args, corpus):
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await run_load(client, RemoteUsage(client), args, corpus)
+
+
+def compare(results, baseline_path):
+    """Prints relative changes against a previous result file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nCompared with {baseline_path}:")
+    for key in ("p50", "p95", "p99"):
+        old, new = baseline.get("latency_ms", {}).get(key), results.get("latency_ms", {}).get(key)
+        if old and new:
+            print(f"  {key:<10} {old:>9.2f}ms -> {new:>9.2f}ms ({(new - old) / old:+.1%})")
+    old, new = baseline.get("throughput_rps"), results.get("throughput_rps")
+    if old and new:
+        print(f"  throughput {old:>9.2f}/s -> {new:>9.2f}/s ({(new - old) / old:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=sorted(ENDPOINTS), required=True)
+    parser.add_argument("--path", help="Endpoint to load instead of the service's single-image endpoint.")
+    parser.add_argument("--transport", choices=["asgi", "http"], default="asgi")
+    parser.add_argument("--url", help="Base URL of the service for --transport http, e.g. http://localhost:8000.")
+    parser.add_argument("--standin", action="store_true", help="Use tiny random models (asgi transport only).")
+    parser.add_argument("--standin-dir", default=os.path.join(tempfile.gettempdir(), "bench-standins"))
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients in closed-loop mode.")
+    parser.add_argument("--rate", type=float, default=10.0, help="Arrivals per second in open-loop mode.")
+    parser.add_argument("--arrivals", choices=["uniform", "poisson"], default="uniform")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests sent first.")
+    parser.add_argument("--corpus", type=int, help="Distinct images to cycle through (default: one per request).")
+    parser.add_argument("--image-size", type=parse_size, default=(640, 480), metavar="WxH")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="jpeg")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    parser.add_argument("--compare", help="Previous --output file to compare against.")
+    args = parser.parse_args()
+    if args.transport == "http" and not args.url:
+        parser.error("--transport http needs --url")
+    if args.transport == "http" and args.standin:
+        parser.error("--standin only applies to the asgi transport; start the service with stand-in models instead")
+
+    corpus = build_corpus(args.corpus or args.requests + args.warmup, args.image_size, args.format, args.seed)
+    runner = run_asgi if args.transport == "asgi" else run_http
+    results = asyncio.run(runner(args, corpus))
+
+    latency = results.get("latency_ms", {})
+    print(f"{args.service} {args.mode}-loop over {args.transport}: {results['succeeded']}/{results['requests']} ok, "
+          f"{results['throughput_rps']} req/s, p50={latency.get('p50')}ms p95={latency.get('p95')}ms "
+          f"p99={latency.get('p99')}ms, cpu={results.get('cpu_utilization')} cores, "
+          f"rss={(results.get('rss_bytes') or 0) / 2**20:.0f}MiB")
+    if results["statuses"].keys() - {"200"}:
+        print(f"statuses: {results['statuses']}")
+    if args.compare:
+        compare(results, args.compare)
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "url")}
+        report = {"git_commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                  "python": sys.version.split()[0], "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                  "config": config, "results": results}
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
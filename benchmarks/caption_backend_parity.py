@@ -0,0 +1,183 @@
+"""
+Checks caption parity and compares latency and memory across caption backends.
+
+Each backend ("torch", "torch-int8", "onnx") is loaded in a fresh process so
+memory numbers are not polluted by the others. "torch" and "torch-int8" are
+the service's backends; "onnx" is ONNX Runtime encoder/decoder graphs with
+KV-cache reuse, exported here (once, into --onnx-dir) because the service
+image can't run it. Captions are compared with
+the fp32 "torch" reference using exact match and corpus BLEU-4; the script
+exits non-zero if any backend falls below --min-bleu or --min-exact-match.
+
+The image set is a fixed, seeded synthetic set by default, so the check runs
+anywhere. Pass --images DIR to use real photos instead.
+
+Usage (from the repository root, with caption/requirements.txt installed;
+the onnx backend also needs optimum-onnx[onnxruntime] with a transformers it
+supports, which the service image doesn't ship):
+    python benchmarks/caption_backend_parity.py --backends torch torch-int8
+    python benchmarks/caption_backend_parity.py --backends torch onnx --onnx-dir /tmp/caption-onnx
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from common import import_service_module, synthetic_images
+
+
+def _load_images(images_dir, count):
+    from PIL import Image
+    if not images_dir:
+        return synthetic_images(count, size=(640, 480), seed=7)
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"))
+    return [Image.open(p).convert("RGB") for p in paths[:count]]
+
+
+def _load_onnx_model(model_name, onnx_dir):
+    """Loads the ONNX Runtime graphs from `onnx_dir`, exporting them on first use."""
+    from optimum.onnxruntime import ORTModelForVision2Seq
+
+    export_dir = os.path.join(onnx_dir, model_name.replace("/", "--"))
+    if os.path.exists(os.path.join(export_dir, "config.json")):
+        return ORTModelForVision2Seq.from_pretrained(export_dir, use_cache=True)
+    # Separate encoder, decoder and decoder-with-past graphs, so generation reuses the KV cache
+    ort_model = ORTModelForVision2Seq.from_pretrained(model_name, export=True, use_cache=True)
+    os.makedirs(onnx_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=onnx_dir)
+    ort_model.save_pretrained(staging_dir)
+    try:
+        os.rename(staging_dir, export_dir)
+    except OSError:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return ort_model
+
+
+def _onnx_captioner(model_loader, onnx_dir):
+    """Returns a generate_captions() equivalent running beam search on the ONNX graphs."""
+    import torch
+    from transformers import AutoTokenizer, ViTImageProcessor
+
+    model = _load_onnx_model(model_loader.MODEL_NAME, onnx_dir)
+    feature_extractor = ViTImageProcessor.from_pretrained(model_loader.MODEL_NAME)
+    tokenizer = AutoTokenizer.from_pretrained(model_loader.MODEL_NAME)
+
+    def generate_captions(images):
+        pixel_values = feature_extractor(images=list(images), return_tensors="pt").pixel_values
+        with torch.inference_mode():
+            output_ids = model.generate(pixel_values, max_length=model_loader.MAX_LENGTH,
+                                        num_beams=model_loader.NUM_BEAMS)
+        return [caption.strip() for caption in tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
+    return generate_captions
+
+
+def _run_backend(backend, images_dir, count, repeats, onnx_dir):
+    """Runs in a child process: loads one backend and captions the image set."""
+    os.environ["CAPTION_BACKEND"] = backend
+    model_loader = import_service_module("caption", "model_loader")
+
+    start = time.perf_counter()
+    if backend == "onnx":
+        generate_captions = _onnx_captioner(model_loader, onnx_dir)
+    else:
+        model_loader.load_model()
+        model_loader.encoder_outputs.max_entries = 0 # Repeats must still pay for the encoder
+        generate_captions = model_loader.generate_captions
+    load_seconds = time.perf_counter() - start
+    rss_after_load = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    images = _load_images(images_dir, count)
+    generate_captions(images[:1]) # Warm-up, not timed
+    captions, latencies = [], []
+    for image in images:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            caption = generate_captions([image])[0]
+            latencies.append(time.perf_counter() - start)
+        captions.append(caption)
+
+    return {
+        "backend": backend,
+        "captions": captions,
+        "load_seconds": round(load_seconds, 2),
+        "mean_latency_ms": round(statistics.fmean(latencies) * 1e3, 1),
+        "p95_latency_ms": round(sorted(latencies)[int(len(latencies) * 0.95) - 1] * 1e3, 1),
+        "max_rss_after_load_mb": round(rss_after_load / 2**20, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def corpus_bleu(references, hypotheses, max_n=4):
+    """Corpus-level BLEU with a single reference per hypothesis."""
+    matches, totals = [0] * max_n, [0] * max_n
+    ref_len = hyp_len = 0
+    for ref, hyp in zip(references, hypotheses):
+        ref_tokens, hyp_tokens = ref.lower().split(), hyp.lower().split()
+        ref_len, hyp_len = ref_len + len(ref_tokens), hyp_len + len(hyp_tokens)
+        for n in range(1, max_n + 1):
+            ref_ngrams = Counter(tuple(ref_tokens[i:i + n]) for i in range(len(ref_tokens) - n + 1))
+            hyp_ngrams = Counter(tuple(hyp_tokens[i:i + n]) for i in range(len(hyp_tokens) - n + 1))
+            matches[n - 1] += sum(min(count, ref_ngrams[gram]) for gram, count in hyp_ngrams.items())
+            totals[n - 1] += max(0, len(hyp_tokens) - n + 1)
+    if hyp_len == 0 or min(matches) == 0:
+        return 0.0
+    log_precision = sum(math.log(m / t) for m, t in zip(matches, totals)) / max_n
+    brevity_penalty = 1.0 if hyp_len > ref_len else math.exp(1 - ref_len / hyp_len)
+    return brevity_penalty * math.exp(log_precision)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8", "onnx"])
+    parser.add_argument("--images", help="Directory of images to use instead of the synthetic set.")
+    parser.add_argument("--count", type=int, default=12, help="Number of images in the set.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per image.")
+    parser.add_argument("--min-bleu", type=float, default=0.6)
+    parser.add_argument("--min-exact-match", type=float, default=0.5)
+    parser.add_argument("--onnx-dir", default=os.path.join(tempfile.gettempdir(), "caption-onnx"),
+                        help="Where the onnx backend's export is kept between runs.")
+    parser.add_argument("--output", help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+
+    backends = ["torch"] + [b for b in args.backends if b != "torch"] # Reference first
+    context = multiprocessing.get_context("spawn")
+    runs = {}
+    for backend in backends:
+        with context.Pool(1) as pool:
+            try:
+                runs[backend] = pool.apply(_run_backend, (backend, args.images, args.count, args.repeats, args.onnx_dir))
+            except Exception as e:
+                print(f"{backend}: failed to run ({e})", file=sys.stderr)
+
+    if "torch" not in runs:
+        sys.exit("The fp32 torch reference backend failed; cannot check parity.")
+    reference = runs["torch"]["captions"]
+    failed = False
+    for backend, run in runs.items():
+        exact = sum(a == b for a, b in zip(reference, run["captions"])) / len(reference)
+        run["exact_match"] = round(exact, 3)
+        run["bleu"] = round(corpus_bleu(reference, run["captions"]), 3)
+        run["passed"] = run["bleu"] >= args.min_bleu and exact >= args.min_exact_match
+        failed |= not run["passed"]
+        print(f"{backend:<11} bleu={run['bleu']:.3f} exact={exact:.2f} "
+              f"latency={run['mean_latency_ms']}ms (p95 {run['p95_latency_ms']}ms) "
+              f"rss={run['max_rss_mb']}MB load={run['load_seconds']}s {'PASS' if run['passed'] else 'FAIL'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(runs, f, indent=2)
+    failed |= len(runs) != len(backends)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Shared helpers for the benchmark scripts in this directory."""
+import importlib
+import os
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_service(service: str):
+    """
+    Imports the package `<service>_app`, i.e. `<service>/app`.
+
+    Both services name their package `app`; their pyproject.toml installs it
+    as `<service>_app`, so a single benchmark process can load either (or
+    both) of them. Needs `pip install -e shared -e caption -e object`.
+    """
+    # Benchmarks measure a ready service, so the lifespan waits for the model (see shared/service_common/startup.py)
+    os.environ.setdefault("STARTUP_BACKGROUND", "false")
+    return importlib.import_module(f"{service}_app")
+
+
+def import_service_module(service: str, module: str):
+    """Imports `<service>/app/<module>.py`, e.g. ("caption", "model_loader")."""
+    load_service(service)
+    return importlib.import_module(f"{service}_app.{module}")
+
+
+def synthetic_images(count: int, size=(640, 480), seed: int = 0) -> list:
+    """Generates deterministic RGB images with a few random shapes on a gradient."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    images = []
+    for _ in range(count):
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = np.broadcast_to(gradient, (height, width, 3)).copy()
+        pixels *= rng.uniform(0.3, 1.0, size=3)
+        for _ in range(rng.integers(2, 6)):
+            x0, y0 = rng.integers(0, width // 2), rng.integers(0, height // 2)
+            x1, y1 = x0 + rng.integers(width // 8, width // 2), y0 + rng.integers(height // 8, height // 2)
+            pixels[y0:y1, x0:x1] = rng.integers(0, 256, size=3)
+        images.append(Image.fromarray(pixels.astype(np.uint8), mode="RGB"))
+    return images
+
+
+def encode_image(image: Image.Image, fmt: str = "JPEG", quality: int = 90) -> bytes:
+    """Encodes a PIL image into bytes in the given format."""
+    buffer = BytesIO()
+    if fmt.upper() in ("JPEG", "WEBP"):
+        image.save(buffer, format=fmt, quality=quality)
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
@@ -0,0 +1,97 @@
+"""
+Tiny randomly initialised stand-ins for the services' models.
+
+They have the same architecture families and interfaces as the real models
+(a ViT+GPT-2 VisionEncoderDecoder and a YOLO11 detector) but are built from
+configs, not downloaded. Benchmarks can then exercise the whole request path
+with no network access and no GPU. Their captions and detections are
+meaningless, so only use them to measure the serving stack, never accuracy.
+"""
+import os
+from pathlib import Path
+
+CAPTION_DIR = "caption"
+OBJECT_FILE = "yolo-standin.pt"
+
+
+def build_caption_standin(path: Path, full_size: bool = False):
+    """
+    Saves a two-layer ViT/GPT-2 captioning model, tokenizer and processor to `path`.
+
+    With `full_size`, the encoder and decoder have the layer count and width of
+    vit-gpt2-image-captioning (~200M parameters), for measuring memory.
+    """
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import (GPT2Config, PreTrainedTokenizerFast, ViTConfig, ViTImageProcessor,
+                              VisionEncoderDecoderConfig, VisionEncoderDecoderModel)
+
+    words = ["<|endoftext|>", "a", "an", "the", "dog", "cat", "man", "woman", "car", "red", "on", "in", "grass", "street"]
+    tokenizer = Tokenizer(models.WordLevel({word: i for i, word in enumerate(words)}, unk_token="<|endoftext|>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<|endoftext|>",
+                                        eos_token="<|endoftext|>", pad_token="<|endoftext|>", unk_token="<|endoftext|>")
+
+    if full_size:
+        encoder = ViTConfig(image_size=224, patch_size=16)
+        decoder = GPT2Config(vocab_size=len(words), bos_token_id=0, eos_token_id=0,
+                             add_cross_attention=True, is_decoder=True)
+    else:
+        encoder = ViTConfig(image_size=224, patch_size=32, hidden_size=64, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=128)
+        decoder = GPT2Config(vocab_size=len(words), n_positions=64, n_embd=64, n_layer=2, n_head=2,
+                             bos_token_id=0, eos_token_id=0, add_cross_attention=True, is_decoder=True)
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder, decoder)
+    config.decoder_start_token_id = config.pad_token_id = config.eos_token_id = 0
+
+    torch.manual_seed(0)
+    model = VisionEncoderDecoderModel(config)
+    model.generation_config.decoder_start_token_id = 0
+    model.generation_config.pad_token_id = 0
+    model.generation_config.eos_token_id = 0
+    # Random weights tend to emit end-of-text at once; make captions run to a realistic length
+    model.generation_config.min_length = 8
+
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    ViTImageProcessor(size={"height": 224, "width": 224}).save_pretrained(path)
+
+
+def build_object_standin(path: Path, full_size: bool = False):
+    """
+    Saves an untrained YOLO11n checkpoint (built from the config bundled with ultralytics) to `path`.
+
+    With `full_size` the checkpoint is a YOLO11m, the size the service deploys.
+    """
+    from ultralytics import YOLO
+
+    YOLO("yolo11m.yaml" if full_size else "yolo11n.yaml").save(str(path))
+
+
+def install(workdir: str, services=("caption", "object"), full_size: bool = False):
+    """
+    Builds the stand-ins under `workdir` (once) and points the services at them.
+
+    Must run before the services' modules are imported, since their model
+    paths and storage locations are read from the environment at import time.
+    Returns the caption model directory to assign to caption's MODEL_NAME.
+    """
+    workdir = Path(workdir) / ("full" if full_size else "")
+    workdir.mkdir(parents=True, exist_ok=True)
+    caption_path = workdir / CAPTION_DIR
+    if "caption" in services and not (caption_path / "config.json").exists():
+        build_caption_standin(caption_path, full_size)
+    object_path = workdir / OBJECT_FILE
+    if "object" in services and not object_path.exists():
+        build_object_standin(object_path, full_size)
+
+    os.environ.setdefault("YOLO_MODEL_PATH", str(object_path))
+    os.environ.setdefault("YOLO_RUNTIME", "pytorch")
+    os.environ.setdefault("YOLO_WARMUP_RUNS", "1")
+    os.environ.setdefault("CAPTION_BACKEND", "torch")
+    os.environ.setdefault("CAPTION_ARTIFACT_DIR", str(workdir / "artifacts"))
+    # Keep job and cache state out of the shared model volume
+    os.environ.setdefault("JOB_WORKERS", "0")
+    os.environ.setdefault("JOB_STORE_PATH", str(workdir / "jobs.sqlite3"))
+    os.environ.setdefault("RESULT_CACHE_SHARED_BACKEND", "none")
+    return str(caption_path)
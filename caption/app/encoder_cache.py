@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Each entry is one image's ViT hidden states: 197 x 768 floats (~0.6 MB) for vit-gpt2-image-captioning
+ENCODER_CACHE_MAX_ENTRIES = int(os.getenv("CAPTION_ENCODER_CACHE_MAX_ENTRIES", "128"))
+
+# --- Metrics ---
+ENCODER_CACHE_HITS = Counter("caption_encoder_cache_hits_total", "Images whose encoder pass was skipped.")
+ENCODER_CACHE_MISSES = Counter("caption_encoder_cache_misses_total", "Images that had to run the encoder.")
+ENCODER_CACHE_ENTRIES = Gauge("caption_encoder_cache_entries", "Encoder outputs held in the cache.")
+
+
+def image_key(image: Image.Image | np.ndarray) -> str:
+    """
+    Hashes a decoded image's pixels; the same upload always decodes to the same pixels.
+
+    A raw (height, width, 3) uint8 array hashes like the RGB image with the same
+    pixels, so raw and encoded uploads of one frame share an entry.
+    """
+    if isinstance(image, np.ndarray):
+        digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16)
+        digest.update(f"RGB:{(image.shape[1], image.shape[0])}".encode())
+    else:
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode}:{image.size}".encode())
+    return digest.hexdigest()
+
+
+class EncoderCache:
+    """
+    Bounded LRU of encoder hidden states by image hash.
+
+    The encoder's output only depends on the image, so a retry, or a request
+    for the same image with another decoding strategy, only pays for decoding.
+    Called from executor threads, so every operation takes a lock.
+    """
+
+    def __init__(self, max_entries: int = ENCODER_CACHE_MAX_ENTRIES):
+        self.max_entries = max(0, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        """Returns the cached hidden states, or None."""
+        with self._lock:
+            hidden = self._entries.get(key)
+            if hidden is not None:
+                self._entries.move_to_end(key)
+        (ENCODER_CACHE_MISSES if hidden is None else ENCODER_CACHE_HITS).inc()
+        return hidden
+
+    def set(self, key: str, hidden):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = hidden
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            ENCODER_CACHE_ENTRIES.set(len(self._entries))
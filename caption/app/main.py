@@ -1,10 +1,22 @@
+import asyncio
+import json
 import logging
-from fastapi import FastAPI, File, UploadFile, HTTPException, status
+from typing import List, Literal
+from fastapi import FastAPI, File, Header, Query, Request, Response, UploadFile, HTTPException, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from contextlib import asynccontextmanager
 from prometheus_fastapi_instrumentator import Instrumentator
 
-from . import model_loader, schemas # Use relative imports within the package
+from service_common import jobs
+from service_common.bulk import BULK_REQUEST_MAX_BYTES
+from service_common.executor import QueueFullError
+from service_common.ingest import NPY_CONTENT_TYPE, RAW_CONTENT_TYPE, RequestSizeLimitMiddleware, UploadTooLargeError
+from service_common.startup import STARTUP_BACKGROUND
+
+from . import model_loader, pipeline, schemas, streaming # Use relative imports within the package
+from .shared import SERVICE, bulk, ingest, instrumentation, startup
 
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -13,18 +25,16 @@ logger = logging.getLogger(__name__)
 # --- Lifespan Management (for loading model on startup) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Load the ML model
+    # Load the ML model in the background, so health checks and metrics are served meanwhile (see service_common/startup.py)
     logger.info("Application startup: Loading ML model...")
-    try:
-        model_loader.load_model()
-        logger.info("ML Model loaded successfully during startup.")
-    except Exception as e:
-        logger.error(f"Fatal Error: Failed to load ML model during startup: {e}", exc_info=True)
-        # Depending on policy, you might want the app to fail startup here
-        # For now, we log the error and continue; endpoints needing the model will fail.
+    startup_task = asyncio.create_task(startup.run(model_loader.load_model, pipeline.start))
+    if not STARTUP_BACKGROUND:
+        await startup_task
     yield
     # Clean up the ML models and release the resources
     logger.info("Application shutdown: Cleaning up resources...")
+    startup_task.cancel()
+    await pipeline.stop()
     # Add any cleanup logic here if needed (e.g., releasing GPU memory explicitly)
 
 API_PREFIX = "/api"
@@ -40,6 +50,13 @@ app = FastAPI(
 )
 
 Instrumentator().instrument(app).expose(app)
+# Routes declared below report per-stage timings (Server-Timing header and caption_stage_seconds)
+app.router.route_class = instrumentation.TimedRoute
+
+# Bounds request bodies before they are parsed; added before CORS so 413 answers carry CORS headers too
+app.add_middleware(RequestSizeLimitMiddleware, ingest=ingest, limits={
+    "/caption/batch": BULK_REQUEST_MAX_BYTES,
+})
 
 app.add_middleware(
     CORSMiddleware,
@@ -50,21 +67,41 @@ app.add_middleware(
 )
 
 # --- API Endpoints ---
+app.get("/debug/profile", response_class=PlainTextResponse, tags=["Debug"])(instrumentation.profile)
+
 @app.get("/health", response_model=schemas.HealthCheckResponse, tags=["Health"])
 async def health_check():
     """Performs a basic health check."""
-    # Could add more checks here (e.g., model loaded status)
-    model_ready = all([model_loader.model, model_loader.feature_extractor, model_loader.tokenizer])
-    status_msg = "ready" if model_ready else "model_loading_failed"
+    # starting, loading and warming_up while the model loads in the background; ready once warm-up has run
+    status_msg = "model_loading_failed" if startup.state == "failed" else startup.state
     logger.info(f"Health check requested. Status: {status_msg}")
     return schemas.HealthCheckResponse(status=status_msg)
 
+@app.get("/health/live", response_model=schemas.HealthCheckResponse, tags=["Health"])
+async def liveness_check():
+    """Liveness probe: answers as soon as the server runs, also while the model loads."""
+    return schemas.HealthCheckResponse(status=startup.state)
+
+@app.get("/health/ready", response_model=schemas.HealthCheckResponse, tags=["Health"],
+         responses={503: {"model": schemas.HealthCheckResponse, "description": "Still loading or warming up, or failed."}})
+async def readiness_check(response: Response):
+    """Readiness probe: 503 until the model is loaded and warmed up, so no traffic arrives before then."""
+    if not startup.is_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return schemas.HealthCheckResponse(status=startup.state)
+
 @app.post("/caption", response_model=schemas.CaptionResponse, tags=["Captioning"])
-async def create_caption(file: UploadFile = File(...)):
+async def create_caption(
+    file: UploadFile = File(...),
+    decoding: Literal["beam", "greedy", "speculative", "early-exit"] = Query(
+        model_loader.DEFAULT_DECODING, description="Decoding strategy; the server may allow only some of them."),
+):
     """
     Uploads an image file and returns a generated caption.
 
     - **file**: The image file to upload (e.g., JPEG, PNG).
+    - **decoding**: `beam` gives the best captions. `greedy` is several times cheaper;
+      `speculative` returns the greedy caption faster; `early-exit` is the fastest and roughest.
     """
     logger.info(f"Received request to caption image: {file.filename}")
     if not file.content_type.startswith("image/"):
@@ -75,19 +112,38 @@ async def create_caption(file: UploadFile = File(...)):
         )
 
     # Ensure model is ready before processing
-    if not all([model_loader.model, model_loader.feature_extractor, model_loader.tokenizer]):
+    if not startup.is_ready():
         logger.error("Caption request failed: Model is not loaded.")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Model is not ready or failed to load. Please try again later.",
         )
+    if decoding not in model_loader.available_decoding():
+        logger.warning(f"Rejecting caption request for {file.filename}: decoding '{decoding}' is not available.")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Decoding '{decoding}' is not available. Use one of {', '.join(model_loader.available_decoding())}.",
+        )
 
     try:
-        image_bytes = await file.read()
+        image_bytes = await ingest.read_upload(file)
         logger.debug(f"Read {len(image_bytes)} bytes from uploaded file.")
-        caption = model_loader.generate_caption(image_bytes)
-        logger.info(f"Successfully generated caption for {file.filename}")
-        return schemas.CaptionResponse(filename=file.filename, caption=caption)
+        caption = await pipeline.caption(image_bytes, decoding=decoding) # Batched with concurrent requests
+        logger.info(f"Successfully generated caption for {file.filename} with {decoding} decoding")
+        return schemas.CaptionResponse(filename=file.filename, caption=caption, decoding=decoding)
+    except UploadTooLargeError as too_large:
+        logger.warning(f"Rejecting caption request for {file.filename}: {too_large}")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(too_large),
+        )
+    except QueueFullError as qf: # Shed load quickly instead of queueing without bound
+        logger.warning(f"Rejecting caption request for {file.filename}: {qf}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Caption queue is full. Please retry later.",
+            headers={"Retry-After": str(qf.retry_after)},
+        )
     except ValueError as ve: # Specific error from our generation function
          logger.error(f"Value error during captioning for {file.filename}: {ve}", exc_info=True)
          return schemas.CaptionResponse(filename=file.filename, caption="", error=f"Caption generation error: {ve}")
@@ -102,6 +158,284 @@ async def create_caption(file: UploadFile = File(...)):
     finally:
          await file.close() # Ensure file handle is closed
 
+@app.post("/caption/raw", response_model=schemas.CaptionResponse, tags=["Captioning"],
+          openapi_extra={"requestBody": {"required": True, "content": {
+              RAW_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+              NPY_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}}}}})
+async def create_caption_raw(
+    request: Request,
+    x_image_shape: str | None = Header(None, description="height,width,3 of an application/octet-stream body."),
+    decoding: Literal["beam", "greedy", "speculative", "early-exit"] = Query(
+        model_loader.DEFAULT_DECODING, description="Decoding strategy; the server may allow only some of them."),
+):
+    """
+    Captions an already-decoded RGB frame, skipping image decoding.
+
+    For internal clients that hold decoded pixels (video pipelines, other
+    models). The body is a uint8 array of shape (height, width, 3), either
+    packed row-major as `application/octet-stream` with an `X-Image-Shape:
+    height,width,3` header, or as a NumPy `.npy` file (`application/x-npy`).
+    The pixels are used in place; a body that doesn't match its shape is
+    rejected with 400.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in (RAW_CONTENT_TYPE, NPY_CONTENT_TYPE):
+        logger.warning(f"Invalid raw content type received: {content_type}")
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Send {RAW_CONTENT_TYPE} with an X-Image-Shape header, or {NPY_CONTENT_TYPE}.",
+        )
+    if not startup.is_ready():
+        logger.error("Raw caption request failed: Model is not loaded.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model is not ready or failed to load. Please try again later.",
+        )
+    if decoding not in model_loader.available_decoding():
+        logger.warning(f"Rejecting raw caption request: decoding '{decoding}' is not available.")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Decoding '{decoding}' is not available. Use one of {', '.join(model_loader.available_decoding())}.",
+        )
+
+    try:
+        body = await ingest.read_raw_body(request)
+        decoded = ingest.decode_raw(body, content_type, x_image_shape)
+    except UploadTooLargeError as too_large:
+        logger.warning(f"Rejecting raw caption request: {too_large}")
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(too_large))
+    except ValueError as ve: # The frame doesn't match its declared shape
+        logger.warning(f"Rejecting raw caption request: {ve}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+
+    try:
+        caption = await pipeline.caption(body, decoding=decoding, decoded=decoded) # Batched with concurrent requests
+        logger.info(f"Successfully generated caption for a raw {decoded.original_size} frame with {decoding} decoding")
+        return schemas.CaptionResponse(filename="raw", caption=caption, decoding=decoding)
+    except QueueFullError as qf: # Shed load quickly instead of queueing without bound
+        logger.warning(f"Rejecting raw caption request: {qf}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Caption queue is full. Please retry later.",
+            headers={"Retry-After": str(qf.retry_after)},
+        )
+    except ValueError as ve: # Specific error from our generation function
+         logger.error(f"Value error during raw captioning: {ve}", exc_info=True)
+         return schemas.CaptionResponse(filename="raw", caption="", error=f"Caption generation error: {ve}")
+    except Exception as e:
+        logger.error(f"Unexpected error during raw captioning: {e}", exc_info=True)
+        return schemas.CaptionResponse(filename="raw", caption="", error="An unexpected error occurred during caption generation.")
+
+@app.post("/caption/batch", tags=["Captioning"],
+          responses={200: {"content": {"application/x-ndjson": {}},
+                           "description": "One BatchCaptionItem JSON object per line, in input order."}})
+async def create_captions_batch(files: List[UploadFile] = File(...)):
+    """
+    Uploads many images, or zip/tar archives of images, and streams back captions as NDJSON.
+
+    - **files**: Image files and/or archives (.zip, .tar, .tar.gz). Archives are read
+      member by member and never extracted to disk.
+
+    Each line carries the image's `index` and `filename`; a failed image gets an
+    `error` and an empty caption without affecting the rest of the batch.
+    """
+    logger.info(f"Received batch caption request with {len(files)} uploaded files.")
+    if not startup.is_ready():
+        logger.error("Batch caption request failed: Model is not loaded.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model is not ready or failed to load. Please try again later.",
+        )
+
+    async def stream_results():
+        processed = 0
+        try:
+            async for index, filename, result in bulk.process_in_order(bulk.iter_uploads(files), bulk.in_bulk_lane(pipeline.caption)):
+                if isinstance(result, UploadTooLargeError):
+                    item = schemas.BatchCaptionItem(index=index, filename=filename, caption="", error=str(result))
+                elif isinstance(result, (ValueError, QueueFullError)):
+                    item = schemas.BatchCaptionItem(index=index, filename=filename, caption="",
+                                                    error=f"Caption generation error: {result}")
+                elif isinstance(result, Exception):
+                    logger.error(f"Unexpected error during batch captioning for {filename}: {result}", exc_info=result)
+                    item = schemas.BatchCaptionItem(index=index, filename=filename, caption="",
+                                                    error="An unexpected error occurred during caption generation.")
+                else:
+                    item = schemas.BatchCaptionItem(index=index, filename=filename, caption=result)
+                processed += 1
+                yield json.dumps(jsonable_encoder(item)) + "\n"
+        except Exception as e: # The status line has already been sent, so report the failure in-band
+            logger.error(f"Batch captioning stopped after {processed} images: {e}", exc_info=True)
+            yield json.dumps({"error": f"Batch stopped after {processed} images: {e}"}) + "\n"
+        finally:
+            for file in files:
+                await file.close()
+        logger.info(f"Finished batch captioning of {processed} images.")
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def _sse_event(event: str, data: dict) -> str:
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# --- Job API ---
+def _job_store() -> jobs.JobStore:
+    if pipeline.job_store is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="The job store is not available.")
+    return pipeline.job_store
+
+def _job_not_found(job_id: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found.")
+
+@app.post("/caption/jobs", response_model=schemas.JobStatus, status_code=status.HTTP_202_ACCEPTED, tags=["Jobs"])
+async def submit_caption_job(request: schemas.JobRequest):
+    """
+    Submits a list of image references for background captioning and returns the job's id.
+
+    - **images**: Paths relative to the job input directory on the shared volume, or http(s) URLs on
+      hosts the service allows (JOB_ALLOW_URLS, JOB_URL_ALLOWED_HOSTS).
+
+    Jobs run in the background at lower priority than single-image requests.
+    With the file job store on the shared volume, any replica answers for a job
+    and a job survives the pod that accepted it; poll `GET /caption/jobs/{job_id}` for progress.
+    """
+    store = _job_store()
+    if not request.images:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A job needs at least one image.")
+    if len(request.images) > jobs.JOB_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Job exceeds the limit of {jobs.JOB_MAX_ITEMS} images.")
+    try:
+        for reference in request.images:
+            jobs.validate_reference(reference)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    job = await asyncio.to_thread(store.create, request.images)
+    jobs.metrics(SERVICE).submitted.inc()
+    logger.info(f"Submitted caption job {job['job_id']} with {len(request.images)} images.")
+    return schemas.JobStatus(**job)
+
+@app.get("/caption/jobs/{job_id}", response_model=schemas.JobStatus, tags=["Jobs"])
+async def get_caption_job(job_id: str,
+                          wait: float = Query(0.0, ge=0.0, le=60.0,
+                                              description="Seconds to wait for progress before answering (long poll).")):
+    """Returns a job's status and progress, optionally waiting until it changes."""
+    job = await jobs.wait_for_change(_job_store(), job_id, wait)
+    if job is None:
+        raise _job_not_found(job_id)
+    return schemas.JobStatus(**job)
+
+@app.get("/caption/jobs/{job_id}/results", response_model=schemas.JobResultsResponse, tags=["Jobs"])
+async def get_caption_job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """Returns a page of per-image results in input order; images not processed yet have status `pending`."""
+    store = _job_store()
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None:
+        raise _job_not_found(job_id)
+    rows = await asyncio.to_thread(store.results, job_id, offset, limit)
+    items = [schemas.JobResultItem(index=row["index"], reference=row["reference"], status=row["status"],
+                                   caption=row["result"], error=row["error"]) for row in rows]
+    next_offset = offset + len(items) if offset + len(items) < job["total"] else None
+    return schemas.JobResultsResponse(job_id=job_id, items=items, next_offset=next_offset)
+
+@app.delete("/caption/jobs/{job_id}", response_model=schemas.JobStatus, tags=["Jobs"])
+async def cancel_caption_job(job_id: str):
+    """Cancels a job that has not finished (409 otherwise); images already processed keep their results."""
+    store = _job_store()
+    if not await asyncio.to_thread(store.cancel, job_id):
+        if await asyncio.to_thread(store.get, job_id) is None:
+            raise _job_not_found(job_id)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job {job_id} has already finished.")
+    logger.info(f"Cancelled caption job {job_id}.")
+    return schemas.JobStatus(**await asyncio.to_thread(store.get, job_id))
+
+@app.post("/caption/stream", tags=["Captioning"],
+          responses={200: {"content": {"text/event-stream": {}},
+                           "description": "`token` events with caption text, then one `done` event (or `error`)."}})
+async def stream_caption(
+    file: UploadFile = File(...),
+    decoding: Literal["greedy", "sample"] = Query(model_loader.STREAM_DECODING,
+                                                  description="Greedy or nucleus-sampling decode."),
+):
+    """
+    Uploads an image file and streams the caption back as Server-Sent Events while it is generated.
+
+    - **file**: The image file to upload (e.g., JPEG, PNG).
+
+    Emits `token` events (`{"text": ...}`) as words are decoded, then a `done`
+    event carrying the same fields as `/caption`. Uses single-sequence decoding,
+    so the caption can differ from the beam-search caption returned by `/caption`.
+    """
+    logger.info(f"Received request to stream caption for image: {file.filename}")
+    if not file.content_type.startswith("image/"):
+        logger.warning(f"Invalid file type received: {file.content_type}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file type. Please upload an image.",
+        )
+    if not startup.is_ready():
+        logger.error("Caption stream request failed: Model is not loaded.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model is not ready or failed to load. Please try again later.",
+        )
+
+    try:
+        image_bytes = await ingest.read_upload(file)
+    except UploadTooLargeError as too_large:
+        logger.warning(f"Rejecting caption stream for {file.filename}: {too_large}")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(too_large),
+        )
+    finally:
+        await file.close()
+
+    chunks = streaming.stream_caption(image_bytes, decoding)
+    try:
+        first_chunk = await anext(chunks, None) # Surfaces a full queue as 429 before the stream starts
+    except QueueFullError as qf:
+        logger.warning(f"Rejecting caption stream for {file.filename}: {qf}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Caption queue is full. Please retry later.",
+            headers={"Retry-After": str(qf.retry_after)},
+        )
+    except ValueError as ve: # The upload could not be decoded or validated
+        logger.warning(f"Rejecting caption stream for {file.filename}: {ve}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid image: {ve}")
+    except Exception as e: # The model or the executor failed, not the request
+        logger.error(f"Error before the caption stream started for {file.filename}: {e}", exc_info=True)
+        if not startup.is_ready() or model_loader.model is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Model is not ready or failed to load. Please try again later.",
+            )
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Caption generation error: {e}")
+
+    async def events():
+        parts = []
+        try:
+            if first_chunk is not None:
+                parts.append(first_chunk)
+                yield _sse_event("token", {"text": first_chunk})
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield _sse_event("token", {"text": chunk})
+            caption = "".join(parts).strip()
+            logger.info(f"Successfully streamed caption for {file.filename}")
+            done = schemas.CaptionResponse(filename=file.filename, caption=caption, decoding=decoding)
+            yield _sse_event("done", jsonable_encoder(done))
+        except Exception as e: # The status line has already been sent, so report the failure in-band
+            logger.error(f"Error during caption streaming for {file.filename}: {e}", exc_info=True)
+            yield _sse_event("error", {"error": f"Caption generation error: {e}"})
+        finally:
+            await chunks.aclose() # Stops generation if the client disconnected mid-stream
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- Add more endpoints as needed (e.g., model info, batch processing) ---
 
 # To run locally (for development): uvicorn backend.app.main:app --reload --port 8000
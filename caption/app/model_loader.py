@@ -1,8 +1,25 @@
+import copy
+import fcntl
+import glob
+import importlib.metadata
 import logging
+import os
+import shutil
+import tempfile
 from io import BytesIO
 from PIL import Image
-from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
-import torch # Or tensorflow as tf
+
+from service_common import near_duplicate
+from service_common.ingest import DecodedImage
+
+from . import encoder_cache
+from .shared import ingest, instrumentation, startup
+
+# torch and transformers take several seconds to import, so import_runtime() imports them
+# when the model loads instead of when the app starts (see service_common/startup.py)
+torch = None # Or tensorflow as tf
+VisionEncoderDecoderModel = ViTImageProcessor = AutoTokenizer = AutoConfig = GenerationConfig = StoppingCriteriaList = None
+BaseModelOutput = Conv1D = cached_file = extract_commit_hash = None
 
 logger = logging.getLogger(__name__)
 
@@ -10,70 +27,431 @@ logger = logging.getLogger(__name__)
 # Choose a pre-trained model from Hugging Face Hub
 # Example: "nlpconnect/vit-gpt2-image-captioning"
 MODEL_NAME = "nlpconnect/vit-gpt2-image-captioning"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-# If using TF: DEVICE = "/GPU:0" if tf.config.list_physical_devices('GPU') else "/CPU:0"
+MODEL_REVISION = os.getenv("CAPTION_MODEL_REVISION", "main") # Hub branch, tag or commit
+DEVICE = None # "cuda" or "cpu", set by import_runtime()
+MAX_LENGTH = 32 # Maximum caption length in tokens
+NUM_BEAMS = int(os.getenv("CAPTION_NUM_BEAMS", "4")) # Beam width of the "beam" strategy
+INPUT_SIZE = 224 # ViT input resolution, so uploads are decoded no larger than needed
+# Streamed captions emit tokens as they are decoded, so they use single-sequence decoding instead of beams
+STREAM_DECODING_MODES = ("greedy", "sample")
+STREAM_DECODING = os.getenv("CAPTION_STREAM_DECODING", "greedy").lower()
+SAMPLING_TOP_P = float(os.getenv("CAPTION_SAMPLING_TOP_P", "0.9"))
+SAMPLING_TEMPERATURE = float(os.getenv("CAPTION_SAMPLING_TEMPERATURE", "0.7"))
+# Decoding strategies for /caption, chosen per request from CAPTION_DECODING_STRATEGIES:
+#   "beam"        - beam search with NUM_BEAMS beams (default; best captions, ~NUM_BEAMS x the decoder cost)
+#   "greedy"      - one sequence, most likely token at each step
+#   "speculative" - same caption as greedy; a draft made of the first DRAFT_LAYERS decoder layers
+#                   proposes tokens and the full decoder checks them all in one pass
+#   "early-exit"  - greedy with only the draft layers; fastest, captions drift from the full model's
+DECODING_STRATEGIES = ("beam", "greedy", "speculative", "early-exit")
+DRAFT_STRATEGIES = ("speculative", "early-exit") # Need the draft decoder (CAPTION_DECODING_STRATEGIES)
+DEFAULT_DECODING = os.getenv("CAPTION_DECODING", "beam").lower()
+ALLOWED_DECODING = tuple(name.strip() for name in os.getenv("CAPTION_DECODING_STRATEGIES",
+                                                            ",".join(DECODING_STRATEGIES)).lower().split(",") if name.strip())
+DRAFT_LAYERS = int(os.getenv("CAPTION_DRAFT_LAYERS", "4")) # Of GPT-2's 12
+SPECULATIVE_TOKENS = int(os.getenv("CAPTION_SPECULATIVE_TOKENS", "5")) # Draft tokens proposed per verification pass
+# Inference backend, read when load_model() runs:
+#   "torch"      - fp32 PyTorch (default)
+#   "torch-int8" - PyTorch with dynamic int8 quantization of all linear layers (CPU only)
+# ONNX Runtime is not a serving backend: optimum-onnx needs an older transformers than the image
+# ships. benchmarks/caption_backend_parity.py exports and checks it (see requirements.txt).
+BACKENDS = ("torch", "torch-int8")
+DEFAULT_BACKEND = "torch"
+# Torch backends load the model, processor and tokenizer from a directory here, saved by the first pod
+# to start and keyed by model, resolved revision, backend and library versions; empty always loads
+# with from_pretrained. Weights are safetensors (torch) or a tensor-only state dict (torch-int8).
+ARTIFACT_DIR = os.getenv("CAPTION_ARTIFACT_DIR", "/model-cache/caption/artifacts")
+QUANTIZED_WEIGHTS = "quantized_state_dict.pt"
+WARMUP_RUNS = int(os.getenv("CAPTION_WARMUP_RUNS", "1")) # Per decoding strategy, before the service reports ready
+
+for _name in ALLOWED_DECODING + (DEFAULT_DECODING,):
+    if _name not in DECODING_STRATEGIES:
+        raise ValueError(f"Unknown caption decoding strategy '{_name}'. Use one of {', '.join(DECODING_STRATEGIES)}.")
+if DEFAULT_DECODING not in ALLOWED_DECODING:
+    raise ValueError(f"CAPTION_DECODING '{DEFAULT_DECODING}' is not in CAPTION_DECODING_STRATEGIES.")
 
 # --- Global Variables ---
 model = None
 feature_extractor = None
 tokenizer = None
+backend = None # Backend the current model was loaded with
+draft_model = None # Shallow decoder sharing the model's first DRAFT_LAYERS layers
+encoder_outputs = encoder_cache.EncoderCache() # ViT hidden states of recent images
+ready = False # True once warm-up captions have completed
 
 # --- Initialization ---
-def load_model():
-    """Loads the pre-trained image captioning model, processor, and tokenizer."""
-    global model, feature_extractor, tokenizer
+def import_runtime():
+    """Imports torch and transformers and picks the device; the first call takes several seconds."""
+    global torch, DEVICE, VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer, AutoConfig, GenerationConfig
+    global StoppingCriteriaList, BaseModelOutput, Conv1D, cached_file, extract_commit_hash
+    if torch is not None:
+        return
+    with startup.phase("import"):
+        import torch
+        from transformers import (AutoConfig, AutoTokenizer, GenerationConfig, StoppingCriteriaList,
+                                  VisionEncoderDecoderModel, ViTImageProcessor)
+        from transformers.modeling_outputs import BaseModelOutput
+        from transformers.pytorch_utils import Conv1D
+        from transformers.utils import cached_file
+        from transformers.utils.hub import extract_commit_hash
+    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    # If using TF: DEVICE = "/GPU:0" if tf.config.list_physical_devices('GPU') else "/CPU:0"
+
+def _conv1d_to_linear(module: "torch.nn.Module"):
+    """Replaces GPT-2 style Conv1D layers with equivalent nn.Linear layers so they can be quantized."""
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+class _TakesEncoderOutputs:
+    """Lets a decoder-only model accept `encoder_outputs`, which generate() hands to assistant models."""
+
+    def forward(self, *args, encoder_outputs=None, **kwargs):
+        if encoder_outputs is not None:
+            hidden = encoder_outputs[0]
+            projection = getattr(self, "encoder_projection", None) # Set when encoder and decoder widths differ
+            kwargs["encoder_hidden_states"] = hidden if projection is None else projection(hidden)
+        return super().forward(*args, **kwargs)
+
+def _build_draft_model(full_model, layers: int):
+    """
+    Returns a decoder made of the first `layers` blocks of the model's GPT-2 decoder.
+
+    The draft shares the full decoder's modules (embeddings, blocks, final norm
+    and LM head), so it costs no extra memory and works with torch-int8 too.
+    """
+    decoder = full_model.decoder
+    transformer = getattr(decoder, "transformer", None)
+    if transformer is None or not hasattr(transformer, "h"):
+        raise RuntimeError(f"Draft decoding needs a GPT-2 style decoder, not {type(decoder).__name__}.")
+    layers = max(1, min(layers, len(transformer.h)))
+    config = copy.deepcopy(decoder.config)
+    config.n_layer = layers
+    draft_class = type(f"Draft{type(decoder).__name__}", (_TakesEncoderOutputs, type(decoder)), {})
+    with torch.device("meta"): # Every module is replaced below, so allocate nothing
+        draft = draft_class(config)
+    draft.transformer.wte = transformer.wte
+    draft.transformer.wpe = transformer.wpe
+    draft.transformer.h = torch.nn.ModuleList(transformer.h[:layers])
+    draft.transformer.ln_f = transformer.ln_f
+    draft.lm_head = decoder.lm_head
+    if getattr(full_model, "enc_to_dec_proj", None) is not None:
+        draft.encoder_projection = full_model.enc_to_dec_proj
+    draft.generation_config = copy.deepcopy(full_model.generation_config)
+    draft.generation_config.num_assistant_tokens = SPECULATIVE_TOKENS
+    return draft.eval()
+
+def _quantize(torch_model):
+    """Dynamic int8 quantization of all linear layers (CPU only)."""
+    if DEVICE != "cpu":
+        raise RuntimeError("The torch-int8 backend only supports CPU inference.")
+    _conv1d_to_linear(torch_model.decoder)
+    return torch.ao.quantization.quantize_dynamic(torch_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def _load_torch_model(quantize: bool):
+    """Loads the PyTorch model, optionally with dynamic int8 quantization."""
+    torch_model = VisionEncoderDecoderModel.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    if quantize:
+        torch_model = _quantize(torch_model)
+    return torch_model.to(DEVICE).eval()
+
+def _quantized_skeleton(config):
+    """An int8 model shaped like _quantize()'s output, without initialising or quantizing any weights."""
+    with torch.device("meta"): # Every tensor is assigned from the artifact's state dict
+        skeleton = VisionEncoderDecoderModel(config)
+        _conv1d_to_linear(skeleton.decoder)
+
+    def swap_linear(module):
+        for name, child in module.named_children():
+            if type(child) is torch.nn.Linear:
+                setattr(module, name, torch.ao.nn.quantized.dynamic.Linear(
+                    child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8))
+            else:
+                swap_linear(child)
+    swap_linear(skeleton)
+    return skeleton
+
+def _artifact_name(backend_name: str, revision: str) -> str:
+    """Artifact directory name; keyed by library versions too, since serialized modules may not survive upgrades."""
+    versions = "-".join(f"{lib}{importlib.metadata.version(lib)}" for lib in ("torch", "transformers"))
+    return f"{MODEL_NAME.replace('/', '--')}--{revision}--{backend_name}--{versions}"
+
+def _resolved_revision() -> str:
+    """The commit MODEL_REVISION resolves to, or for a local model directory, when its files last changed."""
+    config_path = cached_file(MODEL_NAME, "config.json", revision=MODEL_REVISION)
+    commit = extract_commit_hash(config_path, None)
+    if commit is None:
+        directory = os.path.dirname(config_path)
+        commit = f"local{max(os.path.getmtime(os.path.join(directory, name)) for name in os.listdir(directory)):.0f}"
+    return commit
+
+def _save_torch_artifact(artifact: str, torch_model, feature_extractor, tokenizer, quantize: bool):
+    """Writes the artifact directory: config, processor and tokenizer files plus the weights."""
+    staging = tempfile.mkdtemp(dir=ARTIFACT_DIR, suffix=".tmp")
     try:
-        logger.info(f"Loading model '{MODEL_NAME}' onto device '{DEVICE}'...")
-        model = VisionEncoderDecoderModel.from_pretrained(MODEL_NAME).to(DEVICE)
-        feature_extractor = ViTImageProcessor.from_pretrained(MODEL_NAME)
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        feature_extractor.save_pretrained(staging)
+        tokenizer.save_pretrained(staging)
+        if quantize: # Quantized tensors have no safetensors dtype, so save a plain state dict
+            torch_model.config.save_pretrained(staging)
+            torch_model.generation_config.save_pretrained(staging)
+            torch.save(torch_model.state_dict(), os.path.join(staging, QUANTIZED_WEIGHTS))
+        else:
+            torch_model.save_pretrained(staging, safe_serialization=True)
+        # mkdtemp (and safetensors) create them private; pods may run as other users
+        os.chmod(staging, 0o755)
+        for name in os.listdir(staging):
+            os.chmod(os.path.join(staging, name), 0o644)
+        os.rename(staging, artifact) # Atomic, so other pods never see a half-written artifact
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+def _load_torch_artifact(backend_name: str) -> tuple:
+    """
+    Returns (model, feature_extractor, tokenizer) for a torch backend, from its artifact when there is one.
+
+    The artifact skips Hugging Face Hub lookups and, for torch-int8,
+    quantization: the int8 weights are loaded into an uninitialised model.
+    Weights are memory-mapped, so they are read on first use, by the warm-up.
+    Only tensors are deserialized (safetensors, or torch.load with
+    weights_only=True), so a tampered artifact can't run code.
+    """
+    quantize = backend_name == "torch-int8"
+    if not ARTIFACT_DIR:
+        return (_load_torch_model(quantize), ViTImageProcessor.from_pretrained(MODEL_NAME, revision=MODEL_REVISION),
+                AutoTokenizer.from_pretrained(MODEL_NAME, revision=MODEL_REVISION))
+    artifact = os.path.join(ARTIFACT_DIR, _artifact_name(backend_name, _resolved_revision()))
+    if os.path.isdir(artifact):
+        logger.info(f"Loading the {backend_name} model from its artifact {artifact}...")
+        if quantize:
+            torch_model = _quantized_skeleton(AutoConfig.from_pretrained(artifact))
+            state = torch.load(os.path.join(artifact, QUANTIZED_WEIGHTS), mmap=True, weights_only=True)
+            torch_model.load_state_dict(state, assign=True)
+            torch_model.generation_config = GenerationConfig.from_pretrained(artifact)
+        else:
+            torch_model = VisionEncoderDecoderModel.from_pretrained(artifact)
+        return (torch_model.to(DEVICE).eval(), ViTImageProcessor.from_pretrained(artifact),
+                AutoTokenizer.from_pretrained(artifact))
+
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    # Serialize the first load across pods sharing the volume
+    with open(f"{artifact}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.isdir(artifact):
+            return _load_torch_artifact(backend_name)
+        torch_model = _load_torch_model(quantize)
+        feature_extractor = ViTImageProcessor.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+        logger.info(f"Saving the {backend_name} model as {artifact} for the next pods (one-off)...")
+        _save_torch_artifact(artifact, torch_model.cpu(), feature_extractor, tokenizer, quantize)
+    return torch_model.to(DEVICE).eval(), feature_extractor, tokenizer
+
+def _warm_up():
+    """Runs throwaway captions with every available strategy, so one-off initialisation happens before serving."""
+    blank = Image.new("RGB", (INPUT_SIZE, INPUT_SIZE))
+    for decoding in available_decoding():
+        for _ in range(WARMUP_RUNS):
+            generate_captions([blank], decoding)
+    logger.info(f"Warm-up complete ({WARMUP_RUNS} runs of {', '.join(available_decoding())}).")
+
+def _warm_up_once():
+    global ready
+    with startup.phase("warmup", next_state="warming_up"):
+        _warm_up()
+    ready = True
+
+def load_model(warm_up: bool = True):
+    """
+    Loads the pre-trained image captioning model, processor, and tokenizer, and warms them up.
+
+    serve.py's master process passes `warm_up=False`: it loads with one
+    intra-op thread and runs no inference, so no thread pool exists when the
+    workers are forked. Each worker's own load_model() call then only warms up.
+    """
+    global model, feature_extractor, tokenizer, backend, draft_model, ready
+    if all([model, feature_extractor, tokenizer]):
+        if warm_up and not ready:
+            _warm_up_once()
+        logger.info("Caption model already loaded.")
+        return
+    requested_backend = os.getenv("CAPTION_BACKEND", DEFAULT_BACKEND).lower()
+    try:
+        if requested_backend not in BACKENDS:
+            raise ValueError(f"Unknown CAPTION_BACKEND '{requested_backend}'. Choose one of {', '.join(BACKENDS)}.")
+        if ARTIFACT_DIR:
+            # Read from the volume while torch imports; the revision isn't resolved yet, so take any
+            artifacts = glob.glob(os.path.join(ARTIFACT_DIR, _artifact_name(requested_backend, "*")))
+            if artifacts:
+                startup.prefetch(artifacts)
+        import_runtime()
+        if not warm_up:
+            torch.set_num_threads(1)
+        logger.info(f"Loading model '{MODEL_NAME}' with backend '{requested_backend}' onto device '{DEVICE}'...")
+        with startup.phase("load"):
+            model, feature_extractor, tokenizer = _load_torch_artifact(requested_backend)
+            if set(ALLOWED_DECODING) & set(DRAFT_STRATEGIES):
+                draft_model = _build_draft_model(model, DRAFT_LAYERS)
+        backend = requested_backend
+        instrumentation.set_model_labels(MODEL_NAME, backend)
         logger.info("Model loaded successfully.")
+        if warm_up:
+            _warm_up_once()
     except Exception as e:
         logger.error(f"Error loading model: {e}", exc_info=True)
+        model = None # Reset on failure
+        ready = False
         # Depending on requirements, you might want to raise the exception
         # or handle it gracefully (e.g., disable the captioning endpoint)
         raise RuntimeError(f"Failed to load ML model: {e}")
 
+def available_decoding() -> tuple:
+    """The allowed decoding strategies the loaded backend supports."""
+    return tuple(name for name in ALLOWED_DECODING if draft_model is not None or name not in DRAFT_STRATEGIES)
+
+def inference_params(decoding: str = DEFAULT_DECODING) -> dict:
+    """Returns the model settings that affect generated captions (used in cache keys)."""
+    params = {"model": MODEL_NAME, "backend": backend, "max_length": MAX_LENGTH, "decoding": decoding}
+    if decoding == "beam":
+        params["num_beams"] = NUM_BEAMS
+    elif decoding == "early-exit": # Speculative decoding gives the greedy caption whatever the draft
+        params["draft_layers"] = DRAFT_LAYERS
+    return params
+
 # --- Inference ---
-def generate_caption(image_bytes: bytes) -> str:
-    """Generates a caption for the given image bytes."""
+def decode_image(image_bytes: bytes) -> DecodedImage:
+    """Decodes image bytes into an RGB image near the ViT input resolution."""
+    logger.debug("Opening image from bytes.")
+    return ingest.decode_image(image_bytes, target_size=INPUT_SIZE)
+
+def decode_and_hash(image_bytes: bytes) -> tuple:
+    """Decodes image bytes and computes the (dhash, thumbnail) fingerprint used for near-duplicate lookup."""
+    decoded = decode_image(image_bytes)
+    return decoded, near_duplicate.fingerprint(decoded.image)
+
+def _search_kwargs(decoding: str) -> dict:
+    if decoding == "beam":
+        return {"num_beams": NUM_BEAMS}
+    return {"num_beams": 1, "do_sample": False}
+
+def _encoder_hidden_states(images: list) -> "torch.Tensor":
+    """Returns the stacked ViT hidden states of the images, running the encoder only for those not cached."""
+    with instrumentation.stage("preprocess"):
+        keys = [encoder_cache.image_key(image) for image in images]
+        hidden = [encoder_outputs.get(key) for key in keys]
+        missing = [i for i, states in enumerate(hidden) if states is None]
+        if missing:
+            pixel_values = feature_extractor(images=[images[i] for i in missing],
+                                             return_tensors="pt").pixel_values.to(DEVICE)
+    if missing:
+        with instrumentation.stage("encode"), torch.inference_mode():
+            encoded = model.encoder(pixel_values=pixel_values).last_hidden_state
+        for i, states in zip(missing, encoded):
+            hidden[i] = states.clone() # A copy, so the cache doesn't keep the whole batch's tensor alive
+            encoder_outputs.set(keys[i], hidden[i])
+    return torch.stack(hidden)
+
+def _generate(hidden: "torch.Tensor", decoding: str) -> list:
+    """Decodes token ids for each image from its encoder hidden states."""
+    outputs = BaseModelOutput(last_hidden_state=hidden)
+    if decoding in ("beam", "greedy"):
+        return model.generate(encoder_outputs=outputs, max_length=MAX_LENGTH, **_search_kwargs(decoding))
+    if decoding == "early-exit":
+        start = torch.full((len(hidden), 1), model.config.decoder_start_token_id, dtype=torch.long, device=DEVICE)
+        # The start token doubles as the pad token, so the mask can't be inferred from the ids
+        return draft_model.generate(start, attention_mask=torch.ones_like(start), encoder_outputs=outputs,
+                                    max_length=MAX_LENGTH, num_beams=1, do_sample=False)
+    # Assisted generation verifies one sequence at a time; the batch still shares the encoder pass
+    return [model.generate(encoder_outputs=BaseModelOutput(last_hidden_state=states[None]), assistant_model=draft_model,
+                           max_length=MAX_LENGTH, num_beams=1, do_sample=False)[0] for states in hidden]
+
+def generate_captions(images: list, decoding: str = DEFAULT_DECODING) -> list:
+    """
+    Generates captions for a batch of decoded images with the given decoding strategy.
+
+    Returns one caption per input image, in input order.
+    """
     global model, feature_extractor, tokenizer
 
     if not all([model, feature_extractor, tokenizer]):
         raise RuntimeError("Model is not loaded. Cannot generate caption.")
+    if decoding not in available_decoding():
+        raise ValueError(f"Decoding '{decoding}' is not available. Use one of {', '.join(available_decoding())}.")
+    if not images:
+        return []
 
     try:
-        logger.debug("Opening image from bytes.")
-        img = Image.open(BytesIO(image_bytes))
-        if img.mode != "RGB":
-            img = img.convert(mode="RGB")
-        logger.debug("Image opened successfully.")
-
         # --- PyTorch Inference ---
-        logger.debug("Processing image and generating features...")
-        pixel_values = feature_extractor(images=[img], return_tensors="pt").pixel_values.to(DEVICE)
-        logger.debug("Generating caption...")
-        # Adjust generation parameters as needed (max_length, num_beams, etc.)
-        output_ids = model.generate(pixel_values, max_length=32, num_beams=4) # Example parameters
-        logger.debug("Decoding caption...")
-        caption = tokenizer.decode(output_ids[0], skip_special_tokens=True).strip()
-        logger.info(f"Generated caption: {caption}")
-        return caption
+        hidden = _encoder_hidden_states(list(images))
+        with instrumentation.stage("inference"), torch.inference_mode():
+            output_ids = _generate(hidden, decoding)
+        with instrumentation.stage("postprocess"):
+            captions = [caption.strip() for caption in tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
+        instrumentation.trace(logger, "batch_done",
+                              lambda: f"Generated {len(captions)} captions in one {decoding} batch: {captions}")
+        return captions
 
         # --- TensorFlow Inference (Alternative) ---
-        # logger.debug("Processing image and generating features...")
-        # pixel_values = feature_extractor(images=[img], return_tensors="tf").pixel_values
-        # logger.debug("Generating caption...")
+        # logger.debug("Processing images and generating features...")
+        # pixel_values = feature_extractor(images=list(images), return_tensors="tf").pixel_values
+        # logger.debug("Generating captions...")
         # with tf.device(DEVICE):
-        #     output_ids = model.generate(pixel_values, max_length=32, num_beams=4) # Example parameters
-        # logger.debug("Decoding caption...")
-        # caption = tokenizer.decode(output_ids[0], skip_special_tokens=True).strip()
-        # logger.info(f"Generated caption: {caption}")
-        # return caption
+        #     output_ids = model.generate(pixel_values, max_length=MAX_LENGTH, num_beams=NUM_BEAMS)
+        # logger.debug("Decoding captions...")
+        # captions = [c.strip() for c in tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
+        # return captions
 
     except Exception as e:
         logger.error(f"Error during caption generation: {e}", exc_info=True)
         # Re-raise or return an error indicator
         raise ValueError(f"Caption generation failed: {e}")
 
+class _StopWhenSet:
+    """Stops generation once the given event is set (e.g. the client went away); a transformers StoppingCriteria."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+def generate_caption_streamed(image, streamer=None, decoding: str = STREAM_DECODING, stop_event=None) -> str:
+    """
+    Generates a caption for one decoded image with greedy or sampling decode.
+
+    Tokens are pushed to `streamer` (a transformers streamer) as they are
+    produced; setting `stop_event` ends generation early. Returns the full caption.
+    """
+    if not all([model, feature_extractor, tokenizer]):
+        raise RuntimeError("Model is not loaded. Cannot generate caption.")
+    if decoding not in STREAM_DECODING_MODES:
+        raise ValueError(f"Unknown decoding '{decoding}'. Use one of {', '.join(STREAM_DECODING_MODES)}.")
+
+    try:
+        generate_kwargs = {"max_length": MAX_LENGTH, "num_beams": 1, "streamer": streamer}
+        if decoding == "sample":
+            generate_kwargs.update(do_sample=True, top_p=SAMPLING_TOP_P, temperature=SAMPLING_TEMPERATURE)
+        else:
+            generate_kwargs.update(do_sample=False)
+        if stop_event is not None:
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList([_StopWhenSet(stop_event)])
+        generate_kwargs["encoder_outputs"] = BaseModelOutput(last_hidden_state=_encoder_hidden_states([image]))
+        with instrumentation.stage("inference"), torch.inference_mode():
+            output_ids = model.generate(**generate_kwargs)
+        return tokenizer.decode(output_ids[0], skip_special_tokens=True).strip()
+    except Exception as e:
+        logger.error(f"Error during streamed caption generation: {e}", exc_info=True)
+        raise RuntimeError(f"Caption generation failed: {e}") # A model failure, not a bad request
+
+def generate_caption(image_bytes: bytes, decoding: str = DEFAULT_DECODING) -> str:
+    """Generates a caption for the given image bytes."""
+    caption = generate_captions([decode_image(image_bytes).image], decoding)[0]
+    instrumentation.trace(logger, "caption", lambda: f"Generated caption: {caption}")
+    return caption
+
 # --- Call load_model on application startup (handled in main.py) ---
\ No newline at end of file
@@ -0,0 +1,104 @@
+import functools
+import json
+import logging
+
+from service_common import batching, cache, jobs, near_duplicate
+from service_common.executor import INTERACTIVE
+
+from . import model_loader
+from .shared import SERVICE, bulk, inference_executor
+
+logger = logging.getLogger(__name__)
+
+# --- Batching ---
+# Concurrent caption requests with the same decoding strategy are stacked into one batch
+caption_batchers = {
+    decoding: batching.MicroBatcher(functools.partial(model_loader.generate_captions, decoding=decoding),
+                                    name="caption" if decoding == model_loader.DEFAULT_DECODING else f"caption-{decoding}",
+                                    executor=inference_executor)
+    for decoding in model_loader.ALLOWED_DECODING
+}
+caption_batcher = caption_batchers[model_loader.DEFAULT_DECODING]
+
+# --- Result Cache ---
+# Repeated uploads of the same image skip decoding entirely
+result_cache = cache.ResultCache(SERVICE, cache.LRUCache(SERVICE), cache.create_shared_backend(SERVICE))
+
+# --- Near-Duplicate Index ---
+# Re-encoded, resized or EXIF-stripped copies of an image reuse its caption
+near_duplicates = near_duplicate.NearDuplicateIndex(SERVICE)
+
+# --- Background Jobs ---
+# Jobs submitted through the job API run in the executor's bulk lane
+job_store = jobs.create_job_store(SERVICE)
+job_runner = None
+
+async def start():
+    """Starts the inference executor, batching task and job workers (call after the model is loaded)."""
+    global job_runner
+    inference_executor.start(initializer=model_loader.load_model)
+    for batcher in caption_batchers.values():
+        await batcher.start()
+    if job_store is not None and model_loader.model:
+        job_runner = jobs.JobRunner(job_store, caption, bulk)
+        await job_runner.start()
+
+async def stop():
+    """Stops job workers and batching, failing any requests still waiting, then the executor."""
+    if job_runner is not None:
+        await job_runner.stop()
+    for batcher in caption_batchers.values():
+        await batcher.stop()
+    inference_executor.shutdown()
+
+async def caption(image_bytes: bytes, lane: str = INTERACTIVE, decoding: str = model_loader.DEFAULT_DECODING,
+                  decoded=None) -> str:
+    """
+    Returns the caption for the image, from the result cache when possible.
+
+    Batch and background-job callers pass `lane=BULK` so they never delay
+    interactive requests. `decoding` is one of model_loader.available_decoding().
+    Pass `decoded` (an ingest.DecodedImage from ingest.decode_raw) when
+    `image_bytes` is an already-decoded frame; it goes straight to the
+    batcher, skipping decoding and the near-duplicate index.
+    """
+    params = model_loader.inference_params(decoding)
+    if decoded is not None: # Equal bytes are only the same frame if the shape is the same too
+        params = {**params, "shape": list(decoded.image.shape)}
+        compute = lambda: caption_batchers[decoding].submit(decoded.image, lane)
+    else:
+        compute = lambda: _caption_uncached(image_bytes, lane, decoding)
+    return await result_cache.get_or_compute(cache.make_key(image_bytes, params), compute)
+
+async def caption_decoded(image_bytes: bytes, decode) -> str:
+    """
+    Like caption(), but on a cache miss awaits `decode()` for the image instead of decoding it here.
+
+    Lets a caller that runs several models on one upload decode it only once;
+    `decode()` must return an object with an RGB PIL `image`.
+    """
+    key = cache.make_key(image_bytes, model_loader.inference_params())
+    return await result_cache.get_or_compute(key, lambda: _caption_decoded_lazily(decode))
+
+async def _caption_decoded_lazily(decode) -> str:
+    return await caption_batcher.submit((await decode()).image)
+
+async def _caption_uncached(image_bytes: bytes, lane: str, decoding: str) -> str:
+    """Decodes the image on the inference executor and queues it for batched captioning."""
+    batcher = caption_batchers[decoding]
+    if not near_duplicate.NEAR_DUPLICATE_ENABLED:
+        decoded = await inference_executor.run(model_loader.decode_image, image_bytes, lane=lane)
+        return await batcher.submit(decoded.image, lane)
+
+    decoded, (image_hash, image_thumbnail) = await inference_executor.run(model_loader.decode_and_hash, image_bytes, lane=lane)
+    namespace = json.dumps(model_loader.inference_params(decoding), sort_keys=True)
+
+    match = near_duplicates.lookup(namespace, image_hash, image_thumbnail)
+    if match is not None:
+        caption, distance = match
+        logger.debug(f"Reusing caption from a near-duplicate image (hamming distance {distance}).")
+        return caption
+
+    caption = await batcher.submit(decoded.image, lane)
+    near_duplicates.add(namespace, image_hash, caption, image_thumbnail)
+    return caption
@@ -1,11 +1,46 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List
 
 class CaptionResponse(BaseModel):
     """Response schema for the generated caption."""
     filename: str
     caption: str
+    decoding: str | None = Field(None, description="Decoding strategy the caption was generated with.")
     error: str | None = None
 
+class BatchCaptionItem(CaptionResponse):
+    """One line of the NDJSON stream returned by batch captioning."""
+    index: int = Field(..., description="Position of the image in the request (archives expanded in order).")
+
+class JobRequest(BaseModel):
+    """Request body for submitting a captioning job."""
+    images: List[str] = Field(..., description="Image references: paths relative to the job input directory, or http(s) URLs on allowed hosts.")
+
+class JobStatus(BaseModel):
+    """Status and progress of a captioning job."""
+    job_id: str
+    status: str = Field(..., description="One of queued, running, succeeded, failed, cancelled.")
+    total: int = Field(..., description="Number of images in the job.")
+    completed: int = Field(..., description="Images captioned successfully so far.")
+    failed: int = Field(..., description="Images that could not be processed so far.")
+    error: str | None = None
+    created_at: float
+    updated_at: float
+
+class JobResultItem(BaseModel):
+    """Caption for one image of a job."""
+    index: int
+    reference: str
+    status: str = Field(..., description="pending, done or error.")
+    caption: str | None = None
+    error: str | None = None
+
+class JobResultsResponse(BaseModel):
+    """A page of job results, in input order."""
+    job_id: str
+    items: List[JobResultItem]
+    next_offset: int | None = Field(None, description="Offset of the next page, or null if this is the last one.")
+
 class HealthCheckResponse(BaseModel):
     """Response schema for health check."""
     status: str
\ No newline at end of file
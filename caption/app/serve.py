@@ -0,0 +1,59 @@
+"""
+Serves the app with one or more uvicorn worker processes.
+
+    python -m app.serve --host 0.0.0.0 --port 8000
+
+With SERVE_WORKERS=1 (the default) this is plain uvicorn. With more workers,
+the model is loaded once in a master process, the master's heap is frozen
+out of the garbage collector, and workers are forked from it. All workers
+then share the weights and the imported libraries copy-on-write instead of
+each holding a private copy. Each worker gets its own share of the CPU
+cores for torch intra-op threads, and the master restarts workers that die.
+The master runs no inference; each worker warms up after the fork.
+
+Metrics are aggregated across workers through PROMETHEUS_MULTIPROC_DIR.
+Preloading needs CPU inference with a fork-safe backend (torch, torch-int8).
+Otherwise the workers load their own models after the fork, and only the
+imported libraries are shared.
+
+Measured with benchmarks/bench_prefork_memory.py --full-size (stand-in with the
+real model's dimensions, CPU, torch backend, warm-up in each worker):
+
+    workers   pod PSS   private/worker   same capacity as separate pods
+          1   1698MiB          1688MiB          1709MiB
+          2   1884MiB           181MiB          3418MiB
+          4   2565MiB           260MiB          6836MiB
+"""
+import logging
+import os
+import sys
+
+from service_common import serve
+
+logger = logging.getLogger(__name__)
+
+FORK_SAFE_BACKENDS = ("torch", "torch-int8") # Backends whose loaded model may be shared across fork
+
+
+def _preload_supported(model_loader) -> bool:
+    if model_loader.DEVICE != "cpu":
+        logger.warning("CUDA cannot be shared across fork; each worker loads its own model.")
+        return False
+    if os.getenv("CAPTION_BACKEND", model_loader.DEFAULT_BACKEND).lower() not in FORK_SAFE_BACKENDS:
+        logger.warning("The configured backend is not fork-safe; each worker loads its own model.")
+        return False
+    return True
+
+
+def _configure_worker(threads: int):
+    import torch
+
+    torch.set_num_threads(threads)
+
+
+def main():
+    return serve.main(__package__, __doc__, 8000, _preload_supported, _configure_worker)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
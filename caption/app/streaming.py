@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import threading
+import time
+
+from prometheus_client import Histogram
+
+from . import model_loader
+from .shared import inference_executor
+
+logger = logging.getLogger(__name__)
+
+# --- Metrics ---
+TIME_TO_FIRST_TOKEN = Histogram(
+    "caption_stream_time_to_first_token_seconds",
+    "Time from an accepted streaming request until its first caption text is sent.",
+    ["decoding"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+STREAM_DURATION = Histogram(
+    "caption_stream_duration_seconds",
+    "Time from an accepted streaming request until its caption is complete.",
+    ["decoding"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+async def stream_caption(image_bytes: bytes, decoding: str = model_loader.STREAM_DECODING):
+    """
+    Yields caption text chunks for the image as the decoder produces them.
+
+    Decoding the upload goes through the executor's admission control, so a
+    full queue raises QueueFullError before anything is streamed. Generation
+    then runs on an executor thread and stops early if the consumer goes away.
+    Process executors can't stream across the process boundary; there the
+    whole caption is yielded as a single chunk once it is done.
+    """
+    start = time.perf_counter()
+    decoded = await inference_executor.run(model_loader.decode_image, image_bytes)
+
+    if inference_executor.kind == "process":
+        caption = await inference_executor.run(model_loader.generate_caption_streamed, decoded.image,
+                                               None, decoding, bounded=False)
+        TIME_TO_FIRST_TOKEN.labels(decoding=decoding).observe(time.perf_counter() - start)
+        STREAM_DURATION.labels(decoding=decoding).observe(time.perf_counter() - start)
+        yield caption
+        return
+
+    from transformers import AsyncTextIteratorStreamer # Deferred like model_loader's imports; already loaded by now
+    streamer = AsyncTextIteratorStreamer(model_loader.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop_event = threading.Event()
+    # Already admitted above, so the generate job itself is never rejected
+    generation = asyncio.ensure_future(inference_executor.run(
+        model_loader.generate_caption_streamed, decoded.image, streamer, decoding, stop_event, bounded=False))
+    # generate() only ends the stream when it succeeds; end it on failure too so the loop below can't hang
+    generation.add_done_callback(lambda job: job.cancelled() or job.exception() is None or streamer.end())
+
+    first_token = True
+    try:
+        async for text in streamer:
+            if not text:
+                continue
+            if first_token:
+                TIME_TO_FIRST_TOKEN.labels(decoding=decoding).observe(time.perf_counter() - start)
+                first_token = False
+            yield text
+        await generation # Re-raises generation errors
+        STREAM_DURATION.labels(decoding=decoding).observe(time.perf_counter() - start)
+    finally:
+        if not generation.done():
+            stop_event.set()
+            logger.info("Caption stream closed early; stopping generation.")
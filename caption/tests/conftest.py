@@ -0,0 +1,37 @@
+import pytest
+
+from caption_app import encoder_cache, model_loader
+
+
+class _Tokenizer:
+    """Stands in for the GPT-2 tokenizer; captions are the generated token ids."""
+
+    def batch_decode(self, output_ids, skip_special_tokens=True):
+        return [" ".join(str(int(token)) for token in ids) for ids in output_ids]
+
+
+@pytest.fixture
+def tiny_model(monkeypatch):
+    """A randomly initialised ViT-GPT2 captioner small enough to run in a test."""
+    model_loader.import_runtime()
+    from transformers import GPT2Config, ViTConfig, VisionEncoderDecoderConfig, VisionEncoderDecoderModel
+
+    torch = model_loader.torch
+    torch.manual_seed(0)
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(
+        ViTConfig(image_size=32, patch_size=16, hidden_size=32, num_hidden_layers=1, num_attention_heads=2,
+                  intermediate_size=64),
+        GPT2Config(vocab_size=64, n_positions=64, n_embd=32, n_layer=3, n_head=2, bos_token_id=0, eos_token_id=1))
+    config.decoder_start_token_id, config.pad_token_id, config.eos_token_id = 0, 1, 1
+    model = VisionEncoderDecoderModel(config).eval()
+    model.generation_config.decoder_start_token_id = 0
+    model.generation_config.pad_token_id = model.generation_config.eos_token_id = 1
+    monkeypatch.setattr(model_loader, "model", model)
+    monkeypatch.setattr(model_loader, "draft_model", model_loader._build_draft_model(model, 1))
+    monkeypatch.setattr(model_loader, "feature_extractor",
+                        model_loader.ViTImageProcessor(size={"height": 32, "width": 32}))
+    monkeypatch.setattr(model_loader, "tokenizer", _Tokenizer())
+    monkeypatch.setattr(model_loader, "encoder_outputs", encoder_cache.EncoderCache())
+    monkeypatch.setattr(model_loader, "MAX_LENGTH", 12)
+    monkeypatch.setattr(model_loader, "NUM_BEAMS", 2)
+    return model
@@ -0,0 +1,48 @@
+import asyncio
+import functools
+
+import numpy as np
+from PIL import Image
+
+from service_common import batching
+from service_common.executor import InferenceExecutor
+
+from caption_app import model_loader, pipeline
+
+
+def _images(count: int) -> list:
+    rng = np.random.default_rng(1)
+    return [Image.fromarray(rng.integers(0, 255, (32, 32, 3), dtype=np.uint8)) for _ in range(count)]
+
+
+def test_concurrent_requests_share_a_beam_search_batch(tiny_model):
+    images = _images(4)
+    alone = [model_loader.generate_captions([image], "beam")[0] for image in images]
+    batch_sizes = []
+
+    def generate_captions(batch):
+        batch_sizes.append(len(batch))
+        return model_loader.generate_captions(batch, "beam")
+
+    async def run():
+        executor = InferenceExecutor("test_caption_batching", kind="thread", max_workers=1)
+        executor.start()
+        batcher = batching.MicroBatcher(generate_captions, name="caption", executor=executor,
+                                        max_batch_size=4, max_wait_ms=10_000)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(image) for image in images))
+        finally:
+            await batcher.stop()
+            executor.shutdown()
+
+    assert asyncio.run(run()) == alone # Each request gets the caption it would get on its own
+    assert batch_sizes == [4]
+
+
+def test_each_decoding_strategy_has_its_own_batcher():
+    assert set(pipeline.caption_batchers) == set(model_loader.ALLOWED_DECODING)
+    assert pipeline.caption_batcher is pipeline.caption_batchers[model_loader.DEFAULT_DECODING]
+    for decoding, batcher in pipeline.caption_batchers.items():
+        assert isinstance(batcher.batch_fn, functools.partial)
+        assert batcher.batch_fn.keywords == {"decoding": decoding}
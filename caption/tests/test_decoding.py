@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from caption_app import encoder_cache, model_loader
+
+
+def _images(count: int) -> list:
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 255, (32, 32, 3), dtype=np.uint8)) for _ in range(count)]
+
+
+def test_speculative_decoding_gives_the_greedy_captions(tiny_model):
+    images = _images(3)
+    greedy = model_loader.generate_captions(images, "greedy")
+    assert model_loader.generate_captions(images, "speculative") == greedy
+    assert len(model_loader.generate_captions(images, "early-exit")) == 3
+    assert len(model_loader.generate_captions(images, "beam")) == 3
+
+
+def test_encoder_runs_once_per_image_across_strategies(tiny_model, monkeypatch):
+    encoded = []
+    encoder_forward = tiny_model.encoder.forward
+
+    def forward(pixel_values=None, **kwargs):
+        encoded.append(len(pixel_values))
+        return encoder_forward(pixel_values=pixel_values, **kwargs)
+
+    monkeypatch.setattr(tiny_model.encoder, "forward", forward)
+    first, second = _images(2)
+    model_loader.generate_captions([first], "greedy")
+    model_loader.generate_captions([first, second], "beam")
+    model_loader.generate_captions([second, first], "early-exit")
+    assert encoded == [1, 1]
+
+
+def test_draft_strategies_need_the_draft_model(monkeypatch):
+    monkeypatch.setattr(model_loader, "ALLOWED_DECODING", model_loader.DECODING_STRATEGIES)
+    monkeypatch.setattr(model_loader, "draft_model", None)
+    assert model_loader.available_decoding() == ("beam", "greedy")
+    monkeypatch.setattr(model_loader, "draft_model", object())
+    assert model_loader.available_decoding() == model_loader.DECODING_STRATEGIES
+
+
+def test_unavailable_strategy_is_rejected(tiny_model, monkeypatch):
+    monkeypatch.setattr(model_loader, "draft_model", None)
+    with pytest.raises(ValueError, match="not available"):
+        model_loader.generate_captions(_images(1), "speculative")
+
+
+def test_encoder_cache_evicts_the_least_recently_used_entry():
+    cache = encoder_cache.EncoderCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    disabled = encoder_cache.EncoderCache(max_entries=0)
+    disabled.set("a", 1)
+    assert disabled.get("a") is None
+
+
+def test_raw_frames_share_the_key_of_the_same_decoded_image():
+    pixels = np.arange(8 * 6 * 3, dtype=np.uint8).reshape(8, 6, 3)
+    assert encoder_cache.image_key(pixels) == encoder_cache.image_key(Image.fromarray(pixels))
+    assert encoder_cache.image_key(pixels) != encoder_cache.image_key(pixels.reshape(6, 8, 3))
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import json
+import zipfile
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from service_common.ingest import NPY_CONTENT_TYPE, RAW_CONTENT_TYPE
+
+from caption_app import main, model_loader, pipeline, streaming
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main.startup, "state", "ready")
+    return TestClient(main.app) # Without the lifespan, so no model is loaded
+
+
+def _failing_stream(error):
+    async def stream_caption(image_bytes, decoding):
+        raise error
+        yield # An async generator, like the real one
+    return stream_caption
+
+
+def _post(client):
+    return client.post("/caption/stream", files={"file": ("a.jpg", b"\xff\xd8 not decoded", "image/jpeg")})
+
+
+def _sse_events(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_stream_sends_tokens_then_the_whole_caption(client, monkeypatch):
+    async def stream_caption(image_bytes, decoding):
+        for chunk in ("a", " cat", " on a mat "):
+            yield chunk
+
+    monkeypatch.setattr(streaming, "stream_caption", stream_caption)
+    response = _post(client)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert _sse_events(response.text) == [
+        ("token", {"text": "a"}), ("token", {"text": " cat"}), ("token", {"text": " on a mat "}),
+        ("done", {"filename": "a.jpg", "caption": "a cat on a mat", "decoding": model_loader.STREAM_DECODING,
+                  "error": None}),
+    ]
+
+
+def test_failure_after_the_first_token_is_reported_in_band(client, monkeypatch):
+    async def stream_caption(image_bytes, decoding):
+        yield "a"
+        raise RuntimeError("Caption generation failed")
+
+    monkeypatch.setattr(streaming, "stream_caption", stream_caption)
+    response = _post(client)
+    assert response.status_code == 200
+    assert [event for event, _ in _sse_events(response.text)] == ["token", "error"]
+
+
+def test_stream_rejects_undecodable_images_with_400(client, monkeypatch):
+    monkeypatch.setattr(streaming, "stream_caption", _failing_stream(ValueError("Could not decode image")))
+    assert _post(client).status_code == 400
+
+
+def test_stream_reports_generation_failures_as_500(client, monkeypatch):
+    monkeypatch.setattr(model_loader, "model", object())
+    monkeypatch.setattr(streaming, "stream_caption", _failing_stream(RuntimeError("Caption generation failed")))
+    assert _post(client).status_code == 500
+
+
+def test_stream_reports_a_missing_model_as_503(client, monkeypatch):
+    monkeypatch.setattr(model_loader, "model", None)
+    monkeypatch.setattr(streaming, "stream_caption", _failing_stream(RuntimeError("Model is not loaded.")))
+    assert _post(client).status_code == 503
+
+
+def test_raw_npy_frame_is_captioned_without_decoding(client, monkeypatch):
+    frames = []
+
+    async def caption(image_bytes, decoding="beam", decoded=None):
+        frames.append(decoded)
+        return "a grey square"
+
+    monkeypatch.setattr(pipeline, "caption", caption)
+    buffer = io.BytesIO()
+    np.save(buffer, np.full((20, 30, 3), 128, dtype=np.uint8))
+    response = client.post("/caption/raw?decoding=greedy", content=buffer.getvalue(),
+                           headers={"content-type": NPY_CONTENT_TYPE})
+    assert response.status_code == 200
+    assert response.json()["caption"] == "a grey square"
+    assert frames[0].image.shape == (20, 30, 3)
+
+
+def test_raw_frame_not_matching_its_shape_is_rejected_with_400(client):
+    response = client.post("/caption/raw?decoding=greedy", content=b"\0" * 10,
+                           headers={"content-type": RAW_CONTENT_TYPE, "x-image-shape": "20,30,3"})
+    assert response.status_code == 400
+
+
+def test_batch_streams_ndjson_in_input_order(client, monkeypatch):
+    async def caption(image_bytes, lane=None):
+        await asyncio.sleep(0.01 * (3 - len(image_bytes))) # Later images finish first
+        return f"caption {len(image_bytes)}"
+
+    monkeypatch.setattr(pipeline, "caption", caption)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("b.jpg", b"bb")
+        zf.writestr("c.jpg", b"ccc")
+    response = client.post("/caption/batch", files=[("files", ("a.jpg", b"a", "image/jpeg")),
+                                                    ("files", ("set.zip", archive.getvalue(), "application/zip"))])
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["index"], line["filename"], line["caption"]) for line in lines] == [
+        (0, "a.jpg", "caption 1"), (1, "set.zip/b.jpg", "caption 2"), (2, "set.zip/c.jpg", "caption 3")]
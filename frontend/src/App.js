@@ -1,6 +1,6 @@
 import React, { useState, useCallback, useEffect, useRef } from "react";
 import {
-  uploadImageAndGetCaption,
+  streamImageCaption,
   uploadImageAndDetectObjects,
   // Optional: checkCaptionHealth, checkDetectionHealth
 } from "./api"; // Assuming api.js is in the same folder
@@ -531,7 +531,8 @@ function App() {
     setDrawnImageUrl(null); // Clear detection results when generating caption
 
     try {
-      const generatedCaption = await uploadImageAndGetCaption(selectedFile);
+      // Show words as they are generated instead of waiting for the whole caption
+      const generatedCaption = await streamImageCaption(selectedFile, setCaption);
       setCaption(generatedCaption);
     } catch (err) {
       console.error("Caption generation failed:", err);
@@ -59,6 +59,59 @@ export const uploadImageAndGetCaption = async (file) => {
   return data.caption; // Return the caption string
 };
 
+// Streams a caption as Server-Sent Events, calling onToken with the caption so far.
+// EventSource can't POST a file, so the event stream is parsed from the fetch body.
+export const streamImageCaption = async (file, onToken) => {
+  const formData = new FormData();
+  formData.append("file", file);
+
+  const response = await fetch(`${CAPTION_API_BASE_URL}/caption/stream`, {
+    method: "POST",
+    body: formData,
+  });
+  if (!response.ok || !response.body) {
+    let errorDetail = `HTTP error! status: ${response.status}`;
+    try {
+      const errorData = await response.json();
+      errorDetail = errorData.error || errorData.detail || errorDetail;
+    } catch (jsonError) {
+      // Keep the original HTTP error status
+    }
+    throw new Error(errorDetail);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let caption = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      const payload = data ? JSON.parse(data) : {};
+      if (event === "token") {
+        caption += payload.text;
+        onToken(caption);
+      } else if (event === "done") {
+        return payload.caption;
+      } else if (event === "error") {
+        throw new Error(payload.error);
+      }
+    }
+  }
+  return caption.trim();
+};
+
 // --- Object Detection API ---
 export const uploadImageAndDetectObjects = async (file) => {
   const data = await fetchApi(`${DETECTION_API_BASE_URL}/object`, {}, file);
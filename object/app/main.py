@@ -1,10 +1,24 @@
+import asyncio
+import json
 import logging
-from fastapi import FastAPI, File, UploadFile, HTTPException, status
+import os
+from typing import List, Literal
+from fastapi import FastAPI, File, Header, Query, Request, Response, UploadFile, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from contextlib import asynccontextmanager
 from prometheus_fastapi_instrumentator import Instrumentator
 
-from . import model_loader, schemas # Use relative imports within the package
+from service_common import jobs
+from service_common.bulk import BULK_REQUEST_MAX_BYTES
+from service_common.executor import QueueFullError
+from service_common.ingest import (FORM_OVERHEAD_BYTES, NPY_CONTENT_TYPE, RAW_CONTENT_TYPE, RequestSizeLimitMiddleware,
+                                   UploadTooLargeError)
+from service_common.startup import STARTUP_BACKGROUND
+
+from . import model_loader, pipeline, schemas, tiling, video # Use relative imports within the package
+from .shared import SERVICE, bulk, ingest, instrumentation, startup
 
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -13,17 +27,16 @@ logger = logging.getLogger(__name__)
 # --- Lifespan Management (for loading model on startup) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Load the ML model
+    # Load the ML model in the background, so health checks and metrics are served meanwhile (see service_common/startup.py)
     logger.info("Application startup: Loading Object Detection model...")
-    try:
-        model_loader.load_model()
-        logger.info("Object Detection Model loaded successfully during startup.")
-    except Exception as e:
-        logger.error(f"Fatal Error: Failed to load Object Detection model during startup: {e}", exc_info=True)
-        # Allow app to start, but endpoints needing the model will fail.
+    startup_task = asyncio.create_task(startup.run(model_loader.load_model, pipeline.start))
+    if not STARTUP_BACKGROUND:
+        await startup_task
     yield
     # Clean up resources if needed
     logger.info("Application shutdown: Cleaning up resources...")
+    startup_task.cancel()
+    await pipeline.stop()
 
 
 # --- FastAPI App Initialization ---
@@ -35,6 +48,14 @@ app = FastAPI(
 )
 
 Instrumentator().instrument(app).expose(app)
+# Routes declared below report per-stage timings (Server-Timing header and object_stage_seconds)
+app.router.route_class = instrumentation.TimedRoute
+
+# Bounds request bodies before they are parsed; added before CORS so 413 answers carry CORS headers too
+app.add_middleware(RequestSizeLimitMiddleware, ingest=ingest, limits={
+    "/api/object/batch": BULK_REQUEST_MAX_BYTES,
+    "/api/object/video": video.VIDEO_UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+})
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,21 +66,48 @@ app.add_middleware(
 )
 
 # --- API Endpoints ---
+app.get("/api/debug/profile", response_class=PlainTextResponse, tags=["Debug"])(instrumentation.profile)
+
 @app.get("/api/health", response_model=schemas.HealthCheckResponse, tags=["Health"])
 async def health_check():
     """Performs a basic health check, including model status."""
-    # Check only for the model, as image_processor is removed
-    model_ready = bool(model_loader.model)
-    status_msg = "ready" if model_ready else "model_loading_failed_or_in_progress"
+    # Only report ready once warm-up has run, so the first real request doesn't pay for it
+    status_msg = "model_loading_failed" if startup.state == "failed" else startup.state
     logger.info(f"Health check requested. Model status: {status_msg}")
     return schemas.HealthCheckResponse(status=status_msg)
 
+@app.get("/api/health/live", response_model=schemas.HealthCheckResponse, tags=["Health"])
+async def liveness_check():
+    """Liveness probe: answers as soon as the server runs, also while the model loads."""
+    return schemas.HealthCheckResponse(status=startup.state)
+
+@app.get("/api/health/ready", response_model=schemas.HealthCheckResponse, tags=["Health"],
+         responses={503: {"model": schemas.HealthCheckResponse, "description": "Still loading or warming up, or failed."}})
+async def readiness_check(response: Response):
+    """Readiness probe: 503 until the models are loaded and warmed up, so no traffic arrives before then."""
+    if not startup.is_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return schemas.HealthCheckResponse(status=startup.state)
+
 @app.post("/api/object", response_model=schemas.ObjectDetectionResponse, tags=["Detection"])
-async def detect_objects_endpoint(file: UploadFile = File(...)):
+async def detect_objects_endpoint(
+    file: UploadFile = File(...),
+    tiled: bool = Query(False, description="Detect on overlapping full-resolution tiles (for large images)."),
+    tile_size: int = Query(tiling.TILE_SIZE, ge=64, le=4096, description="Tile side in pixels."),
+    tile_overlap: float = Query(tiling.TILE_OVERLAP, ge=0.0, lt=0.9, description="Overlap between neighbouring tiles."),
+    tile_batch_size: int = Query(tiling.TILE_BATCH_SIZE, ge=1, le=64, description="Tiles per predict call."),
+    merge: Literal["nms", "wbf"] = Query(tiling.TILE_MERGE, description="How duplicate detections across tiles are merged."),
+    quality: Literal["auto", "fast", "balanced", "accurate"] = Query(
+        "auto", description="Model size hint; auto lets the server pick based on load."),
+):
     """
     Uploads an image file and returns detected objects with bounding boxes.
 
     - **file**: The image file to upload (e.g., JPEG, PNG).
+    - **tiled**: Slice the image into overlapping tiles so small objects in large images survive.
+      `tile_size`, `tile_overlap`, `tile_batch_size` and `merge` only apply in tiled mode.
+    - **quality**: `fast` uses the smallest served model, `accurate` the largest. The model that
+      produced the detections is returned in `model`.
     """
     logger.info(f"Received request for object detection: {file.filename}")
     if not file.content_type or not file.content_type.startswith("image/"):
@@ -71,7 +119,7 @@ async def detect_objects_endpoint(file: UploadFile = File(...)):
 
     # Ensure model is ready before processing
     # Ensure model is ready before processing
-    if not model_loader.model: # <-- Corrected line (only check for model)
+    if not startup.is_ready():
         logger.error("Detection request failed: Model is not loaded.")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -79,21 +127,39 @@ async def detect_objects_endpoint(file: UploadFile = File(...)):
         )
 
     try:
-        image_bytes = await file.read()
+        image_bytes = await ingest.read_upload(file)
         logger.debug(f"Read {len(image_bytes)} bytes from uploaded file: {file.filename}")
 
-        # Perform detection
-        detected_objects_data = model_loader.detect_objects(image_bytes)
+        # Perform detection (batched together with concurrent requests, or tiled)
+        tile_options = None
+        if tiled:
+            tile_options = {"tile_size": tile_size, "overlap": tile_overlap,
+                            "batch_size": tile_batch_size, "merge": merge}
+        detected_objects_data, model_name = await pipeline.detect_with_model(image_bytes, tile_options, quality=quality)
 
         # Format response using Pydantic models
         detected_objects = [schemas.DetectedObject(**obj_data) for obj_data in detected_objects_data]
 
-        logger.info(f"Successfully processed object detection for {file.filename}")
+        logger.info(f"Successfully processed object detection for {file.filename} with model '{model_name}'")
         return schemas.ObjectDetectionResponse(
             filename=file.filename,
-            objects=detected_objects
+            objects=detected_objects,
+            model=model_name,
         )
 
+    except UploadTooLargeError as too_large:
+        logger.warning(f"Rejecting detection for {file.filename}: {too_large}")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(too_large),
+        )
+    except QueueFullError as qf: # Shed load quickly instead of queueing without bound
+        logger.warning(f"Rejecting detection for {file.filename}: {qf}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Detection queue is full. Please retry later.",
+            headers={"Retry-After": str(qf.retry_after)},
+        )
     except ValueError as ve: # Specific error from our detection function
          logger.error(f"Value error during detection for {file.filename}: {ve}", exc_info=True)
          # Return response with error message
@@ -113,5 +179,296 @@ async def detect_objects_endpoint(file: UploadFile = File(...)):
          await file.close()
          logger.debug(f"Closed file handle for: {file.filename}")
 
+@app.post("/api/object/raw", response_model=schemas.ObjectDetectionResponse, tags=["Detection"],
+          openapi_extra={"requestBody": {"required": True, "content": {
+              RAW_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+              NPY_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}}}}})
+async def detect_objects_raw_endpoint(
+    request: Request,
+    x_image_shape: str | None = Header(None, description="height,width,3 of an application/octet-stream body."),
+    quality: Literal["auto", "fast", "balanced", "accurate"] = Query(
+        "auto", description="Model size hint; auto lets the server pick based on load."),
+):
+    """
+    Detects objects in an already-decoded RGB frame, skipping image decoding.
+
+    For internal clients that hold decoded pixels (video pipelines, other
+    models). The body is a uint8 array of shape (height, width, 3), either
+    packed row-major as `application/octet-stream` with an `X-Image-Shape:
+    height,width,3` header, or as a NumPy `.npy` file (`application/x-npy`).
+    The pixels are used in place; a body that doesn't match its shape is
+    rejected with 400. Boxes are in the frame's pixel coordinates.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in (RAW_CONTENT_TYPE, NPY_CONTENT_TYPE):
+        logger.warning(f"Invalid raw content type received: {content_type}")
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Send {RAW_CONTENT_TYPE} with an X-Image-Shape header, or {NPY_CONTENT_TYPE}.",
+        )
+    if not startup.is_ready():
+        logger.error("Raw detection request failed: Model is not loaded.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model is not ready or failed to load. Please try again later.",
+        )
+
+    try:
+        body = await ingest.read_raw_body(request)
+        decoded = ingest.decode_raw(body, content_type, x_image_shape)
+    except UploadTooLargeError as too_large:
+        logger.warning(f"Rejecting raw detection: {too_large}")
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(too_large))
+    except ValueError as ve: # The frame doesn't match its declared shape
+        logger.warning(f"Rejecting raw detection: {ve}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+
+    try:
+        detected_objects_data, model_name = await pipeline.detect_with_model(body, quality=quality, decoded=decoded)
+        detected_objects = [schemas.DetectedObject(**obj_data) for obj_data in detected_objects_data]
+        logger.info(f"Successfully processed object detection for a raw {decoded.original_size} frame with model '{model_name}'")
+        return schemas.ObjectDetectionResponse(filename="raw", objects=detected_objects, model=model_name)
+    except QueueFullError as qf: # Shed load quickly instead of queueing without bound
+        logger.warning(f"Rejecting raw detection: {qf}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Detection queue is full. Please retry later.",
+            headers={"Retry-After": str(qf.retry_after)},
+        )
+    except ValueError as ve: # Specific error from our detection function
+         logger.error(f"Value error during raw detection: {ve}", exc_info=True)
+         return schemas.ObjectDetectionResponse(filename="raw", objects=[], error=f"Detection error: {ve}")
+    except Exception as e:
+        logger.error(f"Unexpected error during raw detection: {e}", exc_info=True)
+        return schemas.ObjectDetectionResponse(filename="raw", objects=[],
+                                               error="An unexpected error occurred during object detection.")
+
+@app.post("/api/object/batch", tags=["Detection"],
+          responses={200: {"content": {"application/x-ndjson": {}},
+                           "description": "One BatchDetectionItem JSON object per line, in input order."}})
+async def detect_objects_batch_endpoint(files: List[UploadFile] = File(...)):
+    """
+    Uploads many images, or zip/tar archives of images, and streams back detections as NDJSON.
+
+    - **files**: Image files and/or archives (.zip, .tar, .tar.gz). Archives are read
+      member by member and never extracted to disk.
+
+    Each line carries the image's `index` and `filename`; a failed image gets an
+    `error` and an empty `objects` list without affecting the rest of the batch.
+    """
+    logger.info(f"Received batch detection request with {len(files)} uploaded files.")
+    if not startup.is_ready():
+        logger.error("Batch detection request failed: Model is not loaded.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model is not ready or failed to load. Please try again later.",
+        )
+
+    async def stream_results():
+        processed = 0
+        try:
+            async for index, filename, result in bulk.process_in_order(bulk.iter_uploads(files), bulk.in_bulk_lane(pipeline.detect)):
+                if isinstance(result, UploadTooLargeError):
+                    item = schemas.BatchDetectionItem(index=index, filename=filename, objects=[], error=str(result))
+                elif isinstance(result, (ValueError, QueueFullError)):
+                    item = schemas.BatchDetectionItem(index=index, filename=filename, objects=[],
+                                                      error=f"Detection error: {result}")
+                elif isinstance(result, Exception):
+                    logger.error(f"Unexpected error during batch detection for {filename}: {result}", exc_info=result)
+                    item = schemas.BatchDetectionItem(index=index, filename=filename, objects=[],
+                                                      error="An unexpected error occurred during object detection.")
+                else:
+                    item = schemas.BatchDetectionItem(index=index, filename=filename,
+                                                      objects=[schemas.DetectedObject(**obj) for obj in result])
+                processed += 1
+                yield json.dumps(jsonable_encoder(item)) + "\n"
+        except Exception as e: # The status line has already been sent, so report the failure in-band
+            logger.error(f"Batch detection stopped after {processed} images: {e}", exc_info=True)
+            yield json.dumps({"error": f"Batch stopped after {processed} images: {e}"}) + "\n"
+        finally:
+            for file in files:
+                await file.close()
+        logger.info(f"Finished batch detection of {processed} images.")
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# --- Job API ---
+def _job_store() -> jobs.JobStore:
+    if pipeline.job_store is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="The job store is not available.")
+    return pipeline.job_store
+
+def _job_not_found(job_id: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found.")
+
+@app.post("/api/object/jobs", response_model=schemas.JobStatus, status_code=status.HTTP_202_ACCEPTED, tags=["Jobs"])
+async def submit_detection_job(request: schemas.JobRequest):
+    """
+    Submits a list of image references for background detection and returns the job's id.
+
+    - **images**: Paths relative to the job input directory on the shared volume, or http(s) URLs on
+      hosts the service allows (JOB_ALLOW_URLS, JOB_URL_ALLOWED_HOSTS).
+
+    Jobs run in the background at lower priority than single-image requests.
+    With the file job store on the shared volume, any replica answers for a job
+    and a job survives the pod that accepted it; poll `GET /api/object/jobs/{job_id}` for progress.
+    """
+    store = _job_store()
+    if not request.images:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A job needs at least one image.")
+    if len(request.images) > jobs.JOB_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Job exceeds the limit of {jobs.JOB_MAX_ITEMS} images.")
+    try:
+        for reference in request.images:
+            jobs.validate_reference(reference)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    job = await asyncio.to_thread(store.create, request.images)
+    jobs.metrics(SERVICE).submitted.inc()
+    logger.info(f"Submitted detection job {job['job_id']} with {len(request.images)} images.")
+    return schemas.JobStatus(**job)
+
+@app.get("/api/object/jobs/{job_id}", response_model=schemas.JobStatus, tags=["Jobs"])
+async def get_detection_job(job_id: str,
+                            wait: float = Query(0.0, ge=0.0, le=60.0,
+                                                description="Seconds to wait for progress before answering (long poll).")):
+    """Returns a job's status and progress, optionally waiting until it changes."""
+    job = await jobs.wait_for_change(_job_store(), job_id, wait)
+    if job is None:
+        raise _job_not_found(job_id)
+    return schemas.JobStatus(**job)
+
+@app.get("/api/object/jobs/{job_id}/results", response_model=schemas.JobResultsResponse, tags=["Jobs"])
+async def get_detection_job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """Returns a page of per-image results in input order; images not processed yet have status `pending`."""
+    store = _job_store()
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None:
+        raise _job_not_found(job_id)
+    rows = await asyncio.to_thread(store.results, job_id, offset, limit)
+    items = [schemas.JobResultItem(index=row["index"], reference=row["reference"], status=row["status"],
+                                   objects=row["result"], error=row["error"]) for row in rows]
+    next_offset = offset + len(items) if offset + len(items) < job["total"] else None
+    return schemas.JobResultsResponse(job_id=job_id, items=items, next_offset=next_offset)
+
+@app.delete("/api/object/jobs/{job_id}", response_model=schemas.JobStatus, tags=["Jobs"])
+async def cancel_detection_job(job_id: str):
+    """Cancels a job that has not finished (409 otherwise); images already processed keep their results."""
+    store = _job_store()
+    if not await asyncio.to_thread(store.cancel, job_id):
+        if await asyncio.to_thread(store.get, job_id) is None:
+            raise _job_not_found(job_id)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job {job_id} has already finished.")
+    logger.info(f"Cancelled detection job {job_id}.")
+    return schemas.JobStatus(**await asyncio.to_thread(store.get, job_id))
+
+@app.post("/api/object/video", tags=["Detection"],
+          responses={200: {"content": {"application/x-ndjson": {}},
+                           "description": "One VideoFrameDetections JSON object per line, in frame order."}})
+async def detect_video_endpoint(
+    file: UploadFile = File(...),
+    batch_frames: int = Query(video.VIDEO_BATCH_FRAMES, ge=1, le=64, description="Keyframes per predict call."),
+):
+    """
+    Uploads a video file and streams back detections for every frame as NDJSON.
+
+    - **file**: The video file to upload (e.g., MP4, AVI).
+
+    Only keyframes are run through the model; how often depends on how much the
+    scene is changing. Boxes on the frames in between come from a tracker
+    (`keyframe` is false) and carry the same `track_id` as the detections they follow.
+    """
+    logger.info(f"Received request for video detection: {file.filename}")
+    if file.content_type and not file.content_type.startswith(("video/", "application/octet-stream")):
+        logger.warning(f"Invalid file type received: {file.content_type}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file type. Please upload a video.",
+        )
+    if not startup.is_ready():
+        logger.error("Video detection request failed: Model is not loaded.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model is not ready or failed to load. Please try again later.",
+        )
+
+    try:
+        path = await ingest.save_upload(file, video.VIDEO_UPLOAD_MAX_BYTES,
+                                        suffix=os.path.splitext(file.filename or "")[1])
+    except UploadTooLargeError as too_large:
+        logger.warning(f"Rejecting video detection for {file.filename}: {too_large}")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(too_large),
+        )
+    finally:
+        await file.close()
+
+    try:
+        capture = video.open_video(path)
+    except ValueError as ve:
+        os.unlink(path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+
+    async def stream_frames():
+        try:
+            async for result in video.detect_video(capture, batch_frames):
+                frame = schemas.VideoFrameDetections(**result)
+                yield json.dumps(jsonable_encoder(frame)) + "\n"
+        except Exception as e: # The status line has already been sent, so report the failure in-band
+            logger.error(f"Error during video detection for {file.filename}: {e}", exc_info=True)
+            yield json.dumps({"error": f"Video detection stopped: {e}"}) + "\n"
+        finally:
+            os.unlink(path)
+
+    return StreamingResponse(stream_frames(), media_type="application/x-ndjson")
+
+@app.websocket("/api/object/stream")
+async def detect_stream_endpoint(websocket: WebSocket):
+    """
+    Detects objects in a live stream of frames.
+
+    The client sends each frame as one binary message (an encoded image, e.g.
+    JPEG) and receives one VideoFrameDetections JSON message per frame, in
+    order. Frames between keyframes are not decoded; their boxes come from the
+    tracker. When the detection queue is full a keyframe is tracked instead of
+    being dropped.
+    """
+    await websocket.accept()
+    if not startup.is_ready():
+        await websocket.close(code=1013, reason="Model is not ready or failed to load.") # 1013 = try again later
+        return
+
+    tracker = video.VideoTracker()
+    frame = 0
+    try:
+        while True:
+            data = await websocket.receive_bytes()
+            keyframe = tracker.is_keyframe(frame)
+            try:
+                if keyframe:
+                    objects = tracker.on_keyframe(frame, await pipeline.detect_frame(data))
+            except QueueFullError: # Shed load by leaning on the tracker
+                keyframe = False
+            except ValueError as ve:
+                await websocket.send_json({"frame": frame, "error": f"Detection error: {ve}"})
+                frame += 1
+                continue
+            if not keyframe:
+                objects = tracker.on_skipped(frame)
+            result = schemas.VideoFrameDetections(frame=frame, keyframe=keyframe, objects=objects)
+            await websocket.send_json(jsonable_encoder(result))
+            frame += 1
+    except WebSocketDisconnect:
+        logger.info(f"Frame stream closed by client after {frame} frames.")
+    except Exception as e:
+        logger.error(f"Unexpected error in frame stream after {frame} frames: {e}", exc_info=True)
+        try:
+            await websocket.send_json({"frame": frame, "error": "An unexpected error occurred during detection."})
+            await websocket.close(code=1011, reason="Internal error.") # 1011 = server error
+        except (WebSocketDisconnect, RuntimeError): # The client is already gone
+            pass
+
 # To run locally (for development): uvicorn object_detection.app.main:app --reload --port 8001
 # Note: Use a different port (e.g., 8001) if caption service runs on 8000
\ No newline at end of file
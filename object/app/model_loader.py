@@ -1,125 +1,356 @@
+import fcntl
+import hashlib
 import logging
+import shutil
+import tempfile
+import time
 from io import BytesIO
+from pathlib import Path
 from PIL import Image
-import torch # Still potentially useful for device selection
 import numpy as np
 import cv2 # Import opencv
-
-# Import YOLO from ultralytics
-from ultralytics import YOLO
+from prometheus_client import Counter, Histogram
 import os # Import os module
 
-MODEL_PATH_ON_VOLUME = "/model-cache/yolo/yolo11m.pt"
+from service_common import batching, near_duplicate
+from service_common.ingest import DecodedImage
+
+from .shared import ingest, instrumentation, startup
+
+# torch and ultralytics take seconds to import, so import_runtime() imports them when the
+# models load instead of when the app starts (see service_common/startup.py)
+torch = None # Still potentially useful for device selection
+YOLO = None
+
+MODEL_PATH_ON_VOLUME = os.getenv("YOLO_MODEL_PATH", "/model-cache/yolo/yolo11m.pt")
 
 logger = logging.getLogger(__name__)
 
 # --- Configuration ---
-# Choose a YOLOv8 model checkpoint (e.g., yolov8n.pt, yolov8s.pt, yolov8m.pt)
+def _parse_registry(spec: str) -> dict:
+    registry = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, separator, path = (part.strip() for part in entry.partition("="))
+        if not separator or not name or not path:
+            raise ValueError(f"Invalid YOLO_MODELS entry '{entry}'. Use name=path.")
+        registry[name] = path
+    return registry or {Path(MODEL_PATH_ON_VOLUME).stem: MODEL_PATH_ON_VOLUME}
+
+# YOLO checkpoints served side by side, smallest first, e.g.
+# "yolo11n=/model-cache/yolo/yolo11n.pt,yolo11s=/model-cache/yolo/yolo11s.pt,yolo11m=/model-cache/yolo/yolo11m.pt".
 # 'n' is nano (fastest, lowest accuracy), 's' is small, 'm' is medium etc.
-MODEL_NAME = "yolo11m.pt" # Using the nano version as a starting point
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu" # ultralytics can often auto-detect, but good to specify
+# Unset serves only YOLO_MODEL_PATH. app/model_policy.py picks one per request.
+MODEL_REGISTRY = _parse_registry(os.getenv("YOLO_MODELS", ""))
+MODEL_NAME = os.getenv("YOLO_DEFAULT_MODEL", list(MODEL_REGISTRY)[-1]) # Used unless the policy or client picks another
+DEVICE = None # "cuda" or "cpu", set by import_runtime(); ultralytics can often auto-detect, but good to specify
 CONFIDENCE_THRESHOLD = 0.40 # Adjust confidence threshold as needed for YOLOv8
+INPUT_SIZE = int(os.getenv("YOLO_INPUT_SIZE", "640")) # Fixed inference size; uploads are decoded no larger than needed
+# Runtime used to serve the checkpoint: "pytorch" (eager), "onnx" (ONNX Runtime) or "openvino".
+# Exported artifacts are cached on the shared volume, keyed by the checkpoint's hash.
+YOLO_RUNTIME = os.getenv("YOLO_RUNTIME", "pytorch").lower()
+EXPORT_DIR = os.getenv("YOLO_EXPORT_DIR", "/model-cache/yolo/exports")
+INTRA_OP_THREADS = int(os.getenv("YOLO_INTRA_OP_THREADS", "0")) # 0 keeps the runtime's default
+WARMUP_RUNS = int(os.getenv("YOLO_WARMUP_RUNS", "2"))
+LATENCY_SMOOTHING = 0.2 # Weight of the newest batch in each model's per-image latency estimate
+
+# --- Metrics ---
+# rate(object_model_inference_seconds_sum) per model is the share of a worker each model keeps busy
+MODEL_INFERENCE_SECONDS = Histogram(
+    "object_model_inference_seconds",
+    "Wall time of each predict call, by model.",
+    ["model"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+MODEL_IMAGES = Counter("object_model_images_total", "Images run through each model.", ["model"])
 
 # --- Global Variables ---
-model = None # Initialize model to None or a placeholder
+model = None # The default model (MODEL_NAME); set once every registry model has loaded
+models = {} # Every loaded model by registry name, smallest first
+seconds_per_image = {} # Smoothed per-image predict time by model name, for latency-based selection
+runtime = None # Runtime the current model is served with
+ready = False # True once warm-up inferences have completed
 # image_processor is no longer needed from transformers
 
 # --- Initialization ---
-def load_model():
-    """Loads the pre-trained YOLOv8 model."""
-    global model
+def import_runtime():
+    """Imports torch and ultralytics and picks the device; the first call takes seconds."""
+    global torch, YOLO, DEVICE
+    if torch is not None:
+        return
+    with startup.phase("import"):
+        import torch
+        # Import YOLO from ultralytics
+        from ultralytics import YOLO
+    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+def _checkpoint_hash(path: str) -> str:
+    """Returns a short content hash of the checkpoint, used to key exported artifacts."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def _exported_artifact(checkpoint: str, target_runtime: str) -> str:
+    """
+    Returns the path of the exported ONNX/OpenVINO model for this checkpoint,
+    exporting it onto the shared volume first if no pod has done so yet.
+    """
+    stem = Path(checkpoint).stem
+    export_root = Path(EXPORT_DIR)
+    target_dir = export_root / f"{stem}-{_checkpoint_hash(checkpoint)}-{target_runtime}-{INPUT_SIZE}"
+    artifact_name = f"{stem}.onnx" if target_runtime == "onnx" else f"{stem}_openvino_model"
+    artifact = target_dir / artifact_name
+    if artifact.exists():
+        logger.info(f"Found exported {target_runtime} model at {artifact}.")
+        return str(artifact)
+
+    export_root.mkdir(parents=True, exist_ok=True)
+    # Serialize exports across pods sharing the volume
+    with open(export_root / f"{target_dir.name}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if artifact.exists():
+            return str(artifact)
+        logger.info(f"Exporting {checkpoint} to {target_runtime} (imgsz={INPUT_SIZE}); this only happens once...")
+        # Ultralytics writes the export next to the weights, so export from a private staging copy
+        staging_dir = Path(tempfile.mkdtemp(dir=export_root))
+        try:
+            staged_checkpoint = staging_dir / Path(checkpoint).name
+            shutil.copyfile(checkpoint, staged_checkpoint)
+            YOLO(str(staged_checkpoint)).export(format=target_runtime, imgsz=INPUT_SIZE, dynamic=True, verbose=False)
+            staged_checkpoint.unlink()
+            os.rename(staging_dir, target_dir) # Atomic publish
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+    logger.info(f"Exported {target_runtime} model to {artifact}.")
+    return str(artifact)
+
+def _limit_runtime_threads(yolo, artifact: str):
+    """Rebuilds the exported runtime's session with INTRA_OP_THREADS threads."""
+    backend = yolo.predictor.model # AutoBackend, created by the first predict()
+    # Newer ultralytics keeps the runtime objects on a per-format backend object
+    target = backend.__dict__.get("backend", backend)
+    if YOLO_RUNTIME == "onnx" and hasattr(target, "session"):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = INTRA_OP_THREADS
+        options.inter_op_num_threads = 1
+        target.session = onnxruntime.InferenceSession(artifact, options, providers=target.session.get_providers())
+    elif YOLO_RUNTIME == "openvino" and hasattr(target, "ov_compiled_model"):
+        import openvino
+        xml_path = next(Path(artifact).glob("*.xml"))
+        target.ov_compiled_model = openvino.Core().compile_model(
+            str(xml_path), "CPU", {"PERFORMANCE_HINT": "LATENCY", "INFERENCE_NUM_THREADS": INTRA_OP_THREADS})
+    else:
+        logger.warning(f"Could not apply YOLO_INTRA_OP_THREADS to the {YOLO_RUNTIME} runtime; using its default.")
+        return
+    logger.info(f"Limited the {YOLO_RUNTIME} runtime to {INTRA_OP_THREADS} intra-op threads.")
+
+def _warm_up(name: str, yolo):
+    """Runs throwaway inferences so graph compilation and allocation happen before serving."""
+    blank = np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    for batch_size in sorted({1, batching.BATCH_MAX_SIZE}):
+        for _ in range(WARMUP_RUNS):
+            start = time.perf_counter()
+            yolo.predict(source=[blank] * batch_size, imgsz=INPUT_SIZE, conf=CONFIDENCE_THRESHOLD,
+                         device=DEVICE, verbose=False)
+            # Seeds the latency estimate, so latency-based selection works from the first request
+            seconds_per_image[name] = (time.perf_counter() - start) / batch_size
+    logger.info(f"Warm-up of '{name}' complete ({WARMUP_RUNS} runs at batch sizes 1 and {batching.BATCH_MAX_SIZE}).")
+
+def _load_one(name: str, checkpoint: str) -> tuple:
+    """Loads one registry checkpoint with the configured runtime; returns the model and the file it was loaded from."""
+    if not os.path.exists(checkpoint):
+        raise RuntimeError(f"Model file for '{name}' not found at {checkpoint}. Init container might have failed.")
+    if YOLO_RUNTIME == "pytorch":
+        artifact = checkpoint
+        yolo = YOLO(artifact)
+    else:
+        artifact = _exported_artifact(checkpoint, YOLO_RUNTIME)
+        yolo = YOLO(artifact, task="detect")
+    # You can explicitly move the model to a device if needed,
+    # but YOLO often handles device placement automatically during predict.
+    return yolo, artifact
+
+def _warm_up_all(loaded: dict):
+    global ready
+    with startup.phase("warmup", next_state="warming_up"):
+        for name, (yolo, artifact) in loaded.items():
+            _warm_up(name, yolo)
+            if INTRA_OP_THREADS > 0 and YOLO_RUNTIME != "pytorch":
+                _limit_runtime_threads(yolo, artifact)
+                _warm_up(name, yolo)
+    ready = True
+
+def load_model(warm_up: bool = True):
+    """
+    Loads every registry model, exporting them to the configured runtime if needed, and warms them up.
+
+    serve.py's master process passes `warm_up=False`: it loads with one
+    intra-op thread and runs no inference, so no thread pool exists when the
+    workers are forked. PyTorch models are fused up front so the workers
+    share the fused weights. Each worker's own load_model() call then only
+    warms up.
+    """
+    global model, models, runtime, ready
     if model:
+        if warm_up and not ready:
+            _warm_up_all({name: (yolo, MODEL_REGISTRY[name]) for name, yolo in models.items()})
         logger.info("YOLOv8 model already loaded.")
         return
     try:
-        logger.info(f"Loading YOLOv11 model '{MODEL_NAME}' onto device '{DEVICE}'...")
-        # Initialize YOLO model
-        if not os.path.exists(MODEL_PATH_ON_VOLUME):
-               raise RuntimeError(f"Model file not found at {MODEL_PATH_ON_VOLUME}. Init container might have failed.")
-        model = YOLO(MODEL_PATH_ON_VOLUME)
-        # You can explicitly move the model to a device if needed,
-        # but YOLO often handles device placement automatically during predict.
-        # model.to(DEVICE) # Usually not required unless specific device needed upfront
-        logger.info(f"YOLOv11 model '{MODEL_NAME}' loaded successfully.")
+        if YOLO_RUNTIME not in ("pytorch", "onnx", "openvino"):
+            raise ValueError(f"Unknown YOLO_RUNTIME '{YOLO_RUNTIME}'. Use 'pytorch', 'onnx' or 'openvino'.")
+        if MODEL_NAME not in MODEL_REGISTRY:
+            raise ValueError(f"YOLO_DEFAULT_MODEL '{MODEL_NAME}' is not in YOLO_MODELS ({', '.join(MODEL_REGISTRY)}).")
+        # Read the checkpoints from the volume while torch imports; exports are keyed by their hash, so they're read too
+        startup.prefetch([path for path in MODEL_REGISTRY.values() if os.path.exists(path)])
+        import_runtime()
+        logger.info(f"Loading YOLOv11 models {list(MODEL_REGISTRY)} (default '{MODEL_NAME}') onto device "
+                    f"'{DEVICE}' with runtime '{YOLO_RUNTIME}'...")
+        if not warm_up:
+            torch.set_num_threads(1)
+        elif INTRA_OP_THREADS > 0:
+            torch.set_num_threads(INTRA_OP_THREADS)
+        runtime = YOLO_RUNTIME
+        with startup.phase("load"):
+            loaded = {name: _load_one(name, checkpoint) for name, checkpoint in MODEL_REGISTRY.items()}
+        if warm_up:
+            _warm_up_all(loaded)
+        elif YOLO_RUNTIME == "pytorch":
+            for yolo, _ in loaded.values():
+                yolo.fuse() # Otherwise the first predict in each worker fuses a private copy
+        models = {name: yolo for name, (yolo, _) in loaded.items()}
+        model = models[MODEL_NAME]
+        instrumentation.set_model_labels(MODEL_NAME, runtime)
+        logger.info(f"YOLOv11 models {list(models)} loaded successfully.")
     except Exception as e:
         logger.error(f"Error loading YOLOv11 model: {e}", exc_info=True)
         model = None # Reset on failure
+        models = {}
+        ready = False
         raise RuntimeError(f"Failed to load ML model: {e}")
 
+def inference_params(model_name: str | None = None) -> dict:
+    """Returns the model settings that affect detection results (used in cache keys)."""
+    return {"model": model_name or MODEL_NAME, "runtime": runtime, "imgsz": INPUT_SIZE,
+            "confidence": CONFIDENCE_THRESHOLD}
+
 # --- Inference ---
-def detect_objects(image_bytes: bytes) -> list:
-    """Detects objects in the given image bytes using YOLOv8."""
-    global model
+def decode_image(image_bytes: bytes) -> DecodedImage:
+    """Decodes image bytes into an RGB image near YOLO's input resolution."""
+    logger.debug("Opening image from bytes for YOLOv8 detection.")
+    return ingest.decode_image(image_bytes, target_size=INPUT_SIZE)
 
-    if not model:
-        raise RuntimeError("YOLOv11 model is not loaded.")
+def decode_and_hash(image_bytes: bytes) -> tuple:
+    """Decodes image bytes and computes the (dhash, thumbnail) fingerprint used for near-duplicate lookup."""
+    decoded = decode_image(image_bytes)
+    return decoded, near_duplicate.fingerprint(decoded.image)
 
+def scale_detections(detections: list, scale_x: float, scale_y: float) -> list:
+    """Returns copies of the detections with boxes scaled into another image size."""
+    return [
+        {**det, "box": [round(det["box"][0] * scale_x), round(det["box"][1] * scale_y),
+                        round(det["box"][2] * scale_x), round(det["box"][3] * scale_y)]}
+        for det in detections
+    ]
+
+def _format_detections(result, confidence: float) -> list:
+    """Converts one ultralytics result into a list of detection dicts scoring at least `confidence`."""
     detections = []
-    try:
-        logger.debug("Opening image from bytes for YOLOv8 detection.")
-        # Read image bytes into a PIL Image
-        pil_image = Image.open(BytesIO(image_bytes))
-        if pil_image.mode != "RGB":
-            pil_image = pil_image.convert("RGB")
+    boxes = result.boxes # Access the Boxes object containing detections
+    instrumentation.trace(logger, "raw_boxes",
+                          lambda: f"Raw YOLOv11 prediction results: {len(boxes)} potential boxes, "
+                                  f"scores {boxes.conf.cpu().numpy().round(3).tolist()}.")
+    # Extract data
+    box_coords_list = boxes.xyxy.cpu().numpy().tolist() # Bounding boxes in xyxy format
+    scores_list = boxes.conf.cpu().numpy().tolist()     # Confidence scores
+    class_ids_list = boxes.cls.cpu().numpy().astype(int).tolist() # Class IDs
+    class_names = result.names # Dictionary mapping class IDs to names
+
+    # Format results
+    for box, score, class_id in zip(box_coords_list, scores_list, class_ids_list):
+         # Check confidence again (though predict should have filtered)
+         if score >= confidence:
+             label = class_names.get(class_id, f"Unknown class {class_id}")
+             # Ensure box coordinates are integers
+             box_int = [round(coord) for coord in box]
+             detections.append({
+                 "label": label,
+                 "score": round(score, 4),
+                 "box": box_int # [xmin, ymin, xmax, ymax]
+             })
+    return detections
+
+def _record_model_latency(name: str, seconds: float, images: int):
+    MODEL_INFERENCE_SECONDS.labels(model=name).observe(seconds)
+    MODEL_IMAGES.labels(model=name).inc(images)
+    previous = seconds_per_image.get(name)
+    latest = seconds / images
+    seconds_per_image[name] = latest if previous is None else previous + LATENCY_SMOOTHING * (latest - previous)
+
+def latency_estimates() -> dict:
+    """This process's per-image predict time estimates, for a parent process to adopt."""
+    return dict(seconds_per_image)
+
+def _record_predict_stages(results: list):
+    """Records ultralytics' own preprocess/inference/postprocess timings (per-image ms) for the whole batch."""
+    speed = results[0].speed or {}
+    for stage in ("preprocess", "inference", "postprocess"):
+        if speed.get(stage) is not None:
+            instrumentation.record(stage, speed[stage] * len(results) / 1000.0)
 
-        # Convert PIL Image to NumPy array (OpenCV format - BGR)
+def detect_objects_batch(images: list, model_name: str | None = None,
+                         confidence: float = CONFIDENCE_THRESHOLD) -> list:
+    """
+    Runs one batched YOLO forward pass over decoded RGB images.
+
+    Uses the registry model `model_name` (default MODEL_NAME) and keeps
+    detections scoring at least `confidence`. Returns one list of detections
+    per input image, in input order, with boxes in the coordinates of the
+    images as passed in.
+    """
+    name = model_name or MODEL_NAME
+    yolo = models.get(name)
+    if yolo is None:
+        raise RuntimeError(f"YOLOv11 model '{name}' is not loaded.")
+    if not images:
+        return []
+
+    try:
+        logger.debug(f"Performing YOLOv11 object detection inference on a batch of {len(images)}...")
         # Ultralytics predict can often handle PIL directly, but NumPy is robust
-        img_np = np.array(pil_image)
         # No need to convert RGB -> BGR, ultralytics handles it
-        # img_np = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR) # Not needed for ultralytics>=8
-
-        logger.debug("Performing YOLOv11 object detection inference...")
-
-        # Perform prediction
-        # Pass image directly, specify confidence, device, and disable verbose logs
-        results = model.predict(source=img_np,
-                                conf=CONFIDENCE_THRESHOLD,
-                                device=DEVICE,
-                                verbose=False) # Set verbose=True for debugging if needed
-
-        # Check if results is a list and has items
-        if not results or len(results) == 0:
-             logger.info("YOLOv11 prediction returned no results.")
-             return []
-
-        # Process results - results is a list, usually with one element for single image
-        result = results[0] # Get the results for the first (and only) image
-        boxes = result.boxes # Access the Boxes object containing detections
-        logger.info(f"Raw YOLOv11 prediction results: {len(boxes)} potential boxes found before filtering.")
-        if len(boxes) > 0:
-            raw_scores = boxes.conf.cpu().numpy().tolist()
-            logger.info(f"Raw Scores (before threshold): {raw_scores}")
-        # Extract data
-        box_coords_tensor = boxes.xyxy # Bounding boxes in xyxy format (Tensor)
-        scores_tensor = boxes.conf     # Confidence scores (Tensor)
-        class_ids_tensor = boxes.cls   # Class IDs (Tensor)
-        class_names = result.names     # Dictionary mapping class IDs to names
-
-        # Convert tensors to lists
-        box_coords_list = box_coords_tensor.cpu().numpy().tolist()
-        scores_list = scores_tensor.cpu().numpy().tolist()
-        class_ids_list = class_ids_tensor.cpu().numpy().astype(int).tolist()
-
-        logger.debug(f"Raw detections: {len(box_coords_list)}")
-
-        # Format results
-        for box, score, class_id in zip(box_coords_list, scores_list, class_ids_list):
-             # Check confidence again (though predict should have filtered)
-             if score >= CONFIDENCE_THRESHOLD:
-                 label = class_names.get(class_id, f"Unknown class {class_id}")
-                 # Ensure box coordinates are integers
-                 box_int = [round(coord) for coord in box]
-                 detections.append({
-                     "label": label,
-                     "score": round(score, 4),
-                     "box": box_int # [xmin, ymin, xmax, ymax]
-                 })
-                 logger.debug(f"Detected: {label} (Score: {score:.4f}) at Box: {box_int}")
-
-        logger.info(f"YOLOv8 detection complete. Found {len(detections)} objects above threshold {CONFIDENCE_THRESHOLD}.")
-        return detections
+        sources = [np.asarray(image) for image in images]
+        # Pass the whole batch at once, specify confidence, device, and disable verbose logs
+        start = time.perf_counter()
+        results = yolo.predict(source=sources,
+                               imgsz=INPUT_SIZE,
+                               conf=confidence,
+                               device=DEVICE,
+                               verbose=False) # Set verbose=True for debugging if needed
+        _record_model_latency(name, time.perf_counter() - start, len(images))
+
+        # Check if results is a list with one entry per image
+        if not results or len(results) != len(images):
+             raise RuntimeError(f"Expected {len(images)} results from YOLOv11, got {len(results) if results else 0}.")
+        _record_predict_stages(results)
+
+        with instrumentation.stage("format"):
+            batch_detections = [_format_detections(result, confidence) for result in results]
+        instrumentation.trace(logger, "batch_done",
+                              lambda: f"YOLOv8 '{name}' detection complete for batch of {len(images)}. Found "
+                                      f"{sum(len(d) for d in batch_detections)} objects above threshold {confidence}.")
+        return batch_detections
 
     except Exception as e:
         logger.error(f"Error during YOLOv8 object detection: {e}", exc_info=True)
         # Re-raise as a ValueError to be caught in the endpoint
-        raise ValueError(f"Object detection failed: {e}")
\ No newline at end of file
+        raise ValueError(f"Object detection failed: {e}")
+
+def detect_objects(image_bytes: bytes) -> list:
+    """Detects objects in the given image bytes using YOLOv8."""
+    decoded = decode_image(image_bytes)
+    detections = detect_objects_batch([decoded.image])[0]
+    return scale_detections(detections, decoded.scale, decoded.scale)
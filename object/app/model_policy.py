@@ -0,0 +1,129 @@
+import logging
+import os
+
+from prometheus_client import Counter
+
+from . import model_loader
+from .shared import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# How the model is chosen for requests without a quality hint ("auto"):
+#   "fixed" - always the default model (YOLO_DEFAULT_MODEL)
+#   "queue" - one registry size smaller than the default per MODEL_POLICY_QUEUE_STEP requests waiting
+#   "slo"   - the largest model up to the default whose estimated latency at the current backlog
+#             fits in MODEL_POLICY_LATENCY_SLO_MS
+POLICIES = ("fixed", "queue", "slo")
+MODEL_POLICY = os.getenv("MODEL_POLICY", "fixed").lower()
+MODEL_POLICY_QUEUE_STEP = int(os.getenv("MODEL_POLICY_QUEUE_STEP", "8"))
+MODEL_POLICY_LATENCY_SLO_MS = float(os.getenv("MODEL_POLICY_LATENCY_SLO_MS", "500"))
+# Client hints: "fast" is the smallest model, "accurate" the largest, "balanced" the middle one
+QUALITY_HINTS = ("auto", "fast", "balanced", "accurate")
+
+# Cascade: run the smallest model first and only escalate to the chosen model when one of its
+# candidates scores between the two thresholds, i.e. when it is unsure what it saw.
+CASCADE_ENABLED = os.getenv("MODEL_CASCADE", "false").lower() == "true"
+CASCADE_MIN_CONFIDENCE = float(os.getenv("MODEL_CASCADE_MIN_CONFIDENCE", "0.2")) # Lower candidates are noise
+CASCADE_ACCEPT_CONFIDENCE = float(os.getenv("MODEL_CASCADE_ACCEPT_CONFIDENCE", "0.6")) # Higher ones are trusted
+
+# --- Metrics ---
+MODEL_SELECTED = Counter("object_model_selected_total", "Requests routed to each model, by reason.", ["model", "reason"])
+CASCADE_OUTCOMES = Counter("object_cascade_total", "Cascaded requests, by whether the small model's answer was kept.",
+                           ["outcome"])
+
+if MODEL_POLICY not in POLICIES:
+    raise ValueError(f"Unknown MODEL_POLICY '{MODEL_POLICY}'. Use one of {', '.join(POLICIES)}.")
+
+
+def smallest_model() -> str:
+    return next(iter(model_loader.MODEL_REGISTRY))
+
+
+def cascade_applies(model_name: str) -> bool:
+    """True if requests for `model_name` should try the smallest model first."""
+    return CASCADE_ENABLED and model_name != smallest_model()
+
+
+def cascade_params() -> dict:
+    """Cascade settings that affect results (used in cache keys)."""
+    return {"first": smallest_model(), "min": CASCADE_MIN_CONFIDENCE, "accept": CASCADE_ACCEPT_CONFIDENCE}
+
+
+def is_ambiguous(candidates: list) -> bool:
+    """True if any small-model candidate falls between the noise and the accept thresholds."""
+    return any(CASCADE_MIN_CONFIDENCE <= det["score"] < CASCADE_ACCEPT_CONFIDENCE for det in candidates)
+
+
+def record_cascade(escalated: bool):
+    CASCADE_OUTCOMES.labels(outcome="escalated" if escalated else "accepted").inc()
+
+
+def estimated_latency(model_name: str, backlog: int) -> float | None:
+    """Seconds until a request queued behind `backlog` others would be detected, or None if unknown."""
+    per_image = model_loader.seconds_per_image.get(model_name)
+    return None if per_image is None else per_image * (backlog + 1)
+
+
+def _hinted(quality: str) -> int | None:
+    """Registry index a quality hint always maps to, or None for "auto"."""
+    if quality not in QUALITY_HINTS:
+        raise ValueError(f"Unknown quality '{quality}'. Use one of {', '.join(QUALITY_HINTS)}.")
+    last = len(model_loader.MODEL_REGISTRY) - 1
+    return {"fast": 0, "balanced": last // 2, "accurate": last}.get(quality)
+
+
+def cache_params(model_name: str, cascade: bool = True) -> dict:
+    """
+    Settings that decide the detections of a request served by `model_name` (used in cache keys).
+
+    Keyed by the model the policy picks for the request now, so a result
+    computed by a smaller model under load is never served once the load has
+    gone. Pass `cascade=False` for paths that never cascade.
+    """
+    params = model_loader.inference_params(model_name)
+    return {**params, "cascade": cascade_params()} if cascade and cascade_applies(model_name) else params
+
+
+def select(quality: str = "auto", backlog: int = 0) -> tuple:
+    """Returns `(model name, reason)` for a request without recording it; see choose()."""
+    names = list(model_loader.MODEL_REGISTRY)
+    default = names.index(model_loader.MODEL_NAME)
+    hinted = _hinted(quality)
+
+    if hinted is not None:
+        index, reason = hinted, "hint"
+    elif MODEL_POLICY == "queue":
+        index = max(0, default - backlog // max(1, MODEL_POLICY_QUEUE_STEP))
+        reason = "queue" if index < default else "default"
+    elif MODEL_POLICY == "slo":
+        index = default
+        while index > 0:
+            estimate = estimated_latency(names[index], backlog)
+            if estimate is None or estimate * 1000.0 <= MODEL_POLICY_LATENCY_SLO_MS:
+                break
+            index -= 1
+        reason = "slo" if index < default else "default"
+    else:
+        index, reason = default, "default"
+    return names[index], reason
+
+
+def record_choice(model_name: str, reason: str, quality: str, backlog: int):
+    """Counts a selection in object_model_selected_total; called only for requests that run inference."""
+    MODEL_SELECTED.labels(model=model_name, reason=reason).inc()
+    instrumentation.trace(logger, "model_selected",
+                          lambda: f"Selected model '{model_name}' ({reason}) for quality '{quality}' "
+                                  f"with {backlog} requests waiting.")
+
+
+def choose(quality: str = "auto", backlog: int = 0) -> str:
+    """
+    Returns the registry model to serve a request with, and records the choice.
+
+    `quality` is the client's hint and `backlog` the number of requests
+    already waiting for a detection.
+    """
+    model_name, reason = select(quality, backlog)
+    record_choice(model_name, reason, quality, backlog)
+    return model_name
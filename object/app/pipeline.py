@@ -0,0 +1,194 @@
+import functools
+import json
+import logging
+
+from service_common import batching, cache, jobs, near_duplicate
+from service_common.executor import INTERACTIVE
+
+from . import model_loader, model_policy, tiling
+from .shared import SERVICE, bulk, inference_executor
+
+logger = logging.getLogger(__name__)
+
+# --- Batching ---
+# Concurrent detection requests for the same model share one model.predict call
+detection_batchers = {
+    name: batching.MicroBatcher(functools.partial(model_loader.detect_objects_batch, model_name=name),
+                                name="detection" if name == model_loader.MODEL_NAME else f"detection-{name}",
+                                executor=inference_executor)
+    for name in model_loader.MODEL_REGISTRY
+}
+# The cascade's first pass keeps low-confidence candidates, so it can't share the small model's batches
+cascade_batcher = None
+if model_policy.CASCADE_ENABLED and len(model_loader.MODEL_REGISTRY) > 1:
+    cascade_batcher = batching.MicroBatcher(
+        functools.partial(model_loader.detect_objects_batch, model_name=model_policy.smallest_model(),
+                          confidence=min(model_policy.CASCADE_MIN_CONFIDENCE, model_loader.CONFIDENCE_THRESHOLD)),
+        name="cascade", executor=inference_executor)
+all_batchers = list(detection_batchers.values()) + ([cascade_batcher] if cascade_batcher else [])
+detections_in_flight = 0
+
+# --- Result Cache ---
+# Repeated uploads of the same image skip inference entirely
+result_cache = cache.ResultCache(SERVICE, cache.LRUCache(SERVICE), cache.create_shared_backend(SERVICE))
+
+# --- Near-Duplicate Index ---
+# Re-encoded, resized or EXIF-stripped copies of an image reuse its detections
+near_duplicates = near_duplicate.NearDuplicateIndex(SERVICE)
+
+# --- Background Jobs ---
+# Jobs submitted through the job API run in the executor's bulk lane
+job_store = jobs.create_job_store(SERVICE)
+job_runner = None
+
+async def start():
+    """Starts the inference executor, batching task and job workers (call after the model is loaded)."""
+    global job_runner
+    # Process workers measure predict times the latency-based policy needs here
+    inference_executor.start(initializer=model_loader.load_model,
+                             worker_state=(model_loader.latency_estimates, model_loader.seconds_per_image.update))
+    for batcher in all_batchers:
+        await batcher.start()
+    if job_store is not None and model_loader.model:
+        job_runner = jobs.JobRunner(job_store, detect, bulk)
+        await job_runner.start()
+
+async def stop():
+    """Stops job workers and batching, failing any requests still waiting, then the executor."""
+    if job_runner is not None:
+        await job_runner.stop()
+    for batcher in all_batchers:
+        await batcher.stop()
+    inference_executor.shutdown()
+
+def backlog() -> int:
+    """
+    Detections already in progress, the load signal for model selection.
+
+    Requests still being decoded or read count too, so a burst is seen before
+    it reaches the queues; the queue depths cover frames and analyze requests.
+    """
+    queued = inference_executor.queue_depth + sum(batcher.queue_depth for batcher in all_batchers)
+    return max(detections_in_flight, queued)
+
+async def detect(image_bytes: bytes, tile_options: dict | None = None, lane: str = INTERACTIVE,
+                 quality: str = "auto") -> list:
+    """
+    Returns detections for the image, from the result cache when possible.
+
+    Pass `tile_options` (keyword arguments for tiling.detect_tiled) to detect
+    on overlapping full-resolution tiles instead of the downscaled image.
+    Batch and background-job callers pass `lane=BULK` so they never delay
+    interactive requests. `quality` is the client's model hint (see
+    model_policy.choose).
+    """
+    detections, _ = await detect_with_model(image_bytes, tile_options, lane, quality)
+    return detections
+
+async def detect_with_model(image_bytes: bytes, tile_options: dict | None = None, lane: str = INTERACTIVE,
+                            quality: str = "auto", decoded=None) -> tuple:
+    """
+    Like detect(), but returns `(detections, model name)`.
+
+    Pass `decoded` (an ingest.DecodedImage from ingest.decode_raw) when
+    `image_bytes` is an already-decoded frame; it goes straight to the
+    batcher, skipping decoding and the near-duplicate index.
+
+    The cache is keyed by the model the policy picks now; the choice is only
+    recorded in the selection metrics for misses.
+    """
+    load = backlog()
+    model_name, reason = model_policy.select(quality, load)
+    params = model_policy.cache_params(model_name, cascade=not tile_options) # Tiling is already the accurate path
+    if tile_options:
+        params = {**params, "tiling": tile_options}
+    elif decoded is not None: # Equal bytes are only the same frame if the shape is the same too
+        params = {**params, "shape": list(decoded.image.shape)}
+    key = cache.make_key(image_bytes, params)
+    result = await result_cache.get_or_compute(
+        key, lambda: _detect_with_chosen_model(image_bytes, tile_options, lane, decoded, model_name,
+                                               (reason, quality, load)))
+    return result["objects"], result["model"]
+
+async def _detect_with_chosen_model(image_bytes: bytes, tile_options: dict | None, lane: str, decoded,
+                                    model_name: str, choice: tuple) -> dict:
+    """Detects with the chosen model on a cache miss; `choice` is (reason, quality, backlog) for the metrics."""
+    global detections_in_flight
+    model_policy.record_choice(model_name, *choice)
+    detections_in_flight += 1
+    try:
+        if tile_options:
+            return await _detect_tiled(image_bytes, tile_options, model_name, lane)
+        cascade = model_policy.cascade_applies(model_name)
+        if decoded is not None:
+            return await _detect_routed(decoded, model_name, cascade, lane)
+        return await _detect_uncached(image_bytes, model_name, cascade, lane)
+    finally:
+        detections_in_flight -= 1
+
+async def detect_decoded(image_bytes: bytes, decode) -> list:
+    """
+    Like detect(), but on a cache miss awaits `decode()` for the image instead of decoding it here.
+
+    Lets a caller that runs several models on one upload decode it only once;
+    `decode()` must return an ingest.DecodedImage no smaller than INPUT_SIZE.
+    Always uses the default model.
+    """
+    key = cache.make_key(image_bytes, model_loader.inference_params())
+    result = await result_cache.get_or_compute(key, lambda: _detect_decoded_lazily(decode))
+    return result["objects"]
+
+async def _detect_decoded_lazily(decode) -> dict:
+    decoded = await decode()
+    return {"model": model_loader.MODEL_NAME, "objects": await _detect_decoded(decoded, model_loader.MODEL_NAME)}
+
+async def detect_frame(image_bytes: bytes) -> list:
+    """Detects objects in one streamed video frame; frames skip both caches since they rarely repeat exactly."""
+    decoded = await inference_executor.run(model_loader.decode_image, image_bytes)
+    return await _detect_decoded(decoded, model_loader.MODEL_NAME)
+
+async def _detect_tiled(image_bytes: bytes, tile_options: dict, model_name: str, lane: str) -> dict:
+    """Runs tiled detection as one executor job; its tiles are batched together, not with other requests."""
+    options = {**tile_options, "model_name": model_name}
+    detections = await inference_executor.run(tiling.detect_tiled_bytes, image_bytes, options, lane=lane)
+    return {"model": model_name, "objects": detections}
+
+async def _detect_uncached(image_bytes: bytes, model_name: str, cascade: bool, lane: str) -> dict:
+    """Decodes the image on the inference executor and queues it for batched detection."""
+    if not near_duplicate.NEAR_DUPLICATE_ENABLED:
+        decoded = await inference_executor.run(model_loader.decode_image, image_bytes, lane=lane)
+        return await _detect_routed(decoded, model_name, cascade, lane)
+
+    decoded, (image_hash, image_thumbnail) = await inference_executor.run(model_loader.decode_and_hash, image_bytes, lane=lane)
+    width, height = decoded.original_size
+    namespace = json.dumps({**model_loader.inference_params(model_name), "cascade": cascade}, sort_keys=True)
+
+    match = near_duplicates.lookup(namespace, image_hash, image_thumbnail)
+    if match is not None:
+        (result, (prev_width, prev_height)), distance = match
+        logger.debug(f"Reusing detections from a near-duplicate image (hamming distance {distance}).")
+        return {**result, "objects": model_loader.scale_detections(result["objects"], width / prev_width,
+                                                                   height / prev_height)}
+
+    result = await _detect_routed(decoded, model_name, cascade, lane)
+    near_duplicates.add(namespace, image_hash, (result, (width, height)), image_thumbnail)
+    return result
+
+async def _detect_routed(decoded, model_name: str, cascade: bool, lane: str) -> dict:
+    """Detects with `model_name`, or with the smallest model first when cascading."""
+    if cascade:
+        candidates = await _detect_decoded(decoded, model_policy.smallest_model(), lane, batcher=cascade_batcher)
+        escalate = model_policy.is_ambiguous(candidates)
+        model_policy.record_cascade(escalate)
+        if not escalate:
+            return {"model": model_policy.smallest_model(),
+                    "objects": [det for det in candidates if det["score"] >= model_loader.CONFIDENCE_THRESHOLD]}
+    return {"model": model_name, "objects": await _detect_decoded(decoded, model_name, lane)}
+
+async def _detect_decoded(decoded, model_name: str, lane: str = INTERACTIVE, batcher=None) -> list:
+    """Runs batched detection and maps boxes back to the full-resolution image."""
+    batcher = batcher or detection_batchers[model_name]
+    detections = await batcher.submit(decoded.image, lane)
+    if decoded.scale != 1.0:
+        detections = model_loader.scale_detections(detections, decoded.scale, decoded.scale)
+    return detections
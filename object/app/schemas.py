@@ -12,8 +12,53 @@ class ObjectDetectionResponse(BaseModel):
     """Response schema for the object detection endpoint."""
     filename: str
     objects: List[DetectedObject]
+    model: str | None = Field(None, description="Name of the model that produced the detections.")
     error: str | None = None
 
+class BatchDetectionItem(ObjectDetectionResponse):
+    """One line of the NDJSON stream returned by batch detection."""
+    index: int = Field(..., description="Position of the image in the request (archives expanded in order).")
+
+class TrackedObject(DetectedObject):
+    """A detected object in a video frame, with an id that persists across frames."""
+    track_id: int = Field(..., description="Identifier of the track this object belongs to.")
+
+class VideoFrameDetections(BaseModel):
+    """One line of the NDJSON stream returned by video detection."""
+    frame: int = Field(..., description="Zero-based frame index.")
+    timestamp_ms: float | None = Field(None, description="Frame timestamp, when the frame rate is known.")
+    keyframe: bool = Field(..., description="True if the model ran on this frame; False if boxes come from the tracker.")
+    objects: List[TrackedObject] = []
+
+class JobRequest(BaseModel):
+    """Request body for submitting a detection job."""
+    images: List[str] = Field(..., description="Image references: paths relative to the job input directory, or http(s) URLs on allowed hosts.")
+
+class JobStatus(BaseModel):
+    """Status and progress of a detection job."""
+    job_id: str
+    status: str = Field(..., description="One of queued, running, succeeded, failed, cancelled.")
+    total: int = Field(..., description="Number of images in the job.")
+    completed: int = Field(..., description="Images detected successfully so far.")
+    failed: int = Field(..., description="Images that could not be processed so far.")
+    error: str | None = None
+    created_at: float
+    updated_at: float
+
+class JobResultItem(BaseModel):
+    """Detections for one image of a job."""
+    index: int
+    reference: str
+    status: str = Field(..., description="pending, done or error.")
+    objects: List[DetectedObject] | None = None
+    error: str | None = None
+
+class JobResultsResponse(BaseModel):
+    """A page of job results, in input order."""
+    job_id: str
+    items: List[JobResultItem]
+    next_offset: int | None = Field(None, description="Offset of the next page, or null if this is the last one.")
+
 class HealthCheckResponse(BaseModel):
     """Response schema for health check."""
     status: str
\ No newline at end of file
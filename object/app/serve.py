@@ -0,0 +1,63 @@
+"""
+Serves the app with one or more uvicorn worker processes.
+
+    python -m app.serve --host 0.0.0.0 --port 8001
+
+With SERVE_WORKERS=1 (the default) this is plain uvicorn. With more workers,
+the model is loaded once in a master process, the master's heap is frozen
+out of the garbage collector, and workers are forked from it. All workers
+then share the weights and the imported libraries copy-on-write instead of
+each holding a private copy. Each worker gets its own share of the CPU
+cores for torch intra-op threads, and the master restarts workers that die.
+The master runs no inference; each worker warms up after the fork.
+
+Metrics are aggregated across workers through PROMETHEUS_MULTIPROC_DIR.
+Preloading needs CPU inference with the pytorch runtime. With onnx or
+openvino the workers load their own sessions after the fork (each limited to
+its share of the cores), and only the imported libraries are shared.
+
+Measured with benchmarks/bench_prefork_memory.py --full-size (untrained
+YOLO11m, CPU, pytorch runtime). Each worker's warm-up at batch size 8
+leaves its activation buffers in that worker's private heap:
+
+    workers   pod PSS   private/worker   same capacity as separate pods
+          1   1445MiB          1435MiB          1456MiB
+          2   2112MiB           673MiB          2912MiB
+          4   3441MiB           668MiB          5824MiB
+"""
+import logging
+import sys
+
+from service_common import serve
+
+logger = logging.getLogger(__name__)
+
+FORK_SAFE_RUNTIMES = ("pytorch",) # ONNX Runtime and OpenVINO thread pools don't survive a fork
+
+
+def _preload_supported(model_loader) -> bool:
+    if model_loader.DEVICE != "cpu":
+        logger.warning("CUDA cannot be shared across fork; each worker loads its own model.")
+        return False
+    if model_loader.YOLO_RUNTIME not in FORK_SAFE_RUNTIMES:
+        logger.warning(f"The {model_loader.YOLO_RUNTIME} runtime is not fork-safe; each worker loads its own model.")
+        return False
+    return True
+
+
+def _configure_worker(threads: int):
+    import torch
+
+    from . import model_loader
+
+    torch.set_num_threads(threads)
+    if model_loader.INTRA_OP_THREADS <= 0: # Applied to onnx/openvino sessions the worker builds itself
+        model_loader.INTRA_OP_THREADS = threads
+
+
+def main():
+    return serve.main(__package__, __doc__, 8001, _preload_supported, _configure_worker)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+"""
+This service's instances of the shared serving components (see service_common).
+
+Metrics of every component are exported as object_*.
+"""
+from service_common.bulk import Bulk
+from service_common.executor import InferenceExecutor
+from service_common.ingest import Ingest
+from service_common.instrumentation import Instrumentation
+from service_common.startup import Startup
+
+SERVICE = "object"
+
+instrumentation = Instrumentation.for_service(SERVICE)
+# Shared by every endpoint in this service
+inference_executor = InferenceExecutor(SERVICE)
+ingest = Ingest(SERVICE)
+bulk = Bulk(ingest)
+startup = Startup(SERVICE)
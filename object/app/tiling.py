@@ -0,0 +1,168 @@
+import logging
+import math
+import os
+import time
+
+import numpy as np
+from PIL import Image
+from prometheus_client import Histogram
+
+from . import model_loader
+from .shared import ingest
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+TILE_SIZE = int(os.getenv("TILE_SIZE", "640"))               # Side of each square tile, in source pixels
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))       # Fraction of a tile shared with its neighbour
+TILE_BATCH_SIZE = int(os.getenv("TILE_BATCH_SIZE", "16"))    # Tiles per model.predict call
+TILE_MERGE = os.getenv("TILE_MERGE", "nms").lower()          # "nms" or "wbf"
+TILE_IOU_THRESHOLD = float(os.getenv("TILE_IOU_THRESHOLD", "0.5"))
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", "256"))     # Images needing more tiles are refused
+# Also run the whole (downscaled) image, so objects larger than a tile are still found in one piece
+TILE_FULL_IMAGE_PASS = os.getenv("TILE_FULL_IMAGE_PASS", "true").lower() == "true"
+MERGE_METHODS = ("nms", "wbf")
+
+# --- Metrics ---
+TILES_PER_IMAGE = Histogram(
+    "object_tiling_tiles_per_image",
+    "Number of tiles an image was sliced into for tiled detection.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+TILED_DETECTION_SECONDS = Histogram(
+    "object_tiling_detection_seconds",
+    "Time to slice, detect and merge one image in tiled mode.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+def _axis_offsets(length: int, tile: int, stride: int) -> list:
+    """Start offsets along one axis; the last tile is shifted back to end exactly at the edge."""
+    if length <= tile:
+        return [0]
+    offsets = list(range(0, length - tile, stride))
+    offsets.append(length - tile)
+    return offsets
+
+
+def make_tiles(width: int, height: int, tile_size: int = TILE_SIZE, overlap: float = TILE_OVERLAP) -> list:
+    """
+    Returns (xmin, ymin, xmax, ymax) windows covering the image with overlapping tiles.
+
+    Every tile is `tile_size` square unless the image itself is smaller along that axis.
+    """
+    if tile_size <= 0:
+        raise ValueError("tile_size must be positive.")
+    if not 0.0 <= overlap < 1.0:
+        raise ValueError("overlap must be in [0, 1).")
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in _axis_offsets(height, tile_size, stride)
+        for x in _axis_offsets(width, tile_size, stride)
+    ]
+
+
+def _pairwise_iou(box: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """IoU between one xyxy box and an (N, 4) array of boxes."""
+    ix0 = np.maximum(box[0], others[:, 0])
+    iy0 = np.maximum(box[1], others[:, 1])
+    ix1 = np.minimum(box[2], others[:, 2])
+    iy1 = np.minimum(box[3], others[:, 3])
+    intersection = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    other_areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    return intersection / np.maximum(area + other_areas - intersection, 1e-9)
+
+
+def _cluster(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> list:
+    """Greedily groups boxes around the highest-scoring remaining box; returns index arrays."""
+    order = np.argsort(-scores, kind="stable")
+    clusters = []
+    while order.size:
+        overlaps = _pairwise_iou(boxes[order[0]], boxes[order])
+        members = overlaps >= iou_threshold
+        members[0] = True
+        clusters.append(order[members])
+        order = order[~members]
+    return clusters
+
+
+def merge_detections(detections: list, method: str = TILE_MERGE, iou_threshold: float = TILE_IOU_THRESHOLD) -> list:
+    """
+    Merges duplicate detections from overlapping tiles, separately for each class.
+
+    "nms" keeps the highest-scoring box of each overlapping group; "wbf"
+    (weighted boxes fusion) replaces the group with the score-weighted
+    average box and the group's mean score.
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(f"Unknown merge method '{method}'. Use one of {', '.join(MERGE_METHODS)}.")
+
+    by_label = {}
+    for det in detections:
+        by_label.setdefault(det["label"], []).append(det)
+
+    merged = []
+    for label, group in by_label.items():
+        boxes = np.array([det["box"] for det in group], dtype=np.float64)
+        scores = np.array([det["score"] for det in group], dtype=np.float64)
+        for members in _cluster(boxes, scores, iou_threshold):
+            if method == "nms":
+                box, score = boxes[members[0]], scores[members[0]]
+            else:
+                weights = scores[members]
+                box = (boxes[members] * weights[:, None]).sum(axis=0) / weights.sum()
+                score = weights.mean()
+            merged.append({"label": label, "score": round(float(score), 4), "box": [round(c) for c in box]})
+    merged.sort(key=lambda det: det["score"], reverse=True)
+    return merged
+
+
+def detect_tiled(image: Image.Image, tile_size: int = TILE_SIZE, overlap: float = TILE_OVERLAP,
+                 batch_size: int = TILE_BATCH_SIZE, merge: str = TILE_MERGE, model_name: str | None = None) -> list:
+    """
+    Detects objects in a full-resolution image by running overlapping tiles through YOLO.
+
+    Tiles are predicted `batch_size` at a time with the registry model
+    `model_name` (default: the default model) and their detections are
+    shifted into full-image coordinates, then merged across tiles.
+    """
+    start = time.perf_counter()
+    width, height = image.size
+    windows = make_tiles(width, height, tile_size, overlap)
+    if len(windows) > TILE_MAX_TILES:
+        raise ValueError(f"Image of {width}x{height} needs {len(windows)} tiles of {tile_size}px; "
+                         f"the limit is {TILE_MAX_TILES}. Use a larger tile_size.")
+    TILES_PER_IMAGE.observe(len(windows))
+
+    detections = []
+    for i in range(0, len(windows), max(1, batch_size)):
+        chunk = windows[i:i + max(1, batch_size)]
+        results = model_loader.detect_objects_batch([image.crop(window) for window in chunk], model_name)
+        for (x0, y0, _, _), tile_detections in zip(chunk, results):
+            for det in tile_detections:
+                box = det["box"]
+                detections.append({**det, "box": [box[0] + x0, box[1] + y0, box[2] + x0, box[3] + y0]})
+
+    if TILE_FULL_IMAGE_PASS and len(windows) > 1:
+        scale = max(width, height) / model_loader.INPUT_SIZE
+        overview = image
+        if scale > 1.0:
+            overview = image.resize((max(1, math.floor(width / scale)), max(1, math.floor(height / scale))),
+                                    Image.Resampling.BILINEAR)
+        overview_detections = model_loader.detect_objects_batch([overview], model_name)[0]
+        detections.extend(model_loader.scale_detections(overview_detections,
+                                                        width / overview.size[0], height / overview.size[1]))
+
+    merged = merge_detections(detections, merge)
+    TILED_DETECTION_SECONDS.observe(time.perf_counter() - start)
+    logger.info(f"Tiled detection over {len(windows)} tiles of {tile_size}px: "
+                f"{len(detections)} raw detections merged to {len(merged)} with {merge}.")
+    return merged
+
+
+def detect_tiled_bytes(image_bytes: bytes, options: dict) -> list:
+    """Decodes image bytes at full resolution and runs tiled detection with the given options."""
+    decoded = ingest.decode_image(image_bytes, target_size=None)
+    return detect_tiled(decoded.image, **options)
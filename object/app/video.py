@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+
+import cv2
+import numpy as np
+from prometheus_client import Counter, Histogram
+
+from service_common.executor import BULK
+
+from . import model_loader
+from .shared import inference_executor
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+VIDEO_UPLOAD_MAX_BYTES = int(os.getenv("VIDEO_UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+VIDEO_BATCH_FRAMES = int(os.getenv("VIDEO_BATCH_FRAMES", "8"))   # Keyframes per model.predict call
+VIDEO_MIN_STRIDE = int(os.getenv("VIDEO_MIN_STRIDE", "1"))       # Detect every frame while the scene changes...
+VIDEO_MAX_STRIDE = int(os.getenv("VIDEO_MAX_STRIDE", "8"))       # ...and at most every Nth frame while it is stable
+VIDEO_TRACK_IOU = float(os.getenv("VIDEO_TRACK_IOU", "0.3"))     # Min IoU to continue a track
+VIDEO_TRACK_MAX_MISSES = int(os.getenv("VIDEO_TRACK_MAX_MISSES", "2")) # Keyframes a track may go undetected
+
+# --- Metrics ---
+VIDEO_FRAMES = Counter(
+    "object_video_frames_total",
+    "Video frames processed, by whether they were detected (keyframe) or carried by the tracker.",
+    ["kind"],
+)
+VIDEO_STRIDE = Histogram(
+    "object_video_stride",
+    "Frames between consecutive keyframes chosen by the adaptive stride.",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+
+
+def _iou(a: list, b: list) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class _Track:
+    __slots__ = ("track_id", "label", "score", "box", "velocity", "frame", "misses")
+
+    def __init__(self, track_id: int, det: dict, frame: int):
+        self.track_id = track_id
+        self.label = det["label"]
+        self.score = det["score"]
+        self.box = [float(c) for c in det["box"]]
+        self.velocity = [0.0, 0.0, 0.0, 0.0] # Box change per frame
+        self.frame = frame
+        self.misses = 0
+
+    def update(self, det: dict, frame: int):
+        elapsed = max(1, frame - self.frame)
+        self.velocity = [(new - old) / elapsed for new, old in zip(det["box"], self.box)]
+        self.box = [float(c) for c in det["box"]]
+        self.score = det["score"]
+        self.frame = frame
+        self.misses = 0
+
+    def predict(self, frame: int) -> dict:
+        elapsed = frame - self.frame
+        box = [round(c + v * elapsed) for c, v in zip(self.box, self.velocity)]
+        return {"label": self.label, "score": round(self.score, 4), "box": box, "track_id": self.track_id}
+
+
+class VideoTracker:
+    """
+    Carries detections between keyframes and decides how often to detect.
+
+    Keyframe detections are matched to existing tracks greedily by IoU within
+    each class. Frames between keyframes get every live track moved along its
+    last observed velocity. The stride doubles (up to VIDEO_MAX_STRIDE) each
+    time a keyframe matches the existing tracks one-to-one and drops back to
+    VIDEO_MIN_STRIDE as soon as an object appears or disappears.
+    """
+
+    def __init__(self, min_stride: int = VIDEO_MIN_STRIDE, max_stride: int = VIDEO_MAX_STRIDE,
+                 iou_threshold: float = VIDEO_TRACK_IOU, max_misses: int = VIDEO_TRACK_MAX_MISSES):
+        self.min_stride = max(1, min_stride)
+        self.max_stride = max(self.min_stride, max_stride)
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.stride = self.min_stride
+        self.last_keyframe = None
+        self._tracks = []
+        self._next_id = 1
+
+    def is_keyframe(self, frame: int) -> bool:
+        """True if `frame` is due for detection under the current stride."""
+        return self.last_keyframe is None or frame - self.last_keyframe >= self.stride
+
+    def on_keyframe(self, frame: int, detections: list) -> list:
+        """Updates tracks with a keyframe's detections and returns them with track ids."""
+        if self.last_keyframe is not None:
+            VIDEO_STRIDE.observe(frame - self.last_keyframe)
+        self.last_keyframe = frame
+        VIDEO_FRAMES.labels(kind="keyframe").inc()
+
+        candidates = sorted(
+            ((_iou(track.box, det["box"]), t, d)
+             for t, track in enumerate(self._tracks)
+             for d, det in enumerate(detections)
+             if track.label == det["label"]),
+            key=lambda match: match[0], reverse=True,
+        )
+        matched_tracks, matched_dets = set(), {}
+        for iou, t, d in candidates:
+            if iou < self.iou_threshold:
+                break
+            if t in matched_tracks or d in matched_dets:
+                continue
+            matched_tracks.add(t)
+            matched_dets[d] = self._tracks[t]
+            self._tracks[t].update(detections[d], frame)
+
+        for t, track in enumerate(self._tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        stable = len(matched_dets) == len(detections) == len(self._tracks)
+        self._tracks = [track for track in self._tracks if track.misses <= self.max_misses]
+
+        results = []
+        for d, det in enumerate(detections):
+            track = matched_dets.get(d)
+            if track is None:
+                track = _Track(self._next_id, det, frame)
+                self._next_id += 1
+                self._tracks.append(track)
+            results.append({**det, "track_id": track.track_id})
+
+        self.stride = min(self.stride * 2, self.max_stride) if stable else self.min_stride
+        return results
+
+    def on_skipped(self, frame: int) -> list:
+        """Returns the predicted positions of tracks seen at the last keyframe."""
+        VIDEO_FRAMES.labels(kind="tracked").inc()
+        return [track.predict(frame) for track in self._tracks if track.misses == 0]
+
+
+def _to_model_input(frame: np.ndarray) -> tuple:
+    """Converts a BGR frame to an RGB array no larger than the model input, plus the scale factor."""
+    height, width = frame.shape[:2]
+    scale = max(width, height) / model_loader.INPUT_SIZE
+    if scale > 1.0:
+        frame = cv2.resize(frame, (max(1, round(width / scale)), max(1, round(height / scale))),
+                           interpolation=cv2.INTER_AREA)
+    else:
+        scale = 1.0
+    # Same channel order as decoded uploads, so stills and video frames get identical results
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), scale
+
+
+def _read_window(capture, tracker: VideoTracker, start: int, max_keyframes: int) -> list:
+    """
+    Reads frames from `start` until `max_keyframes` keyframes are collected or the video ends.
+
+    Returns (frame_index, model_input, scale) tuples; model_input is None for
+    skipped frames, which are only grabbed, never decoded.
+    """
+    window, keyframes, index = [], 0, start
+    last_keyframe = tracker.last_keyframe
+    while keyframes < max_keyframes:
+        is_keyframe = last_keyframe is None or index - last_keyframe >= tracker.stride
+        if is_keyframe:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            image, scale = _to_model_input(frame)
+            window.append((index, image, scale))
+            keyframes += 1
+            last_keyframe = index
+        else:
+            if not capture.grab():
+                break
+            window.append((index, None, 1.0))
+        index += 1
+    return window
+
+
+def open_video(path: str):
+    """Opens a video file for incremental decoding, raising ValueError if OpenCV can't read it."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError("Could not open the uploaded video.")
+    return capture
+
+
+async def detect_video(capture, batch_frames: int = VIDEO_BATCH_FRAMES):
+    """
+    Yields one result dict per frame of an opened video, in frame order, then releases it.
+
+    Frames are decoded a window at a time, so memory stays flat regardless of
+    the video's length. Keyframes in a window share one batched predict call;
+    the frames between them are filled in by the tracker. A window's keyframes
+    are chosen before it is detected, so windows only batch keyframes while
+    the tracker is at its minimum stride (every frame it could pick is a
+    keyframe anyway); at a longer stride each window holds one keyframe, and
+    a scene change shortens the stride from the very next keyframe.
+
+    Keyframes run in the executor's bulk lane without a queue bound: a video is
+    long-running work that waits behind interactive requests instead of
+    failing mid-stream when the queue is full.
+    """
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    tracker = VideoTracker()
+    index = 0
+    try:
+        while True:
+            max_keyframes = max(1, batch_frames) if tracker.stride == tracker.min_stride else 1
+            window = await asyncio.to_thread(_read_window, capture, tracker, index, max_keyframes)
+            if not window:
+                break
+            index = window[-1][0] + 1
+            keyframes = [(image, scale) for _, image, scale in window if image is not None]
+            batch = await inference_executor.run(model_loader.detect_objects_batch, [image for image, _ in keyframes],
+                                                 bounded=False, lane=BULK)
+            detections = iter(model_loader.scale_detections(dets, scale, scale)
+                              for dets, (_, scale) in zip(batch, keyframes))
+
+            for frame, image, _ in window:
+                if image is not None:
+                    objects, keyframe = tracker.on_keyframe(frame, next(detections)), True
+                else:
+                    objects, keyframe = tracker.on_skipped(frame), False
+                timestamp_ms = round(frame * 1000 / fps, 1) if fps else None
+                yield {"frame": frame, "timestamp_ms": timestamp_ms, "keyframe": keyframe, "objects": objects}
+    finally:
+        capture.release()
+    logger.info(f"Finished video detection: {index} frames.")
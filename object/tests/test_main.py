@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from service_common.executor import QueueFullError
+from service_common.ingest import RAW_CONTENT_TYPE
+
+from object_app import main, pipeline
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main.startup, "state", "ready")
+    return TestClient(main.app) # Without the lifespan, so no model is loaded
+
+
+def test_full_queue_answers_429_with_retry_after(client, monkeypatch):
+    async def detect_with_model(*args, **kwargs):
+        raise QueueFullError("Inference queue is full (32 interactive jobs waiting).", retry_after=7)
+
+    monkeypatch.setattr(pipeline, "detect_with_model", detect_with_model)
+    response = client.post("/api/object", files={"file": ("a.jpg", b"\xff\xd8 not decoded", "image/jpeg")})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+
+
+def test_raw_frame_is_detected_without_decoding(client, monkeypatch):
+    frames = []
+
+    async def detect_with_model(image_bytes, quality="auto", decoded=None):
+        frames.append(decoded)
+        return [{"label": "cat", "score": 0.9, "box": [1, 2, 3, 4]}], "small"
+
+    monkeypatch.setattr(pipeline, "detect_with_model", detect_with_model)
+    frame = np.zeros((32, 48, 3), dtype=np.uint8)
+    response = client.post("/api/object/raw", content=frame.tobytes(),
+                           headers={"content-type": RAW_CONTENT_TYPE, "x-image-shape": "32,48,3"})
+    assert response.status_code == 200
+    assert response.json()["model"] == "small"
+    assert frames[0].image.shape == (32, 48, 3)
+
+
+def test_raw_frame_not_matching_its_shape_is_rejected_with_400(client):
+    response = client.post("/api/object/raw", content=b"\0" * 10,
+                           headers={"content-type": RAW_CONTENT_TYPE, "x-image-shape": "32,48,3"})
+    assert response.status_code == 400
+
+
+def test_raw_endpoint_rejects_encoded_images_with_415(client):
+    response = client.post("/api/object/raw", content=b"\xff\xd8", headers={"content-type": "image/jpeg"})
+    assert response.status_code == 415
+
+
+def test_requests_and_readiness_answer_503_until_the_model_is_ready(client, monkeypatch):
+    monkeypatch.setattr(main.startup, "state", "warming_up")
+    assert client.get("/api/health/live").status_code == 200
+    assert client.get("/api/health/ready").status_code == 503
+    response = client.post("/api/object", files={"file": ("a.jpg", b"\xff\xd8 not decoded", "image/jpeg")})
+    assert response.status_code == 503
+    monkeypatch.setattr(main.startup, "state", "ready")
+    assert client.get("/api/health/ready").json()["status"] == "ready"
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from object_app import model_loader, model_policy, pipeline
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(model_loader, "MODEL_REGISTRY", {"small": "s.pt", "medium": "m.pt", "large": "l.pt"})
+    monkeypatch.setattr(model_loader, "MODEL_NAME", "large")
+    monkeypatch.setattr(model_loader, "seconds_per_image", {})
+    monkeypatch.setattr(model_policy, "CASCADE_ENABLED", False)
+
+
+def test_queue_policy_steps_down_with_the_backlog(monkeypatch):
+    monkeypatch.setattr(model_policy, "MODEL_POLICY", "queue")
+    monkeypatch.setattr(model_policy, "MODEL_POLICY_QUEUE_STEP", 8)
+    assert model_policy.select("auto", 0) == ("large", "default")
+    assert model_policy.select("auto", 8) == ("medium", "queue")
+    assert model_policy.select("auto", 100) == ("small", "queue")
+    assert model_policy.select("accurate", 100) == ("large", "hint")
+
+
+def test_slo_policy_picks_the_largest_model_within_the_slo(monkeypatch):
+    monkeypatch.setattr(model_policy, "MODEL_POLICY", "slo")
+    monkeypatch.setattr(model_policy, "MODEL_POLICY_LATENCY_SLO_MS", 500)
+    model_loader.seconds_per_image.update({"small": 0.01, "medium": 0.05, "large": 0.2})
+    assert model_policy.select("auto", 1)[0] == "large"  # 0.4s
+    assert model_policy.select("auto", 4)[0] == "medium" # 1.0s large, 0.25s medium
+    assert model_policy.select("auto", 40)[0] == "small"
+
+
+def test_cascade_only_applies_above_the_smallest_model(monkeypatch):
+    monkeypatch.setattr(model_policy, "CASCADE_ENABLED", True)
+    assert "cascade" in model_policy.cache_params("large")
+    assert "cascade" not in model_policy.cache_params("small")
+    assert "cascade" not in model_policy.cache_params("large", cascade=False)
+    assert model_policy.is_ambiguous([{"score": 0.5}])
+    assert not model_policy.is_ambiguous([{"score": 0.1}, {"score": 0.9}])
+
+
+def test_result_from_a_degraded_model_is_not_served_off_peak(monkeypatch):
+    monkeypatch.setattr(model_policy, "MODEL_POLICY", "queue")
+    monkeypatch.setattr(pipeline, "result_cache", pipeline.cache.ResultCache("object", pipeline.cache.LRUCache("object")))
+    runs = []
+
+    async def detect_uncached(image_bytes, model_name, cascade, lane):
+        runs.append(model_name)
+        return {"model": model_name, "objects": []}
+
+    monkeypatch.setattr(pipeline, "_detect_uncached", detect_uncached)
+    monkeypatch.setattr(pipeline, "backlog", lambda: 100)
+    assert asyncio.run(pipeline.detect_with_model(b"image"))[1] == "small"
+    monkeypatch.setattr(pipeline, "backlog", lambda: 0)
+    assert asyncio.run(pipeline.detect_with_model(b"image"))[1] == "large"
+    assert asyncio.run(pipeline.detect_with_model(b"image"))[1] == "large"
+    assert runs == ["small", "large"]
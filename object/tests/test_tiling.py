@@ -0,0 +1,39 @@
+import pytest
+
+from object_app import tiling
+
+# Two tiles saw the same cat (IoU 0.82); the dog overlaps it but is another class
+DETECTIONS = [
+    {"label": "cat", "score": 0.6, "box": [10, 0, 110, 100]},
+    {"label": "cat", "score": 0.9, "box": [0, 0, 100, 100]},
+    {"label": "dog", "score": 0.8, "box": [0, 0, 100, 100]},
+    {"label": "cat", "score": 0.7, "box": [300, 300, 400, 400]},
+]
+
+
+def test_nms_keeps_the_highest_scoring_box_of_each_group():
+    merged = tiling.merge_detections(DETECTIONS, method="nms", iou_threshold=0.5)
+    assert merged == [
+        {"label": "cat", "score": 0.9, "box": [0, 0, 100, 100]},
+        {"label": "dog", "score": 0.8, "box": [0, 0, 100, 100]},
+        {"label": "cat", "score": 0.7, "box": [300, 300, 400, 400]},
+    ]
+
+
+def test_wbf_averages_each_group_weighted_by_score():
+    merged = tiling.merge_detections(DETECTIONS, method="wbf", iou_threshold=0.5)
+    assert merged == [
+        {"label": "dog", "score": 0.8, "box": [0, 0, 100, 100]},
+        {"label": "cat", "score": 0.75, "box": [4, 0, 104, 100]},
+        {"label": "cat", "score": 0.7, "box": [300, 300, 400, 400]},
+    ]
+
+
+def test_boxes_below_the_iou_threshold_are_kept_apart():
+    merged = tiling.merge_detections(DETECTIONS, method="nms", iou_threshold=0.9)
+    assert len(merged) == len(DETECTIONS)
+
+
+def test_unknown_merge_method_is_rejected():
+    with pytest.raises(ValueError):
+        tiling.merge_detections(DETECTIONS, method="mean")
@@ -0,0 +1,46 @@
+from object_app.video import VideoTracker
+
+
+def _car(x: int, score: float = 0.9) -> dict:
+    return {"label": "car", "score": score, "box": [x, 100, x + 100, 200]}
+
+
+def test_track_ids_continue_across_keyframes_and_tracked_frames():
+    tracker = VideoTracker(min_stride=1, max_stride=4, iou_threshold=0.3, max_misses=1)
+    person = {"label": "person", "score": 0.8, "box": [500, 50, 560, 250]}
+
+    first = tracker.on_keyframe(0, [_car(0), person])
+    car_id, person_id = (det["track_id"] for det in first)
+    assert car_id != person_id
+
+    moved = tracker.on_keyframe(1, [person, _car(10)]) # Order changes, the car moves 10px per frame
+    assert {det["label"]: det["track_id"] for det in moved} == {"car": car_id, "person": person_id}
+
+    predicted = {det["track_id"]: det for det in tracker.on_skipped(3)}
+    assert predicted[car_id]["box"] == [30, 100, 130, 200] # Carried along its velocity
+    assert predicted[person_id]["box"] == person["box"]
+
+    later = tracker.on_keyframe(4, [_car(40), person])
+    assert [det["track_id"] for det in later] == [car_id, person_id]
+
+
+def test_new_object_gets_a_new_id_and_resets_the_stride():
+    tracker = VideoTracker(min_stride=1, max_stride=8, iou_threshold=0.3, max_misses=1)
+    tracker.on_keyframe(0, [_car(0)])
+    tracker.on_keyframe(1, [_car(0)])
+    assert tracker.stride == 2
+
+    result = tracker.on_keyframe(3, [_car(0), _car(600)])
+    assert [det["track_id"] for det in result] == [1, 2]
+    assert tracker.stride == 1
+
+
+def test_track_survives_max_misses_keyframes_then_is_dropped():
+    tracker = VideoTracker(min_stride=1, max_stride=1, iou_threshold=0.3, max_misses=1)
+    car_id = tracker.on_keyframe(0, [_car(0)])[0]["track_id"]
+    tracker.on_keyframe(1, [])
+    assert tracker.on_keyframe(2, [_car(0)])[0]["track_id"] == car_id # Missed once: same track
+
+    tracker.on_keyframe(3, [])
+    tracker.on_keyframe(4, [])
+    assert tracker.on_keyframe(5, [_car(0)])[0]["track_id"] != car_id
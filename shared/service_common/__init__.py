@@ -0,0 +1,11 @@
+"""
+Serving components shared by the caption and object detection services.
+
+Admission control (executor), micro-batching, result caching, near-duplicate
+reuse, upload ingestion, batch and background-job processing, per-stage
+instrumentation, startup tracking and prefork serving live here once. Every
+component that exports metrics is created for a service name and prefixes its
+metrics with it (caption_inference_queue_depth, object_inference_queue_depth,
+...), so both services can run in one process, as the analyze service does.
+Each service binds its instances in its app/shared.py.
+"""
@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import logging
+import os
+from collections import deque
+
+from prometheus_client import Gauge, Histogram
+
+from . import instrumentation
+from .instrumentation import Instrumentation
+from .executor import INTERACTIVE, LANES, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# A batch is dispatched as soon as it is full, or once its oldest request has
+# waited BATCH_MAX_WAIT_MS, whichever comes first.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+BATCH_MAX_QUEUE_SIZE = int(os.getenv("BATCH_MAX_QUEUE_SIZE", "64"))
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        self.batch_size = Histogram(
+            f"{service}_batch_size",
+            "Number of images per batched model call.",
+            ["batcher"],
+            buckets=(1, 2, 4, 8, 16, 32, 64),
+        )
+        self.wait_seconds = Histogram(
+            f"{service}_batch_wait_seconds",
+            "Time a request spends queued before its batch starts.",
+            ["batcher"],
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+        )
+        self.queue_depth = Gauge(f"{service}_batch_queue_depth", "Requests waiting to be batched.", ["batcher"],
+                                 multiprocess_mode="livesum") # Per pod, for the autoscaler
+        self.max_size_setting = Gauge(f"{service}_batch_max_size", "Configured maximum batch size.", ["batcher"])
+        self.max_wait_setting = Gauge(f"{service}_batch_max_wait_milliseconds", "Configured maximum batch wait time.", ["batcher"])
+        self.max_queue_setting = Gauge(f"{service}_batch_max_queue_size", "Configured maximum batch queue depth.", ["batcher"])
+
+_metrics = functools.cache(_Metrics)
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into a single call of `batch_fn`.
+
+    `batch_fn` receives a list of items and must return a list of results in
+    the same order. It runs on `executor` so the event loop stays free.
+    Batches are filled from the interactive lane first; bulk items only take
+    the slots that interactive requests leave free. Up to
+    `executor.max_workers` batches run at once; the next batch is only formed
+    once one of them finishes, so it gathers whatever arrived meanwhile.
+    Metrics are exported as <service>_batch_*, with the service taken from
+    `executor`.
+    """
+
+    def __init__(self, batch_fn, name: str, executor,
+                 max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_MAX_WAIT_MS,
+                 max_queue_size: int = BATCH_MAX_QUEUE_SIZE):
+        self.batch_fn = batch_fn
+        self.name = name
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue_size = max(1, max_queue_size)
+        self._pending = {lane: deque() for lane in LANES}
+        self._wakeup = None
+        self._worker = None
+        self._slots = None
+        self._in_flight = set()
+        self._metrics = _metrics(executor.service)
+        self._instrumentation = Instrumentation.for_service(executor.service)
+
+        self._metrics.max_size_setting.labels(batcher=name).set(self.max_batch_size)
+        self._metrics.max_wait_setting.labels(batcher=name).set(max_wait_ms)
+        self._metrics.max_queue_setting.labels(batcher=name).set(self.max_queue_size)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def start(self):
+        """Starts the background task that forms and runs batches."""
+        if self._worker:
+            return
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.executor.max_workers)
+        self._worker = asyncio.create_task(self._run(), name=f"batcher-{self.name}")
+        logger.info(f"Batcher '{self.name}' started (max_batch_size={self.max_batch_size}, "
+                    f"max_wait={self.max_wait * 1000:.1f}ms, max_queue_size={self.max_queue_size}).")
+
+    async def stop(self):
+        """Stops the batching task, lets batches already running finish, and fails any requests still queued."""
+        if not self._worker:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        for pending in self._pending.values():
+            while pending:
+                _, future, _, _ = pending.popleft()
+                if not future.done():
+                    future.set_exception(RuntimeError("Batcher stopped before the request was processed."))
+        self._metrics.queue_depth.labels(batcher=self.name).set(0)
+        logger.info(f"Batcher '{self.name}' stopped.")
+
+    async def submit(self, item, lane: str = INTERACTIVE):
+        """Queues a single item and waits for its result from the batched call."""
+        if not self._worker:
+            raise RuntimeError(f"Batcher '{self.name}' is not running.")
+        pending = self._pending[lane]
+        if len(pending) >= self.max_queue_size:
+            raise QueueFullError(f"Batch queue '{self.name}' is full ({self.max_queue_size} {lane} requests waiting).")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # The caller's stage timings receive its share of the batch (batch_wait, inference, ...)
+        pending.append((item, future, loop.time(), instrumentation.current_timings()))
+        self._metrics.queue_depth.labels(batcher=self.name).set(self.queue_depth)
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.queue_depth:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._slots.acquire() # Released when the batch finishes
+
+            # Linger until the batch is full or the oldest request hits its deadline
+            deadline = min(pending[0][2] for pending in self._pending.values() if pending) + self.max_wait
+            while self.queue_depth < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch, lane = [], None
+            for pending_lane in LANES:
+                pending = self._pending[pending_lane]
+                while pending and len(batch) < self.max_batch_size:
+                    batch.append(pending.popleft())
+                    lane = lane or pending_lane # The batch runs in the lane of its most urgent item
+            self._metrics.queue_depth.labels(batcher=self.name).set(self.queue_depth)
+            task = asyncio.create_task(self._process(batch, lane))
+            self._in_flight.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def _process(self, batch: list, lane: str):
+        loop = asyncio.get_running_loop()
+        # Callers that disconnected while queued don't need a slot in the batch
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+
+        started = loop.time()
+        for _, _, enqueued, request_timings in batch:
+            self._metrics.wait_seconds.labels(batcher=self.name).observe(started - enqueued)
+            self._instrumentation.record("batch_wait", started - enqueued)
+            instrumentation.merge(request_timings, {"batch_wait": started - enqueued})
+        self._metrics.batch_size.labels(batcher=self.name).observe(len(batch))
+
+        items = [item for item, _, _, _ in batch]
+        try:
+            # The batch was already admitted by submit(), so it is never rejected here
+            with instrumentation.collect() as batch_timings:
+                results = await self.executor.run(self.batch_fn, items, bounded=False, lane=lane)
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch function returned {len(results)} results for {len(items)} items.")
+        except Exception as e:
+            logger.error(f"Batch of {len(items)} failed in batcher '{self.name}': {e}")
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logger.debug(f"Batcher '{self.name}' processed {len(items)} items in {loop.time() - started:.3f}s.")
+        for (_, future, _, request_timings), result in zip(batch, results):
+            instrumentation.merge(request_timings, batch_timings)
+            if not future.done():
+                future.set_result(result)
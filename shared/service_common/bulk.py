@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import logging
+import os
+import tarfile
+import zipfile
+from collections import deque
+
+from fastapi import UploadFile
+from prometheus_client import Counter
+
+from .ingest import UPLOAD_MAX_BYTES, Ingest, UploadTooLargeError
+from .executor import BULK, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))              # Images per batch request
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "16"))         # Images decoded/inferred at once per request
+# Whole batch request body, archives included. Enforced by RequestSizeLimitMiddleware before the form is
+# parsed, since the parser spools every upload to a temporary file; keep the ingress limit in step.
+BULK_REQUEST_MAX_BYTES = int(os.getenv("BULK_REQUEST_MAX_BYTES", str(1024 * 1024 * 1024)))
+BULK_RETRY_MAX_SECONDS = float(os.getenv("BULK_RETRY_MAX_SECONDS", "60")) # Give up on an item after this long
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed")
+TAR_TYPES = ("application/x-tar", "application/gzip", "application/x-gzip", "application/x-gtar",
+             "application/x-bzip2", "application/x-xz")
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        self.items = Counter(f"{service}_bulk_items_total", "Images processed by batch requests, by outcome.", ["outcome"])
+
+_metrics = functools.cache(_Metrics)
+
+
+def _archive_kind(file: UploadFile) -> str | None:
+    """Returns "zip" or "tar" if the upload looks like an archive, else None."""
+    name = (file.filename or "").lower()
+    if name.endswith(".zip") or file.content_type in ZIP_TYPES:
+        return "zip"
+    if name.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")) or file.content_type in TAR_TYPES:
+        return "tar"
+    return None
+
+
+def _iter_archive(fileobj, kind: str, max_bytes: int):
+    """
+    Yields (member_name, bytes_or_error) for every image in a zip or tar archive.
+
+    Members are read one at a time, so only the current image is in memory.
+    Tars are read as a forward-only stream; zips need their central directory,
+    which is read from the (already spooled) upload.
+    """
+    if kind == "zip":
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if info.file_size > max_bytes:
+                    yield info.filename, UploadTooLargeError(
+                        f"Archive member is {info.file_size} bytes; the limit is {max_bytes} bytes.")
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, member.read(max_bytes + 1)
+    else:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for info in archive:
+                if not info.isfile() or not info.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if info.size > max_bytes:
+                    yield info.name, UploadTooLargeError(
+                        f"Archive member is {info.size} bytes; the limit is {max_bytes} bytes.")
+                    continue
+                yield info.name, archive.extractfile(info).read()
+
+
+def in_bulk_lane(process):
+    """Wraps a pipeline function so it runs in the executor's bulk lane."""
+    return lambda data: process(data, lane=BULK)
+
+
+async def _process_with_retry(process, data: bytes):
+    """Runs one item, waiting out full queues instead of failing it (batch work isn't latency-sensitive)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BULK_RETRY_MAX_SECONDS
+    delay = 0.05
+    while True:
+        try:
+            return await process(data)
+        except QueueFullError:
+            if loop.time() + delay > deadline:
+                raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+
+class Bulk:
+    """Batch-request processing (archives, bounded in-order concurrency) for one service."""
+
+    def __init__(self, ingest: Ingest):
+        self.ingest = ingest
+        self._metrics = _metrics(ingest.service)
+
+    in_bulk_lane = staticmethod(in_bulk_lane)
+
+    async def iter_uploads(self, files: list, max_items: int = BULK_MAX_ITEMS):
+        """
+        Yields (filename, bytes_or_error) for every image in the uploads, expanding archives in place.
+
+        Problems with one item (too large, unreadable archive) are yielded as the
+        exception instead of the bytes, so the rest of the batch still runs.
+        """
+        count = 0
+        for file in files:
+            kind = _archive_kind(file)
+            if kind is None:
+                if count >= max_items:
+                    raise ValueError(f"Batch exceeds the limit of {max_items} images.")
+                count += 1
+                try:
+                    yield file.filename, await self.ingest.read_upload(file)
+                except UploadTooLargeError as too_large:
+                    yield file.filename, too_large
+                continue
+
+            await file.seek(0)
+            members = _iter_archive(file.file, kind, UPLOAD_MAX_BYTES)
+            while True:
+                try:
+                    # Decompression is blocking, so read each member off the event loop
+                    item = await asyncio.to_thread(next, members, None)
+                except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError) as e:
+                    yield file.filename, ValueError(f"Could not read archive: {e}")
+                    break
+                if item is None:
+                    break
+                if count >= max_items:
+                    members.close()
+                    raise ValueError(f"Batch exceeds the limit of {max_items} images.")
+                count += 1
+                name, data = item
+                if isinstance(data, bytes) and len(data) > UPLOAD_MAX_BYTES:
+                    data = UploadTooLargeError(f"Archive member exceeds the limit of {UPLOAD_MAX_BYTES} bytes.")
+                yield f"{file.filename}/{name}", data
+
+    async def process_in_order(self, items, process, max_in_flight: int = BULK_MAX_IN_FLIGHT):
+        """
+        Runs `process(bytes)` over (filename, bytes_or_error) items with bounded concurrency.
+
+        Yields (index, filename, result_or_exception) in input order. Up to
+        `max_in_flight` items are decoded and queued for inference at once, which
+        keeps the micro-batcher fed with full batches while bounding memory.
+        """
+        window = deque()
+        index = 0
+        try:
+            async for filename, data in items:
+                if isinstance(data, Exception):
+                    job = asyncio.get_running_loop().create_future()
+                    job.set_exception(data)
+                else:
+                    job = asyncio.ensure_future(_process_with_retry(process, data))
+                window.append((index, filename, job))
+                index += 1
+                while len(window) >= max(1, max_in_flight):
+                    yield await self._finish(window.popleft())
+            while window:
+                yield await self._finish(window.popleft())
+        finally:
+            for _, _, job in window: # The client went away or the upload was rejected mid-batch
+                if job.done() and not job.cancelled():
+                    job.exception() # Mark as retrieved
+                else:
+                    job.cancel()
+
+    async def _finish(self, entry: tuple) -> tuple:
+        index, filename, job = entry
+        try:
+            result = await job
+        except Exception as e:
+            self._metrics.items.labels(outcome="error").inc()
+            return index, filename, e
+        self._metrics.items.labels(outcome="ok").inc()
+        return index, filename, result
@@ -0,0 +1,272 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+
+from prometheus_client import Counter, Gauge
+
+from . import sqlite_local
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2048"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))) # Of JSON-encoded results
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+# Optional second tier: "none", "sqlite" (node-local, shared by a pod's workers) or "file" (safe on a shared volume)
+RESULT_CACHE_SHARED_BACKEND = os.getenv("RESULT_CACHE_SHARED_BACKEND", "none").lower()
+# Default: /local-state/result-cache/<service> for sqlite, /model-cache/result-cache/<service> for file
+RESULT_CACHE_SHARED_PATH = os.getenv("RESULT_CACHE_SHARED_PATH")
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        self.hits = Counter(f"{service}_result_cache_hits_total", "Results served from the cache.", ["tier"])
+        self.misses = Counter(f"{service}_result_cache_misses_total", "Requests that had to run inference.")
+        self.deduplicated = Counter(f"{service}_result_cache_deduplicated_total",
+                                    "Requests that waited on an identical in-flight inference instead of running their own.")
+        self.entries = Gauge(f"{service}_result_cache_entries", "Entries held in the in-process cache tier.")
+        self.bytes = Gauge(f"{service}_result_cache_bytes", "Approximate size of the results held in the in-process cache tier.")
+
+_metrics = functools.cache(_Metrics)
+
+_MISSING = object()
+
+
+def make_key(image_bytes: bytes, params: dict) -> str:
+    """Builds a cache key from the image content and the parameters that affect the result."""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _approximate_size(key: str, value) -> int:
+    """Bytes an entry accounts for: its key plus the JSON encoding of its value."""
+    return len(key) + len(json.dumps(value, separators=(",", ":")))
+
+
+class LRUCache:
+    """
+    In-process cache tier with entry-count, size and TTL based eviction.
+
+    Sizes are approximated by the JSON encoding of each result, so one image
+    with thousands of detections can't push the process past its memory
+    limit; a result larger than `max_bytes` on its own is not cached.
+    """
+
+    def __init__(self, service: str, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = RESULT_CACHE_TTL_SECONDS, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max(0, max_entries)
+        self.max_bytes = max(0, max_bytes)
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expiry, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._metrics = _metrics(service)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached value, or _MISSING if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, _, value = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self._update_metrics()
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries == 0:
+            return
+        size = _approximate_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            self._update_metrics()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _update_metrics(self):
+        self._metrics.entries.set(len(self._entries))
+        self._metrics.bytes.set(self._bytes)
+
+
+class SharedCacheBackend(ABC):
+    """
+    Interface for the optional shared cache tier.
+
+    Values are JSON-serializable inference results. Implementations are called
+    from worker threads and must be safe to use from more than one thread.
+    """
+
+    @abstractmethod
+    def get(self, key: str):
+        """Returns the stored value, or None if it is absent or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value, ttl_seconds: float):
+        """Stores the value until `ttl_seconds` from now."""
+
+
+class SqliteCacheBackend(SharedCacheBackend):
+    """Shared tier stored in a node-local sqlite database, shared by the worker processes of a pod."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connect()
+        # sqlite connections must not be used across fork (see serve.py), so each child opens its own
+        os.register_at_fork(after_in_child=self._connect)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        self._conn.commit()
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite_local.connect(self.path, timeout=5.0)
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl_seconds: float):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+                               (key, json.dumps(value), time.time() + ttl_seconds))
+            self._conn.execute("DELETE FROM results WHERE expires < ?", (time.time(),))
+            self._conn.commit()
+
+
+class FileCacheBackend(SharedCacheBackend):
+    """Shared tier stored as one JSON file per key under a directory; safe on a volume shared by replicas."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if entry["expires"] < time.time():
+            path.unlink(missing_ok=True)
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value, ttl_seconds: float):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so readers never see a partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"expires": time.time() + ttl_seconds, "value": value}, f)
+        os.replace(tmp_path, path)
+
+
+def create_shared_backend(service: str, kind: str = RESULT_CACHE_SHARED_BACKEND,
+                          path: str | None = RESULT_CACHE_SHARED_PATH):
+    """Builds the configured shared tier, or returns None when it is disabled."""
+    if kind in ("", "none"):
+        return None
+    try:
+        if kind == "sqlite":
+            path = path or f"/local-state/result-cache/{service}"
+            return SqliteCacheBackend(os.path.join(path, "results.sqlite3"))
+        if kind == "file":
+            path = path or f"/model-cache/result-cache/{service}"
+            return FileCacheBackend(path)
+    except Exception as e:
+        logger.error(f"Could not initialise shared result cache '{kind}' at {path}: {e}. Continuing without it.")
+        return None
+    raise ValueError(f"Unknown shared cache backend '{kind}'. Use 'none', 'sqlite' or 'file'.")
+
+
+class ResultCache:
+    """
+    Two-tier result cache that also deduplicates concurrent identical requests.
+
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, service: str, local: LRUCache, shared: SharedCacheBackend | None = None):
+        self.local = local
+        self.shared = shared
+        self.ttl_seconds = local.ttl_seconds
+        self._in_flight = {}
+        self._metrics = _metrics(service)
+
+    async def get_or_compute(self, key: str, compute):
+        """Returns the cached result for `key`, or awaits `compute()` exactly once to fill it."""
+        value = self.local.get(key)
+        if value is not _MISSING:
+            self._metrics.hits.labels(tier="local").inc()
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._metrics.deduplicated.inc()
+        else:
+            # Run the fill as its own task so one caller disconnecting doesn't cancel it for the others
+            task = asyncio.ensure_future(self._fill(key, compute))
+            task.add_done_callback(self._fill_done)
+            self._in_flight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: str, compute):
+        try:
+            if self.shared:
+                try:
+                    value = await asyncio.to_thread(self.shared.get, key)
+                except Exception as e:
+                    logger.warning(f"Shared result cache lookup failed: {e}")
+                    value = None
+                if value is not None:
+                    self._metrics.hits.labels(tier="shared").inc()
+                    self.local.set(key, value)
+                    return value
+
+            self._metrics.misses.inc()
+            value = await compute()
+            self.local.set(key, value)
+            if self.shared:
+                try:
+                    await asyncio.to_thread(self.shared.set, key, value, self.ttl_seconds)
+                except Exception as e:
+                    logger.warning(f"Shared result cache store failed: {e}")
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    @staticmethod
+    def _fill_done(task: asyncio.Task):
+        # Errors are delivered to the waiting callers; don't log them again if nobody was left waiting
+        if not task.cancelled():
+            task.exception()
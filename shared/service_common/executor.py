@@ -0,0 +1,213 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .instrumentation import Instrumentation
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# "thread" keeps one copy of the model shared by all workers (torch releases the
+# GIL during inference); "process" forks workers that each run their own model.
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread").lower()
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_MAX_QUEUE_SIZE = int(os.getenv("INFERENCE_MAX_QUEUE_SIZE", "32"))
+INFERENCE_RETRY_AFTER_SECONDS = int(os.getenv("INFERENCE_RETRY_AFTER_SECONDS", "2"))
+
+# Priority lanes, highest first: a free worker always goes to waiting interactive
+# (single-image) work before any batch or background-job work.
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        # Summed over a pod's live workers (see serve.py), as the autoscaler reads them per pod
+        self.queue_depth = Gauge(f"{service}_inference_queue_depth", "Inference jobs waiting for a free executor worker.",
+                                 multiprocess_mode="livesum")
+        self.lane_queue_depth = Gauge(f"{service}_inference_lane_queue_depth", "Inference jobs waiting for a free executor worker, by lane.", ["lane"],
+                                      multiprocess_mode="livesum")
+        self.in_flight = Gauge(f"{service}_inference_in_flight", "Inference jobs currently running on executor workers.")
+        self.queue_wait_seconds = Histogram(
+            f"{service}_inference_queue_wait_seconds",
+            "Time an inference job waits before an executor worker picks it up.",
+            ["lane"],
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+        )
+        self.run_seconds = Histogram(
+            f"{service}_inference_run_seconds",
+            "Time an inference job spends running on an executor worker.",
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+        )
+        self.rejected = Counter(f"{service}_inference_rejected_total", "Inference jobs rejected because the executor queue was full.", ["lane"])
+
+# One set per service, however many executors it creates
+_metrics = functools.cache(_Metrics)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when work is rejected because a bounded queue is full."""
+
+    def __init__(self, message: str, retry_after: int = INFERENCE_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _timed_call(fn, args, collect_state=None):
+    """
+    Runs `fn` on a worker and reports when it started (wall clock works across processes).
+
+    Also returns `collect_state()`, taken after the call, when given.
+    """
+    started = time.time()
+    result = fn(*args)
+    return started, result, collect_state() if collect_state else None
+
+
+class InferenceExecutor:
+    """
+    Runs blocking inference work off the event loop on a bounded pool.
+
+    At most `max_workers` jobs run at once and at most `max_queue_size` wait for
+    a worker in each lane; anything beyond that is rejected immediately with
+    QueueFullError. Waiting jobs are started lane by lane in LANES order, so
+    bulk work only gets a worker when no interactive work is waiting. Metrics
+    are exported as <service>_inference_*.
+    """
+
+    def __init__(self, service: str, kind: str = INFERENCE_EXECUTOR,
+                 max_workers: int = INFERENCE_WORKERS,
+                 max_queue_size: int = INFERENCE_MAX_QUEUE_SIZE):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind '{kind}'. Use 'thread' or 'process'.")
+        self.service = service
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self._pool = None
+        self._worker_state = None
+        self._free = 0
+        self._waiters = {lane: deque() for lane in LANES}
+        self._metrics = _metrics(service)
+        self._instrumentation = Instrumentation.for_service(service)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def start(self, initializer=None, worker_state=None):
+        """
+        Creates the worker pool. `initializer` runs once in each worker process.
+
+        State a job updates inside a worker process (e.g. latency estimates)
+        never reaches this one; pass `worker_state=(collect, apply)` to run
+        collect() in the worker after each job and apply() here on its result.
+        """
+        if self._pool:
+            return
+        if self.kind == "process":
+            self._worker_state = worker_state
+            # Fork so workers inherit already-imported modules and loaded weights
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context("fork"),
+                                             initializer=initializer)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        self._free = self.max_workers
+        logger.info(f"Inference executor started ({self.kind} pool, workers={self.max_workers}, "
+                    f"max_queue_size={self.max_queue_size}).")
+
+    def shutdown(self):
+        """Shuts the pool down, cancelling jobs that have not started yet."""
+        if not self._pool:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        logger.info("Inference executor stopped.")
+
+    async def run(self, fn, *args, bounded: bool = True, lane: str = INTERACTIVE):
+        """
+        Runs `fn(*args)` on the pool, waiting for a free worker if needed.
+
+        Work that has already been admitted elsewhere (e.g. a formed batch) can
+        pass `bounded=False` so it queues without being subject to rejection.
+        Batch and background-job work passes `lane=BULK`.
+        """
+        if not self._pool:
+            raise RuntimeError("Inference executor is not running.")
+        waiters = self._waiters[lane]
+        if bounded and self._free == 0 and len(waiters) >= self.max_queue_size:
+            self._metrics.rejected.labels(lane=lane).inc()
+            raise QueueFullError(f"Inference queue is full ({len(waiters)} {lane} jobs waiting).")
+
+        enqueued = time.time()
+        await self._acquire(lane)
+
+        loop = asyncio.get_running_loop()
+        self._metrics.in_flight.inc()
+        try:
+            if self.kind == "process":
+                job = self._pool.submit(_timed_call, fn, args, self._worker_state and self._worker_state[0])
+            else: # Stages the job records (decode, inference, ...) count towards the caller's request
+                job = self._pool.submit(contextvars.copy_context().run, _timed_call, fn, args)
+        except Exception:
+            self._release()
+            raise
+        # Free the slot when the job really finishes, even if the caller gave up waiting
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        started, result, state = await asyncio.wrap_future(job)
+        if state is not None:
+            self._worker_state[1](state)
+        self._metrics.queue_wait_seconds.labels(lane=lane).observe(max(0.0, started - enqueued))
+        self._instrumentation.record("queue", max(0.0, started - enqueued))
+        self._metrics.run_seconds.observe(time.time() - started)
+        return result
+
+    async def _acquire(self, lane: str):
+        """Takes a worker slot, queueing behind earlier work in this lane and all higher lanes."""
+        if self._free > 0 and not self.queue_depth:
+            self._free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[lane]
+        waiters.append(waiter)
+        self._set_queue_depth(lane)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._hand_off() # Granted a slot just as we were cancelled; pass it on
+            else:
+                waiters.remove(waiter)
+            raise
+        finally:
+            self._set_queue_depth(lane)
+
+    def _hand_off(self):
+        """Gives a free slot to the first waiter of the highest-priority lane, or returns it to the pool."""
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self._free += 1
+
+    def _set_queue_depth(self, lane: str):
+        self._metrics.lane_queue_depth.labels(lane=lane).set(len(self._waiters[lane]))
+        self._metrics.queue_depth.set(self.queue_depth)
+
+    def _release(self):
+        self._metrics.in_flight.dec()
+        self._hand_off()
+
@@ -0,0 +1,354 @@
+import asyncio
+import functools
+import logging
+import os
+import resource
+import tempfile
+import time
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+from fastapi import Request, UploadFile
+from fastapi.responses import JSONResponse
+from numpy.lib import format as npy_format
+from PIL import Image, ImageOps
+from prometheus_client import Counter, Gauge, Histogram
+
+from .instrumentation import Instrumentation
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+FORM_OVERHEAD_BYTES = 64 * 1024 # Multipart boundaries, part headers and small fields around an upload
+# Let libjpeg scale by 1/2, 1/4 or 1/8 during the DCT instead of decoding every pixel
+JPEG_DRAFT_DECODE = os.getenv("JPEG_DRAFT_DECODE", "true").lower() == "true"
+# Pre-decoded uploads (the /raw endpoints): uint8 RGB frames of shape (height, width, 3)
+RAW_CONTENT_TYPE = "application/octet-stream" # Packed pixels; the shape comes in the X-Image-Shape header
+NPY_CONTENT_TYPE = "application/x-npy"        # A NumPy .npy file, which declares its own shape
+RAW_MIN_SIDE = 16 # Also keeps height and width from being mistaken for the channel axis
+RAW_MAX_SIDE = int(os.getenv("RAW_MAX_SIDE", "8192"))
+_NPY_HEADER_MAX_BYTES = 16 * 1024
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        self.upload_bytes = Histogram(
+            f"{service}_upload_bytes",
+            "Size of uploaded image files.",
+            buckets=(64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6),
+        )
+        self.uploads_rejected = Counter(f"{service}_upload_rejected_total", "Uploads rejected before decoding.", ["reason"])
+        self.decode_seconds = Histogram(
+            f"{service}_image_decode_seconds",
+            "Time to decode, orient and convert an uploaded image.",
+            ["format"],
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+        )
+        self.decode_scale = Histogram(
+            f"{service}_image_decode_scale",
+            "Downscale factor applied while decoding (1 = full resolution).",
+            buckets=(1, 2, 4, 8),
+        )
+        self.decode_rss_bytes = Histogram(
+            f"{service}_image_decode_rss_bytes",
+            "Resident set size right after an image is decoded, while its pixels are live.",
+            buckets=(256e6, 512e6, 768e6, 1e9, 1.5e9, 2e9, 3e9, 4e9),
+        )
+        self.peak_rss_bytes = Gauge(f"{service}_process_peak_rss_bytes", "Peak resident set size of the process so far.")
+
+_metrics = functools.cache(_Metrics)
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds UPLOAD_MAX_BYTES."""
+
+
+@dataclass
+class DecodedImage:
+    """An RGB image plus what is needed to map results back to the original."""
+    image: Image.Image | np.ndarray # An np.ndarray view into the request body for raw uploads
+    original_size: tuple # (width, height) of the full-resolution, EXIF-oriented image
+    scale: float         # original_size / image.size along each axis
+    format: str | None
+
+
+def _raw_shape(shape_header: str | None) -> tuple:
+    if not shape_header:
+        raise ValueError(f"{RAW_CONTENT_TYPE} uploads need an X-Image-Shape header (height,width,3).")
+    try:
+        return tuple(int(part) for part in shape_header.split(","))
+    except ValueError:
+        raise ValueError(f"Invalid X-Image-Shape '{shape_header}'; expected height,width,3.")
+
+
+def _npy_shape(body: bytearray) -> tuple:
+    """Returns the shape and data offset of a .npy body, which must hold a C-ordered uint8 array."""
+    header = BytesIO(bytes(memoryview(body)[:_NPY_HEADER_MAX_BYTES])) # Only the header is copied
+    try:
+        version = npy_format.read_magic(header)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(header)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(header)
+    except ValueError as e:
+        raise ValueError(f"Invalid .npy body: {e}")
+    if dtype != np.uint8 or fortran_order:
+        raise ValueError(f"The .npy array must be C-ordered uint8, not {'Fortran-ordered ' if fortran_order else ''}{dtype}.")
+    return shape, header.tell()
+
+
+def _current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class Ingest:
+    """
+    Reads, bounds and decodes the uploads of one service.
+
+    Metrics are exported as <service>_upload_* and <service>_image_decode_*.
+    Only the service name is stored, so methods can be sent to process-pool
+    workers.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+
+    @property
+    def _metrics(self) -> _Metrics:
+        return _metrics(self.service)
+
+    @property
+    def _instrumentation(self) -> Instrumentation:
+        return Instrumentation.for_service(self.service)
+
+    async def read_upload(self, file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> bytes:
+        """
+        Reads a parsed upload in chunks and rejects it if it is larger than `max_bytes`.
+
+        The form parser has already received the whole file by now; the request
+        body itself is bounded earlier, by RequestSizeLimitMiddleware.
+        """
+        if file.size is not None and file.size > max_bytes:
+            self._metrics.uploads_rejected.labels(reason="too_large").inc()
+            raise UploadTooLargeError(f"Upload is {file.size} bytes; the limit is {max_bytes} bytes.")
+
+        with self._instrumentation.stage("read"):
+            chunks, total = [], 0
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                total += len(chunk)
+                if total > max_bytes:
+                    self._metrics.uploads_rejected.labels(reason="too_large").inc()
+                    raise UploadTooLargeError(f"Upload exceeds the limit of {max_bytes} bytes.")
+                chunks.append(chunk)
+        self._metrics.upload_bytes.observe(total)
+        return b"".join(chunks)
+
+    async def save_upload(self, file: UploadFile, max_bytes: int, suffix: str = "") -> str:
+        """
+        Copies an upload to a temporary file in chunks and returns its path.
+
+        For media that decoders need to read from disk (e.g. video), so the whole
+        upload is never held in memory. The caller deletes the file. Like
+        read_upload, this runs after the form was parsed.
+        """
+        if file.size is not None and file.size > max_bytes:
+            self._metrics.uploads_rejected.labels(reason="too_large").inc()
+            raise UploadTooLargeError(f"Upload is {file.size} bytes; the limit is {max_bytes} bytes.")
+
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        total = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                    total += len(chunk)
+                    if total > max_bytes:
+                        self._metrics.uploads_rejected.labels(reason="too_large").inc()
+                        raise UploadTooLargeError(f"Upload exceeds the limit of {max_bytes} bytes.")
+                    await asyncio.to_thread(out.write, chunk)
+        except BaseException:
+            os.unlink(path)
+            raise
+        self._metrics.upload_bytes.observe(total)
+        return path
+
+    async def read_raw_body(self, request: Request, max_bytes: int = UPLOAD_MAX_BYTES) -> bytearray:
+        """
+        Reads a request body into one preallocated buffer, failing as soon as it grows past `max_bytes`.
+
+        Each received chunk is copied once, into the buffer; arrays made from it
+        with np.frombuffer are views, so the pixels are never copied again.
+        """
+        try:
+            declared = int(request.headers.get("content-length", "0"))
+        except ValueError:
+            raise ValueError("Invalid Content-Length header.")
+        if declared > max_bytes:
+            self._metrics.uploads_rejected.labels(reason="too_large").inc()
+            raise UploadTooLargeError(f"Upload is {declared} bytes; the limit is {max_bytes} bytes.")
+
+        with self._instrumentation.stage("read"):
+            buffer, total = bytearray(declared), 0
+            async for chunk in request.stream():
+                end = total + len(chunk)
+                if end > max_bytes:
+                    self._metrics.uploads_rejected.labels(reason="too_large").inc()
+                    raise UploadTooLargeError(f"Upload exceeds the limit of {max_bytes} bytes.")
+                if end > len(buffer): # Chunked upload without a Content-Length
+                    buffer.extend(bytes(end - len(buffer)))
+                buffer[total:end] = chunk
+                total = end
+            del buffer[total:]
+        self._metrics.upload_bytes.observe(total)
+        return buffer
+
+    def decode_raw(self, body: bytearray, content_type: str, shape_header: str | None = None) -> DecodedImage:
+        """
+        Wraps a pre-decoded RGB frame in a DecodedImage without copying its pixels.
+
+        `body` holds either packed uint8 pixels (RAW_CONTENT_TYPE, with the shape
+        from the X-Image-Shape header) or a .npy file (NPY_CONTENT_TYPE). The
+        frame is validated strictly, since nothing downstream can tell a wrong
+        shape from a strange image.
+        """
+        start = time.perf_counter()
+        if content_type == NPY_CONTENT_TYPE:
+            (shape, offset), image_format = _npy_shape(body), "npy"
+        elif content_type == RAW_CONTENT_TYPE:
+            shape, offset, image_format = _raw_shape(shape_header), 0, "raw"
+        else:
+            raise ValueError(f"Unsupported content type '{content_type}'. Use {RAW_CONTENT_TYPE} or {NPY_CONTENT_TYPE}.")
+
+        if len(shape) != 3 or shape[2] != 3:
+            raise ValueError(f"Expected an RGB frame of shape (height, width, 3), got {shape}.")
+        height, width, _ = shape
+        if not (RAW_MIN_SIDE <= height <= RAW_MAX_SIDE and RAW_MIN_SIDE <= width <= RAW_MAX_SIDE):
+            raise ValueError(f"Frame sides must be {RAW_MIN_SIDE} to {RAW_MAX_SIDE} pixels, got {width}x{height}.")
+        expected = height * width * 3
+        if len(body) - offset != expected:
+            raise ValueError(f"Body holds {len(body) - offset} bytes of pixels; shape {shape} needs {expected}.")
+        image = np.frombuffer(body, dtype=np.uint8, count=expected, offset=offset).reshape(shape)
+
+        decode_seconds = time.perf_counter() - start
+        self._metrics.decode_seconds.labels(format=image_format).observe(decode_seconds)
+        self._instrumentation.record("decode", decode_seconds)
+        self._metrics.decode_scale.observe(1)
+        return DecodedImage(image=image, original_size=(width, height), scale=1.0, format=image_format)
+
+    def decode_image(self, image_bytes: bytes, target_size: int | None = None) -> DecodedImage:
+        """
+        Decodes image bytes into an RGB image no smaller than `target_size` on either side.
+
+        JPEGs are decoded in draft mode, which lets libjpeg skip most of the
+        work for large photos. EXIF orientation is applied in place and the mode
+        conversion only runs when the decoder did not already produce RGB.
+        Pass `target_size=None` to always decode at full resolution.
+        """
+        start = time.perf_counter()
+        try:
+            img = Image.open(BytesIO(image_bytes))
+            image_format = img.format
+            full_width, full_height = img.size
+            if target_size and JPEG_DRAFT_DECODE and image_format == "JPEG":
+                img.draft("RGB", (target_size, target_size))
+            scale = full_width / img.size[0]
+
+            # Orientations 5-8 swap width and height
+            swapped = img.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+            ImageOps.exif_transpose(img, in_place=True)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.load()
+        except Exception as e:
+            logger.error(f"Error decoding uploaded image: {e}", exc_info=True)
+            raise ValueError(f"Could not decode image: {e}")
+
+        decode_seconds = time.perf_counter() - start
+        self._metrics.decode_seconds.labels(format=(image_format or "unknown").lower()).observe(decode_seconds)
+        self._instrumentation.record("decode", decode_seconds)
+        self._metrics.decode_scale.observe(scale)
+        self._metrics.decode_rss_bytes.observe(_current_rss_bytes())
+        self._metrics.peak_rss_bytes.set(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024) # ru_maxrss is KiB on Linux
+
+        original_size = (full_height, full_width) if swapped else (full_width, full_height)
+        return DecodedImage(image=img, original_size=original_size, scale=scale, format=image_format)
+
+
+# --- Request body limits ---
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware that bounds request bodies before anything parses them.
+
+    Starlette spools a multipart upload (to memory, then a temporary file)
+    while parsing the form, before the endpoint sees it, so a limit checked
+    in the endpoint only applies after the whole body was received. This
+    answers 413 right away when Content-Length is over the limit for the
+    request's path, and otherwise counts the body as it arrives and fails the
+    request as soon as it passes the limit. `limits` maps path prefixes to
+    byte limits (None for no limit); the longest matching prefix wins and
+    other paths get `default`.
+    """
+
+    def __init__(self, app, ingest: Ingest, limits: dict | None = None,
+                 default: int = UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES):
+        self.app = app
+        self.ingest = ingest
+        self.limits = sorted((limits or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.default = default
+
+    def limit_for(self, path: str) -> int | None:
+        return next((limit for prefix, limit in self.limits if path.startswith(prefix)), self.default)
+
+    async def _reject(self, scope, receive, send, limit: int):
+        self.ingest._metrics.uploads_rejected.labels(reason="too_large").inc()
+        response = JSONResponse({"detail": f"Request body exceeds the limit of {limit} bytes."},
+                                status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await self._reject(scope, receive, send, limit)
+            return
+
+        received, exceeded, started = 0, False, False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLargeError(f"Request body exceeds the limit of {limit} bytes.")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded: # The app turned the failed read into its own error response; answer 413 instead
+                if not started:
+                    started = True
+                    await self._reject(scope, receive, send, limit)
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not started: # A response already under way (e.g. streamed batch results) is cut short
+            await self._reject(scope, receive, send, limit)
@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+
+from fastapi import HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_MAX_REQUESTS = int(os.getenv("PROFILER_MAX_REQUESTS", "1000"))
+TRACE_INTERVAL_SECONDS = float(os.getenv("TRACE_INTERVAL_SECONDS", "10")) # Per trace key
+
+# Stage durations of the request being handled (or of the batch being run), in seconds
+_timings: contextvars.ContextVar = contextvars.ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def collect():
+    """Collects the stages recorded inside the block, including in executor threads, into a dict."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def current_timings() -> dict | None:
+    return _timings.get()
+
+
+def merge(target: dict | None, timings: dict):
+    """Adds already-observed stage durations (e.g. of a shared batch) to a request's timings."""
+    if target is None:
+        return
+    for stage, seconds in timings.items():
+        target[stage] = target.get(stage, 0.0) + seconds
+
+
+def server_timing(timings: dict) -> str:
+    """Formats stage durations as a Server-Timing header value (milliseconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+
+# --- Rate-limited debug traces ---
+_last_trace = {}
+
+def trace(log: logging.Logger, key: str, message):
+    """
+    Logs `message()` at DEBUG, at most once per TRACE_INTERVAL_SECONDS per key.
+
+    `message` is a callable so hot paths don't build strings that are never logged.
+    """
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    now = time.monotonic()
+    key = (log.name, key)
+    if now - _last_trace.get(key, float("-inf")) < TRACE_INTERVAL_SECONDS:
+        return
+    _last_trace[key] = now
+    log.debug(message())
+
+
+# --- Sampling profiler ---
+class StackSampler:
+    """
+    Samples the Python stacks of every thread at a fixed interval.
+
+    Samples are aggregated in the "folded" format (one `frame;frame;frame count`
+    line per distinct stack) read by flamegraph.pl and speedscope. Runs in a
+    daemon thread, so it needs no ptrace privileges, but it only sees threads
+    of this process (not process-pool workers).
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = TallyCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+
+class _Profile:
+    """A profile waiting for its next `remaining` requests to complete."""
+
+    def __init__(self, requests: int):
+        self.remaining = requests
+        self.done = asyncio.Event()
+
+    def request_finished(self):
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.done.set()
+
+_active_profile = None
+
+
+async def profile(requests: int = Query(10, ge=1, le=PROFILER_MAX_REQUESTS,
+                                        description="Number of requests to capture."),
+                  interval_ms: float = Query(5.0, ge=1.0, le=100.0, description="Sampling interval."),
+                  timeout: float = Query(60.0, gt=0.0, le=600.0,
+                                         description="Stop after this many seconds even if fewer requests arrived.")):
+    """
+    Samples all threads while the next `requests` requests are served and returns folded stacks.
+
+    Feed the output to flamegraph.pl or load it into speedscope. Disabled unless
+    PROFILER_ENABLED=true.
+    """
+    global _active_profile
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiling is disabled.")
+    if _active_profile is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already being captured.")
+
+    _active_profile = _Profile(requests)
+    sampler = StackSampler(interval_ms / 1000.0)
+    sampler.start()
+    logger.info(f"Profiling the next {requests} requests (interval {interval_ms}ms).")
+    try:
+        await asyncio.wait_for(_active_profile.done.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        captured = requests - max(0, _active_profile.remaining)
+        _active_profile = None
+        folded = await asyncio.to_thread(sampler.stop)
+    logger.info(f"Profile finished after {captured} requests ({sum(sampler.samples.values())} samples).")
+    return PlainTextResponse(folded, headers={"X-Profiled-Requests": str(captured)})
+
+
+class TimedRoute(APIRoute):
+    """
+    Route class that times request parsing, the endpoint and response serialization.
+
+    Stages recorded while the endpoint runs (upload read, decode, inference, ...)
+    are collected per request and returned in a Server-Timing header together
+    with the route's own stages. For streaming responses the header only covers
+    the work done before the stream starts. Use Instrumentation.TimedRoute,
+    which sets `instrumentation` to the service's.
+    """
+    instrumentation: "Instrumentation" = None
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kw):
+            timings = _timings.get()
+            if timings is not None:
+                timings["_endpoint_start"] = time.perf_counter()
+            try:
+                return await endpoint(*args, **kw)
+            finally:
+                if timings is not None:
+                    timings["_endpoint_end"] = time.perf_counter()
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            start = time.perf_counter()
+            profile_run = _active_profile
+            with collect() as timings:
+                try:
+                    response = await handler(request)
+                finally:
+                    if profile_run is not None:
+                        profile_run.request_finished()
+            end = time.perf_counter()
+            endpoint_start = timings.pop("_endpoint_start", None)
+            endpoint_end = timings.pop("_endpoint_end", None)
+            if endpoint_start is not None:
+                self.instrumentation.record("parse", endpoint_start - start)
+                timings["parse"] = endpoint_start - start
+            if endpoint_end is not None:
+                self.instrumentation.record("serialize", end - endpoint_end)
+                timings["serialize"] = end - endpoint_end
+            timings["total"] = end - start
+            response.headers["Server-Timing"] = server_timing(timings)
+            return response
+        return timed_handler
+
+
+class Instrumentation:
+    """
+    Per-stage timing for one service, exported as <service>_stage_seconds.
+
+    Stages: parse (multipart body), read (upload), queue (waiting for an
+    executor worker), decode, batch_wait, then the model's own stages
+    (preprocess, inference, postprocess, ...) and serialize (response model +
+    JSON). Use for_service() so every component of a service shares one.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.labels = {"model": "unknown", "backend": "unknown"}
+        self.stage_seconds = Histogram(
+            f"{service}_stage_seconds",
+            "Time spent in each stage of request handling and inference.",
+            ["stage", "model", "backend"],
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+        )
+
+    @classmethod
+    @functools.cache
+    def for_service(cls, service: str) -> "Instrumentation":
+        return cls(service)
+
+    def set_model_labels(self, model: str, backend: str):
+        """Sets the model/backend labels of the stage histogram (call once the model is loaded)."""
+        self.labels.update(model=model, backend=backend)
+
+    def record(self, stage: str, seconds: float):
+        """Observes a stage duration and adds it to the current request's timings, if any."""
+        self.stage_seconds.labels(stage=stage, **self.labels).observe(seconds)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    @functools.cached_property
+    def TimedRoute(self) -> type:
+        """A TimedRoute class whose routes record their stages here."""
+        return type(f"{self.service.title()}TimedRoute", (TimedRoute,), {"instrumentation": self})
+
+    # Request-scoped helpers, so a service can use its instance like a module
+    collect = staticmethod(collect)
+    current_timings = staticmethod(current_timings)
+    merge = staticmethod(merge)
+    server_timing = staticmethod(server_timing)
+    trace = staticmethod(trace)
+    profile = staticmethod(profile)
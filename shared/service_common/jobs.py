@@ -0,0 +1,634 @@
+import asyncio
+import functools
+import http.client
+import ipaddress
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from prometheus_client import Counter, Gauge
+
+from . import sqlite_local
+from .bulk import Bulk
+from .executor import QueueFullError
+from .ingest import UPLOAD_MAX_BYTES, UploadTooLargeError
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# "file" keeps jobs on a volume shared by every replica, so any pod answers polls and
+# a job survives its pod; "sqlite" is node-local (see sqlite_local.py), for single-node setups
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite").lower()
+# Default: /local-state/jobs/<service>.sqlite3 for sqlite, /model-cache/jobs/<service> for file
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))                      # Jobs processed at once per pod
+JOB_MAX_IN_FLIGHT = int(os.getenv("JOB_MAX_IN_FLIGHT", "16"))         # Images per job decoded/queued at once
+JOB_MAX_ITEMS = int(os.getenv("JOB_MAX_ITEMS", "100000"))             # Image references per job
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))      # A job whose worker stops renewing is re-run
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))        # Idle workers look for new jobs this often
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Image references are paths relative to JOB_IMAGE_ROOT, or http(s) URLs if enabled
+JOB_IMAGE_ROOT = os.getenv("JOB_IMAGE_ROOT", "/model-cache/job-inputs")
+JOB_ALLOW_URLS = os.getenv("JOB_ALLOW_URLS", "false").lower() == "true"
+# Hosts URLs may point at, comma-separated; ".example.com" also allows its subdomains. Empty allows none.
+JOB_URL_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("JOB_URL_ALLOWED_HOSTS", "").split(",") if h.strip()]
+JOB_FETCH_TIMEOUT_SECONDS = float(os.getenv("JOB_FETCH_TIMEOUT_SECONDS", "30"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        self.submitted = Counter(f"{service}_jobs_submitted_total", "Jobs submitted to the job API.")
+        self.finished = Counter(f"{service}_jobs_finished_total", "Jobs that reached a final state on this pod.", ["status"])
+        self.items = Counter(f"{service}_job_items_total", "Job images processed on this pod, by outcome.", ["outcome"])
+        self.running = Gauge(f"{service}_jobs_running", "Jobs currently being processed by this pod's workers.")
+
+# The service's job metrics; the API counts submissions in metrics(service).submitted
+metrics = functools.cache(_Metrics)
+
+
+class JobStore(ABC):
+    """
+    Interface for persistent job state.
+
+    A job is an ordered list of image references plus one result per item.
+    Workers claim a job with a lease and must keep renewing it; a job whose
+    lease runs out is handed to the next worker, which continues with the
+    items that have no result yet. Implementations are called from worker
+    threads and must be safe to use from more than one thread and process.
+    """
+
+    @abstractmethod
+    def create(self, references: list) -> dict:
+        """Queues a new job for the references and returns its status."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> dict | None:
+        """Returns the job's status and progress, or None if it does not exist."""
+
+    @abstractmethod
+    def results(self, job_id: str, offset: int, limit: int) -> list:
+        """Returns up to `limit` items starting at index `offset`, in order."""
+
+    @abstractmethod
+    def claim(self, owner: str, lease_seconds: float) -> str | None:
+        """Leases the oldest runnable job to `owner` and returns its id, or None."""
+
+    @abstractmethod
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extends the lease; False if `owner` no longer holds it (e.g. the job was cancelled)."""
+
+    @abstractmethod
+    def pending(self, job_id: str, after: int, limit: int) -> list:
+        """Returns (index, reference) of items without a result, after index `after`."""
+
+    @abstractmethod
+    def record(self, job_id: str, index: int, result=None, error: str | None = None):
+        """Stores the result, or the error, of one item."""
+
+    @abstractmethod
+    def finish(self, job_id: str, owner: str, status: str, error: str | None = None):
+        """Moves the job to a final `status` if `owner` still holds its lease."""
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a job that has not finished; False if there is no such job or it already finished."""
+
+    @abstractmethod
+    def purge(self, older_than: float):
+        """Deletes finished jobs last updated before `older_than` (a unix time)."""
+
+
+class SqliteJobStore(JobStore):
+    """
+    Job store in a single node-local sqlite database.
+
+    Shared by the worker processes of one pod, not between pods: with several
+    replicas a job is only known to the pod that accepted it, and it is lost
+    with the pod. Multi-replica deployments use FileJobStore.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connect()
+        # sqlite connections must not be used across fork (see serve.py), so each child opens its own
+        os.register_at_fork(after_in_child=self._connect)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, "
+            "completed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, error TEXT, owner TEXT, "
+            "lease_expires REAL, created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items (job_id TEXT NOT NULL, idx INTEGER NOT NULL, reference TEXT NOT NULL, "
+            "status TEXT NOT NULL, result TEXT, error TEXT, PRIMARY KEY (job_id, idx))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        # Autocommit mode, so claims can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite_local.connect(self.path, timeout=10.0, isolation_level=None)
+
+    def _transaction(self, body):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = body(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return value
+
+    @staticmethod
+    def _job_row(row) -> dict:
+        keys = ("job_id", "status", "total", "completed", "failed", "error", "created_at", "updated_at")
+        return dict(zip(keys, row))
+
+    def create(self, references: list) -> dict:
+        job_id, now = uuid.uuid4().hex, time.time()
+
+        def insert(conn):
+            conn.execute("INSERT INTO jobs (id, status, total, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, QUEUED, len(references), now, now))
+            conn.executemany("INSERT INTO items (job_id, idx, reference, status) VALUES (?, ?, ?, 'pending')",
+                             ((job_id, i, ref) for i, ref in enumerate(references)))
+        self._transaction(insert)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT id, status, total, completed, failed, error, created_at, updated_at "
+                                     "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job_row(row) if row else None
+
+    def results(self, job_id: str, offset: int, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT idx, reference, status, result, error FROM items "
+                                      "WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+                                      (job_id, offset, limit)).fetchall()
+        return [{"index": idx, "reference": ref, "status": status,
+                 "result": json.loads(result) if result is not None else None, "error": error}
+                for idx, ref, status, result, error in rows]
+
+    def claim(self, owner: str, lease_seconds: float) -> str | None:
+        def take(conn):
+            now = time.time()
+            row = conn.execute("SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                               "ORDER BY created_at LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = ?, owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                         (RUNNING, owner, now + lease_seconds, now, row[0]))
+            return row[0]
+        return self._transaction(take)
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND status = ?",
+                                        (time.time() + lease_seconds, job_id, owner, RUNNING))
+        return cursor.rowcount == 1
+
+    def pending(self, job_id: str, after: int, limit: int) -> list:
+        with self._lock:
+            return self._conn.execute("SELECT idx, reference FROM items WHERE job_id = ? AND status = 'pending' "
+                                      "AND idx > ? ORDER BY idx LIMIT ?", (job_id, after, limit)).fetchall()
+
+    def record(self, job_id: str, index: int, result=None, error: str | None = None):
+        def update(conn):
+            cursor = conn.execute("UPDATE items SET status = ?, result = ?, error = ? "
+                                  "WHERE job_id = ? AND idx = ? AND status = 'pending'",
+                                  ("error" if error else "done", None if error else json.dumps(result),
+                                   error, job_id, index))
+            if cursor.rowcount: # A re-run after a lost lease must not count an item twice
+                column = "failed" if error else "completed"
+                conn.execute(f"UPDATE jobs SET {column} = {column} + 1, updated_at = ? WHERE id = ?",
+                             (time.time(), job_id))
+        self._transaction(update)
+
+    def finish(self, job_id: str, owner: str, status: str, error: str | None = None):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_expires = NULL, "
+                               "updated_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                               (status, error, time.time(), job_id, owner, RUNNING))
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = ?, owner = NULL, updated_at = ? "
+                                        "WHERE id = ? AND status IN (?, ?)",
+                                        (CANCELLED, time.time(), job_id, QUEUED, RUNNING))
+        return cursor.rowcount == 1
+
+    def purge(self, older_than: float):
+        def delete(conn):
+            conn.execute("DELETE FROM items WHERE job_id IN (SELECT id FROM jobs WHERE status IN (?, ?, ?) "
+                         "AND updated_at < ?)", (*TERMINAL_STATUSES, older_than))
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+                         (*TERMINAL_STATUSES, older_than))
+        self._transaction(delete)
+
+
+class FileJobStore(JobStore):
+    """
+    Job store as plain files under a directory; safe on a volume shared by every replica.
+
+    Each job is a directory holding its references, one file per finished item
+    and, once it ends, a `final.json`. Every decision that must be made by one
+    worker only is an exclusive file creation, which NFS and similar shared
+    filesystems perform atomically on the server:
+
+    - a result is linked into place once, so an item re-run after a lost lease keeps its first result;
+    - a lease is a numbered file in the job's `lease` directory. Claiming an
+      expired lease and renewing a held one both create the next number, so of
+      two pods racing for a job exactly one wins;
+    - `final.json` is created once, so a cancel and a finish can't both apply.
+
+    Open jobs are also listed in `queue/`, named by submission time, so claiming
+    reads one directory instead of every job.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        for name in ("jobs", "queue", "tmp"):
+            (self.directory / name).mkdir(parents=True, exist_ok=True)
+
+    def _job(self, job_id: str) -> Path:
+        if not job_id.isalnum(): # Job ids are uuid hex; anything else must not become a path
+            return self.directory / "jobs" / "-"
+        return self.directory / "jobs" / job_id
+
+    def _write_new(self, path: Path, value) -> bool:
+        """Creates `path` holding `value` as JSON; False if it already exists. Readers never see a partial file."""
+        tmp_path = self.directory / "tmp" / f"{uuid.uuid4().hex}.json"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        try:
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            tmp_path.unlink()
+
+    @staticmethod
+    def _read(path: Path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _lease(self, job_dir: Path) -> tuple:
+        """Returns (number, lease) of the newest lease file, or (0, None) if the job was never claimed."""
+        try:
+            numbers = [int(name.partition(".")[0]) for name in os.listdir(job_dir / "lease")]
+        except FileNotFoundError:
+            return 0, None
+        if not numbers:
+            return 0, None
+        number = max(numbers)
+        return number, self._read(job_dir / "lease" / f"{number:012d}.json")
+
+    def _take_lease(self, job_dir: Path, number: int, owner: str, lease_seconds: float) -> bool:
+        return self._write_new(job_dir / "lease" / f"{number + 1:012d}.json",
+                               {"owner": owner, "expires": time.time() + lease_seconds})
+
+    def _counts(self, job_dir: Path) -> tuple:
+        done = len(os.listdir(job_dir / "items"))
+        failed = len(os.listdir(job_dir / "failed"))
+        return done - failed, failed
+
+    def create(self, references: list) -> dict:
+        job_id, now = uuid.uuid4().hex, time.time()
+        building = self.directory / "tmp" / job_id
+        for name in ("items", "failed", "lease"):
+            (building / name).mkdir(parents=True)
+        with open(building / "job.json", "w") as f:
+            json.dump({"job_id": job_id, "total": len(references), "created_at": now}, f)
+        with open(building / "references.json", "w") as f:
+            json.dump(references, f)
+        os.rename(building, self._job(job_id)) # Appears complete or not at all
+        (self.directory / "queue" / f"{time.time_ns():020d}-{job_id}").touch()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        job_dir = self._job(job_id)
+        job = self._read(job_dir / "job.json")
+        if job is None:
+            return None
+        try:
+            completed, failed = self._counts(job_dir)
+            updated_at = max(job["created_at"], os.stat(job_dir / "items").st_mtime)
+        except FileNotFoundError: # Purged while being read
+            return None
+        final = self._read(job_dir / "final.json")
+        if final is not None:
+            status, error, updated_at = final["status"], final["error"], final["updated_at"]
+        else:
+            _, lease = self._lease(job_dir)
+            status = RUNNING if lease is not None and lease["expires"] >= time.time() else QUEUED
+            error = None
+        return {"job_id": job["job_id"], "status": status, "total": job["total"], "completed": completed,
+                "failed": failed, "error": error, "created_at": job["created_at"], "updated_at": updated_at}
+
+    def results(self, job_id: str, offset: int, limit: int) -> list:
+        job_dir = self._job(job_id)
+        references = self._read(job_dir / "references.json") or []
+        items = []
+        for index in range(offset, min(offset + limit, len(references))):
+            item = self._read(job_dir / "items" / f"{index}.json")
+            items.append({"index": index, "reference": references[index],
+                          "status": item["status"] if item else "pending",
+                          "result": item["result"] if item else None, "error": item["error"] if item else None})
+        return items
+
+    def claim(self, owner: str, lease_seconds: float) -> str | None:
+        queue = self.directory / "queue"
+        for entry in sorted(os.listdir(queue)):
+            job_id = entry.partition("-")[2]
+            job_dir = self._job(job_id)
+            if not job_dir.exists() or (job_dir / "final.json").exists():
+                (queue / entry).unlink(missing_ok=True)
+                continue
+            number, lease = self._lease(job_dir)
+            if lease is not None and lease["expires"] >= time.time():
+                continue
+            if self._take_lease(job_dir, number, owner, lease_seconds):
+                return job_id
+        return None
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        job_dir = self._job(job_id)
+        number, lease = self._lease(job_dir)
+        if lease is None or lease["owner"] != owner or (job_dir / "final.json").exists():
+            return False
+        return self._take_lease(job_dir, number, owner, lease_seconds)
+
+    def pending(self, job_id: str, after: int, limit: int) -> list:
+        job_dir = self._job(job_id)
+        references = self._read(job_dir / "references.json") or []
+        done = {int(name.partition(".")[0]) for name in os.listdir(job_dir / "items")}
+        indices = (i for i in range(after + 1, len(references)) if i not in done)
+        return [(i, references[i]) for _, i in zip(range(limit), indices)]
+
+    def record(self, job_id: str, index: int, result=None, error: str | None = None):
+        job_dir = self._job(job_id)
+        item = {"status": "error" if error else "done", "result": None if error else result, "error": error}
+        # A re-run after a lost lease must not count an item twice
+        if self._write_new(job_dir / "items" / f"{index}.json", item) and error:
+            (job_dir / "failed" / str(index)).touch()
+
+    def _finalise(self, job_id: str, status: str, error: str | None) -> bool:
+        return self._write_new(self._job(job_id) / "final.json",
+                               {"status": status, "error": error, "updated_at": time.time()})
+
+    def finish(self, job_id: str, owner: str, status: str, error: str | None = None):
+        _, lease = self._lease(self._job(job_id))
+        if lease is not None and lease["owner"] == owner:
+            self._finalise(job_id, status, error)
+
+    def cancel(self, job_id: str) -> bool:
+        if not (self._job(job_id) / "job.json").exists():
+            return False
+        return self._finalise(job_id, CANCELLED, None)
+
+    def purge(self, older_than: float):
+        for job_dir in (self.directory / "jobs").iterdir():
+            final = self._read(job_dir / "final.json")
+            if final is not None and final["updated_at"] < older_than:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def create_job_store(service: str, kind: str = JOB_STORE_BACKEND, path: str | None = JOB_STORE_PATH) -> JobStore | None:
+    """Opens the configured job store, or returns None (job endpoints answer 503) if it can't be opened."""
+    try:
+        if kind == "sqlite":
+            path = path or f"/local-state/jobs/{service}.sqlite3"
+            return SqliteJobStore(path)
+        if kind == "file":
+            path = path or f"/model-cache/jobs/{service}"
+            return FileJobStore(path)
+    except Exception as e:
+        logger.error(f"Could not open job store '{kind}' at {path}: {e}. The job API is disabled.")
+        return None
+    raise ValueError(f"Unknown job store backend '{kind}'. Use 'sqlite' or 'file'.")
+
+
+def _host_allowed(host: str) -> bool:
+    return any(host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+               for allowed in JOB_URL_ALLOWED_HOSTS)
+
+
+def validate_reference(reference: str) -> Path | None:
+    """
+    Raises ValueError if `reference` is not an image reference this service may read.
+
+    Returns the resolved file path for path references, None for URLs. URLs
+    must be enabled (JOB_ALLOW_URLS) and point at a host in
+    JOB_URL_ALLOWED_HOSTS; their addresses are checked when they are fetched.
+    """
+    if reference.startswith(("http://", "https://")):
+        if not JOB_ALLOW_URLS:
+            raise ValueError("URL references are disabled on this service.")
+        host = (urllib.parse.urlsplit(reference).hostname or "").lower()
+        if not _host_allowed(host):
+            raise ValueError(f"URL host is not in the allowed hosts of this service: {host or reference}")
+        return None
+    root = Path(JOB_IMAGE_ROOT).resolve()
+    path = (root / reference).resolve()
+    if not path.is_relative_to(root):
+        raise ValueError(f"Path references must stay inside the job input directory: {reference}")
+    return path
+
+
+def _public_address(host: str, port: int) -> str:
+    """Resolves `host`, refusing it if any of its addresses is private, loopback, link-local or otherwise internal."""
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ValueError(f"Could not resolve {host}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        address = getattr(address, "ipv4_mapped", None) or address
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"URL host {host} resolves to a non-public address ({address}).")
+    return infos[0][4][0]
+
+
+def _fetch_url(url: str, max_bytes: int) -> bytes:
+    """GETs `url` from a vetted public address; redirects are not followed."""
+    parts = urllib.parse.urlsplit(url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    address = _public_address(parts.hostname, port)
+    connection = (http.client.HTTPSConnection if https else http.client.HTTPConnection)(
+        parts.hostname, port, timeout=JOB_FETCH_TIMEOUT_SECONDS)
+    # Connect to the address just checked, so a second DNS answer can't point the request elsewhere
+    connection._create_connection = lambda _, *args: socket.create_connection((address, port), *args)
+    try:
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        connection.request("GET", target)
+        response = connection.getresponse()
+        if response.status != 200:
+            redirect = " (redirects are not followed)" if 300 <= response.status < 400 else ""
+            raise ValueError(f"Fetching the image returned HTTP {response.status}{redirect}.")
+        return response.read(max_bytes + 1)
+    except http.client.HTTPException as e:
+        raise ValueError(f"Fetching the image failed: {e!r}")
+    finally:
+        connection.close()
+
+
+def load_reference(reference: str, max_bytes: int = UPLOAD_MAX_BYTES) -> bytes:
+    """Reads the image behind a reference, refusing anything larger than `max_bytes`."""
+    path = validate_reference(reference)
+    if path is None:
+        data = _fetch_url(reference, max_bytes)
+    else:
+        with open(path, "rb") as f:
+            data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise UploadTooLargeError(f"Image exceeds the limit of {max_bytes} bytes.")
+    return data
+
+
+def _item_error(error: Exception, index: int) -> str:
+    """Message stored for a failed item; unexpected errors are logged rather than exposed."""
+    if isinstance(error, (UploadTooLargeError, ValueError, QueueFullError, OSError)):
+        return str(error) or type(error).__name__
+    logger.error(f"Unexpected error processing job item {index}: {error}", exc_info=error)
+    return "An unexpected error occurred while processing the image."
+
+
+class JobRunner:
+    """
+    Background workers that claim jobs from `store` and run them through `process`.
+
+    `process(image_bytes, lane=...)` is the service's pipeline function; jobs
+    always run in the executor's bulk lane, so interactive requests go first.
+    Workers share the model already loaded in this process. Items are run by
+    the service's `bulk` processor and counted in <service>_job_* metrics.
+    """
+
+    def __init__(self, store: JobStore, process, bulk: Bulk, workers: int = JOB_WORKERS,
+                 max_in_flight: int = JOB_MAX_IN_FLIGHT, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.store = store
+        self.process = bulk.in_bulk_lane(process)
+        self.bulk = bulk
+        self.workers = max(0, workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self.lease_seconds = lease_seconds
+        self._tasks = []
+        self._metrics = metrics(bulk.ingest.service)
+
+    async def start(self):
+        if self._tasks or not self.workers:
+            return
+        host = socket.gethostname()
+        self._tasks = [asyncio.create_task(self._work(f"{host}-{os.getpid()}-{n}"), name=f"job-worker-{n}")
+                       for n in range(self.workers)]
+        logger.info(f"Job runner started ({self.workers} workers, max_in_flight={self.max_in_flight}).")
+
+    async def stop(self):
+        """Stops the workers; jobs they were running are resumed elsewhere once their lease expires."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Job runner stopped.")
+
+    async def _work(self, owner: str):
+        last_purge = 0.0
+        while True:
+            try:
+                if time.time() - last_purge > 3600:
+                    await asyncio.to_thread(self.store.purge, time.time() - JOB_RETENTION_SECONDS)
+                    last_purge = time.time()
+                job_id = await asyncio.to_thread(self.store.claim, owner, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Job worker {owner} could not reach the job store: {e}")
+                job_id = None
+            if job_id is None:
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+
+            logger.info(f"Job worker {owner} claimed job {job_id}.")
+            self._metrics.running.inc()
+            try:
+                status = await self._run_job(job_id, owner)
+                error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+                status, error = FAILED, str(e)
+            finally:
+                self._metrics.running.dec()
+            if status is not None:
+                await asyncio.to_thread(self.store.finish, job_id, owner, status, error)
+                self._metrics.finished.labels(status=status).inc()
+                logger.info(f"Job {job_id} finished with status '{status}'.")
+
+    async def _items(self, job_id: str):
+        """Yields (index, reference) for every item still without a result, in pages."""
+        after = -1
+        while True:
+            page = await asyncio.to_thread(self.store.pending, job_id, after, self.max_in_flight * 4)
+            if not page:
+                return
+            for index, reference in page:
+                yield index, reference
+            after = page[-1][0]
+
+    async def _run_one(self, reference: str):
+        image_bytes = await asyncio.to_thread(load_reference, reference)
+        return await self.process(image_bytes)
+
+    async def _run_job(self, job_id: str, owner: str) -> str | None:
+        """Processes the job's remaining items; returns its final status, or None if the lease was lost."""
+        renewed = time.monotonic()
+        results = self.bulk.process_in_order(self._items(job_id), self._run_one, self.max_in_flight)
+        try:
+            async for _, index, result in results:
+                if isinstance(result, Exception):
+                    self._metrics.items.labels(outcome="error").inc()
+                    await asyncio.to_thread(self.store.record, job_id, index, None, _item_error(result, index))
+                else:
+                    self._metrics.items.labels(outcome="ok").inc()
+                    await asyncio.to_thread(self.store.record, job_id, index, result)
+                if time.monotonic() - renewed > self.lease_seconds / 4:
+                    if not await asyncio.to_thread(self.store.renew, job_id, owner, self.lease_seconds):
+                        logger.info(f"Stopping job {job_id}: it was cancelled or its lease was taken over.")
+                        return None
+                    renewed = time.monotonic()
+        finally:
+            await results.aclose()
+        return SUCCEEDED
+
+
+async def wait_for_change(store: JobStore, job_id: str, timeout: float) -> dict | None:
+    """
+    Long-polls a job: returns as soon as it finishes or makes progress, or after `timeout` seconds.
+
+    Polls the store, so it also sees progress made by the pod's other worker processes.
+    """
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None or timeout <= 0 or job["status"] in TERMINAL_STATUSES:
+        return job
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    seen = (job["status"], job["completed"], job["failed"])
+    while loop.time() < deadline:
+        await asyncio.sleep(min(0.5, max(0.0, deadline - loop.time())))
+        job = await asyncio.to_thread(store.get, job_id)
+        if job is None or (job["status"], job["completed"], job["failed"]) != seen:
+            break
+    return job
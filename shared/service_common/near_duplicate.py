@@ -0,0 +1,180 @@
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+from itertools import combinations
+
+from PIL import Image
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Off by default: a reused result belongs to another image, which is only acceptable for workloads
+# dominated by re-uploads of the same photos
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "false").lower() == "true"
+MAX_DISTANCE_LIMIT = 2 # Beyond this, distinct images with a similar layout start to match
+NEAR_DUPLICATE_MAX_DISTANCE = min(int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "2")), MAX_DISTANCE_LIMIT) # Hamming bits out of 64
+NEAR_DUPLICATE_MAX_PIXEL_DIFFERENCE = int(os.getenv("NEAR_DUPLICATE_MAX_PIXEL_DIFFERENCE", "16")) # 0-255, per channel
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "100000"))
+
+HASH_BITS = 64
+THUMBNAIL_SIZE = (8, 8)
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        self.hits = Counter(f"{service}_near_duplicate_hits_total", "Results reused from a perceptually similar image.")
+        self.misses = Counter(f"{service}_near_duplicate_misses_total", "Lookups with no similar image in the index.")
+        self.entries = Gauge(f"{service}_near_duplicate_index_entries", "Hashes held in the near-duplicate index.")
+        self.lookup_seconds = Histogram(
+            f"{service}_near_duplicate_lookup_seconds",
+            "Time spent searching the near-duplicate index.",
+            buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05),
+        )
+
+_metrics = functools.cache(_Metrics)
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    Computes a 64-bit difference hash of an image.
+
+    The hash survives re-encoding, resizing and metadata changes, so two
+    uploads of the same photo end up a few bits apart at most.
+    """
+    pixels = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR).tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def thumbnail(image: Image.Image) -> bytes:
+    """
+    Averages an image down to an 8x8 RGB thumbnail.
+
+    dHash only sees luminance gradients, so a recoloured object or a
+    different shape in the same place can hash within a bit or two of the
+    original; the thumbnail tells those apart, while re-encodes and resizes
+    of the same photo stay within a few levels of it.
+    """
+    return image.convert("RGB").resize(THUMBNAIL_SIZE, Image.Resampling.BOX).tobytes()
+
+
+def fingerprint(image: Image.Image) -> tuple[int, bytes]:
+    """The (dhash, thumbnail) pair the index matches images by."""
+    return dhash(image), thumbnail(image)
+
+
+def _pixel_difference(a: bytes, b: bytes) -> int:
+    """Largest per-channel difference between two thumbnails."""
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def _neighbours(value: int, bits: int, radius: int):
+    """Yields every `bits`-wide value within `radius` bit flips of `value`."""
+    yield value
+    for distance in range(1, radius + 1):
+        for positions in combinations(range(bits), distance):
+            flipped = value
+            for position in positions:
+                flipped ^= 1 << position
+            yield flipped
+
+
+class NearDuplicateIndex:
+    """
+    Multi-index hashing table for 64-bit perceptual hashes.
+
+    Each hash is split into `bands` chunks, each indexed in its own table. Two
+    hashes within `max_distance` bits must agree to within
+    max_distance // bands bits on at least one chunk, so probing those few
+    neighbours per chunk finds every match without scanning the whole index.
+    Entries are evicted least-recently-used beyond `max_entries`.
+
+    Entries live in a namespace (e.g. the inference parameters) so results
+    produced with different settings never match each other. When a
+    thumbnail is stored with an entry, a lookup only matches it if its own
+    thumbnail is within `max_pixel_difference` of it on every pixel.
+    """
+
+    def __init__(self, service: str, max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE,
+                 max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES, bands: int = 4,
+                 max_pixel_difference: int = NEAR_DUPLICATE_MAX_PIXEL_DIFFERENCE):
+        if HASH_BITS % bands:
+            raise ValueError(f"bands must divide {HASH_BITS}.")
+        if not 0 <= max_distance <= MAX_DISTANCE_LIMIT:
+            raise ValueError(f"max_distance must be between 0 and {MAX_DISTANCE_LIMIT}.")
+        self.max_distance = max_distance
+        self.max_pixel_difference = max_pixel_difference
+        self.max_entries = max(0, max_entries)
+        self.bands = bands
+        self.band_bits = HASH_BITS // bands
+        self._band_mask = (1 << self.band_bits) - 1
+        self._band_radius = self.max_distance // bands
+        self._entries = OrderedDict() # (namespace, hash) -> (thumbnail, value)
+        self._tables = [{} for _ in range(bands)] # (namespace, chunk) -> set of hashes
+        self._metrics = _metrics(service)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _chunks(self, value: int):
+        return [(value >> (band * self.band_bits)) & self._band_mask for band in range(self.bands)]
+
+    def _matches(self, namespace: str, candidate: int, image_thumbnail: bytes | None) -> bool:
+        stored_thumbnail = self._entries[(namespace, candidate)][0]
+        return stored_thumbnail is None or image_thumbnail is None or \
+            _pixel_difference(stored_thumbnail, image_thumbnail) <= self.max_pixel_difference
+
+    def lookup(self, namespace: str, value: int, image_thumbnail: bytes | None = None):
+        """Returns (stored_value, distance) for the closest match within max_distance, or None."""
+        start = time.perf_counter()
+        best, best_distance = None, self.max_distance + 1
+        if (namespace, value) in self._entries and self._matches(namespace, value, image_thumbnail):
+            best, best_distance = value, 0
+        else:
+            seen = {value}
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                for probe in _neighbours(chunk, self.band_bits, self._band_radius):
+                    for candidate in table.get((namespace, probe), ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        distance = (candidate ^ value).bit_count()
+                        if distance < best_distance and self._matches(namespace, candidate, image_thumbnail):
+                            best, best_distance = candidate, distance
+        self._metrics.lookup_seconds.observe(time.perf_counter() - start)
+
+        if best is None:
+            self._metrics.misses.inc()
+            return None
+        self._metrics.hits.inc()
+        self._entries.move_to_end((namespace, best))
+        return self._entries[(namespace, best)][1], best_distance
+
+    def add(self, namespace: str, value: int, stored, image_thumbnail: bytes | None = None):
+        """Stores a result for the hash, evicting the least recently used entries if needed."""
+        if self.max_entries == 0:
+            return
+        key = (namespace, value)
+        if key not in self._entries:
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                table.setdefault((namespace, chunk), set()).add(value)
+        self._entries[key] = (image_thumbnail, stored)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(*self._entries.popitem(last=False)[0])
+        self._metrics.entries.set(len(self._entries))
+
+    def _remove(self, namespace: str, value: int):
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            bucket = table.get((namespace, chunk))
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[(namespace, chunk)]
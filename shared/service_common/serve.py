@@ -0,0 +1,165 @@
+"""
+Serves a service's app with one or more uvicorn worker processes.
+
+With one worker this is plain uvicorn. With more workers, the model is loaded
+once in a master process, the master's heap is frozen out of the garbage
+collector, and workers are forked from it. All workers then share the
+weights and the imported libraries copy-on-write instead of each holding a
+private copy. Each worker gets its own share of the CPU cores for intra-op
+threads, and the master restarts workers that die.
+
+The master loads single-threaded and runs no inference: a fork taken after
+torch or OpenMP has started its thread pool can leave a worker waiting on a
+lock held by a thread that doesn't exist in the child. Warm-up inferences
+run in each worker after the fork, before it reports ready.
+
+Metrics are aggregated across workers through PROMETHEUS_MULTIPROC_DIR.
+Each service's app/serve.py says which of its backends may be preloaded.
+"""
+import argparse
+import gc
+import glob
+import importlib
+import logging
+import os
+import signal
+import socket
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+SERVE_THREADS_PER_WORKER = int(os.getenv("SERVE_THREADS_PER_WORKER", "0")) # 0 splits the cores evenly
+SERVE_PRELOAD = os.getenv("SERVE_PRELOAD", "true").lower() == "true"
+SERVE_GC_FREEZE = os.getenv("SERVE_GC_FREEZE", "true").lower() == "true"
+SERVE_RESTART_DELAY_SECONDS = float(os.getenv("SERVE_RESTART_DELAY_SECONDS", "1"))
+
+
+def _threads_per_worker(workers: int) -> int:
+    if SERVE_THREADS_PER_WORKER > 0:
+        return SERVE_THREADS_PER_WORKER
+    return max(1, len(os.sched_getaffinity(0)) // workers)
+
+
+def _prepare_metrics_dir():
+    """Points prometheus_client at an empty multiprocess directory (before it is first imported)."""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory is None:
+        directory = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+    else:
+        os.makedirs(directory, exist_ok=True)
+        for stale in glob.glob(os.path.join(directory, "*.db")): # Left over from an earlier run
+            os.remove(stale)
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, threads: int, configure_worker):
+    """Runs in a forked child: serves `app` on the inherited socket until told to stop."""
+    import uvicorn
+
+    configure_worker(threads)
+    logger.info(f"Worker {os.getpid()} serving with {threads} intra-op threads.")
+    # The lifespan's load_model() only warms up when the master already loaded the model
+    uvicorn.Server(uvicorn.Config(app, log_config=None)).run(sockets=[sock])
+
+
+def _spawn(app, sock: socket.socket, threads: int, configure_worker) -> int:
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL) # uvicorn installs its own handlers
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            _run_worker(app, sock, threads, configure_worker)
+        except BaseException:
+            logger.exception(f"Worker {os.getpid()} crashed.")
+            code = 1
+        finally:
+            logging.shutdown()
+            os._exit(code)
+    return pid
+
+
+def serve_prefork(package: str, host: str, port: int, workers: int, preload_supported, configure_worker):
+    """
+    Loads `package`'s model in this process, then forks `workers` workers serving `package`.main:app.
+
+    `preload_supported(model_loader)` says whether the loaded model may be
+    shared across fork; `configure_worker(threads)` runs in each worker first.
+    """
+    _prepare_metrics_dir()
+    from prometheus_client import multiprocess
+
+    model_loader = importlib.import_module(f"{package}.model_loader")
+    app = importlib.import_module(f"{package}.main").app
+
+    model_loader.import_runtime() # Before forking, so the workers share the libraries and the device is known
+    preload = SERVE_PRELOAD and preload_supported(model_loader)
+    if preload:
+        try:
+            model_loader.load_model(warm_up=False)
+        except Exception as e: # The workers retry and report unhealthy if they fail too
+            logger.error(f"Failed to preload the model in the master process: {e}", exc_info=True)
+
+    threads = _threads_per_worker(workers)
+    sock = _listen(host, port)
+    if SERVE_GC_FREEZE:
+        # Move everything allocated so far out of the collector's reach, so collections
+        # in the workers don't write to (and so un-share) the master's pages
+        gc.collect()
+        gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    children.update(_spawn(app, sock, threads, configure_worker) for _ in range(workers))
+    logger.info(f"Serving on {host}:{port} with {workers} workers (pids {sorted(children)}, "
+                f"preloaded={preload and bool(model_loader.model)}, threads per worker={threads}).")
+    while children:
+        try:
+            pid, wait_status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        multiprocess.mark_process_dead(pid)
+        if not stopping:
+            logger.error(f"Worker {pid} exited ({wait_status}); starting a replacement.")
+            time.sleep(SERVE_RESTART_DELAY_SECONDS)
+            children.add(_spawn(app, sock, threads, configure_worker))
+    logger.info("All workers stopped.")
+
+
+def main(package: str, description: str, default_port: int, preload_supported, configure_worker):
+    """Command-line entry point of a service's serve module (see serve_prefork)."""
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.workers <= 1:
+        import uvicorn
+        uvicorn.run(f"{package}.main:app", host=args.host, port=args.port)
+        return
+    serve_prefork(package, args.host, args.port, args.workers, preload_supported, configure_worker)
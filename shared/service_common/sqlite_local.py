@@ -0,0 +1,53 @@
+"""
+Node-local sqlite databases.
+
+sqlite in WAL mode keeps its index in a shared-memory file next to the
+database and relies on POSIX locks, neither of which works between hosts
+on NFS, CephFS or SMB mounts: a database written from several nodes through
+a ReadWriteMany volume can be corrupted. The stores built on sqlite (the job
+store and the sqlite result-cache tier) are therefore owned by one node,
+e.g. a per-pod emptyDir shared only by the worker processes of that pod, and
+connect() refuses paths on network filesystems.
+"""
+import os
+import sqlite3
+from pathlib import Path
+
+NETWORK_FILESYSTEMS = frozenset({
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "ceph", "fuse.ceph", "glusterfs", "fuse.glusterfs",
+    "lustre", "gpfs", "beegfs", "9p", "afs", "fuse.sshfs", "fuse.s3fs", "fuse.juicefs",
+})
+
+
+def filesystem_type(path: str) -> str | None:
+    """Type of the filesystem holding `path`, from /proc/self/mounts; None where that can't be read."""
+    try:
+        with open("/proc/self/mounts") as f:
+            mounts = [line.split() for line in f]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    for fields in mounts:
+        mount_point = fields[1].replace("\\040", " ")
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) >= len(best):
+            best, fstype = mount_point, fields[2]
+    return fstype
+
+
+def connect(path: str, timeout: float, **kwargs) -> sqlite3.Connection:
+    """
+    Opens (creating its directory) a WAL-mode sqlite database for use from several threads.
+
+    Raises ValueError if `path` is on a network filesystem.
+    """
+    directory = Path(path).parent
+    directory.mkdir(parents=True, exist_ok=True)
+    fstype = filesystem_type(str(directory))
+    if fstype in NETWORK_FILESYSTEMS:
+        raise ValueError(f"{path} is on a network filesystem ({fstype}); sqlite databases must be node-local, "
+                         f"e.g. on an emptyDir volume")
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=timeout, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
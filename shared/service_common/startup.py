@@ -0,0 +1,127 @@
+"""
+Startup phases and readiness of a service process.
+
+The app answers HTTP (liveness probes, /metrics) as soon as it starts, while
+the model loads on a background thread: the ML libraries are imported, the
+weights are read from the model volume, and warm-up inferences run before
+readiness flips, so no request pays for lazy initialisation. Each phase's
+duration is exported as <service>_startup_phase_seconds, so cold-start
+regressions show on dashboards.
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# false waits for the model inside the lifespan, so the server only starts listening once it is ready
+STARTUP_BACKGROUND = os.getenv("STARTUP_BACKGROUND", "true").lower() == "true"
+PREFETCH_CHUNK_BYTES = 8 * 1024 * 1024
+
+_started_at = time.monotonic()
+
+
+# --- Metrics ---
+class _Metrics:
+    def __init__(self, service: str):
+        self.phase_seconds = Gauge(
+            f"{service}_startup_phase_seconds",
+            "Duration of each startup phase of this process; 'ready' is the time from process start to ready.",
+            ["phase"],
+        )
+        self.ready = Gauge(f"{service}_ready", "1 once the model is loaded and warmed up and requests are accepted.")
+
+_metrics = functools.cache(_Metrics)
+
+
+def process_age() -> float:
+    """Seconds since this process started, including interpreter start-up and imports."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _started_at
+
+
+class Startup:
+    """
+    Startup state machine of one service: starting -> loading -> warming_up -> ready, or failed.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.state = "starting"
+        self._metrics = _metrics(service)
+
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    @contextmanager
+    def phase(self, name: str, next_state: str | None = None):
+        """Times a startup phase into <service>_startup_phase_seconds{phase=name}, optionally moving to `next_state`."""
+        if next_state is not None:
+            self.state = next_state
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._metrics.phase_seconds.labels(phase=name).set(seconds)
+            logger.info(f"{self.service} startup phase '{name}' took {seconds:.2f}s.")
+
+    def prefetch(self, paths: list) -> threading.Thread:
+        """
+        Reads files (or every file under directories) into the page cache on a background thread.
+
+        Started before the slow imports, so reading the weights from the model
+        volume overlaps with them instead of following them.
+        """
+        def read_all():
+            with self.phase("prefetch"):
+                buffer = bytearray(PREFETCH_CHUNK_BYTES)
+                for path in paths:
+                    files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names] \
+                        if os.path.isdir(path) else [path]
+                    for file in files:
+                        try:
+                            with open(file, "rb", buffering=0) as f:
+                                while f.readinto(buffer):
+                                    pass
+                        except OSError as e:
+                            logger.warning(f"Could not prefetch {file}: {e}")
+
+        thread = threading.Thread(target=read_all, name=f"{self.service}-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    async def run(self, load, start_pipeline):
+        """
+        Loads the model on a worker thread, then starts the pipeline and flips readiness.
+
+        If loading fails the pipeline still starts, and endpoints needing the
+        model answer 503.
+        """
+        self.state = "loading"
+        try:
+            await asyncio.to_thread(load)
+        except Exception as e:
+            self.state = "failed"
+            logger.error(f"Fatal Error: Failed to load the {self.service} model during startup: {e}", exc_info=True)
+        await start_pipeline()
+        if self.state == "failed":
+            return
+        self.state = "ready"
+        self._metrics.ready.set(1)
+        age = process_age()
+        self._metrics.phase_seconds.labels(phase="ready").set(age)
+        logger.info(f"{self.service} ready to serve {age:.2f}s after the process started.")
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+from service_common import batching
+from service_common.executor import BULK, INTERACTIVE, InferenceExecutor
+
+
+def _run_with_batcher(scenario, batch_fn, max_workers: int = 1, **options):
+    async def run():
+        executor = InferenceExecutor("test_batching", kind="thread", max_workers=max_workers)
+        executor.start()
+        batcher = batching.MicroBatcher(batch_fn, name="test", executor=executor, **options)
+        await batcher.start()
+        try:
+            return await scenario(batcher)
+        finally:
+            await batcher.stop()
+            executor.shutdown()
+    return asyncio.run(run())
+
+
+def test_full_batch_is_dispatched_without_waiting():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    async def scenario(batcher):
+        start = time.perf_counter()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(4)))
+        return results, time.perf_counter() - start
+
+    results, seconds = _run_with_batcher(scenario, batch_fn, max_batch_size=4, max_wait_ms=10_000)
+    assert results == [0, 10, 20, 30]
+    assert batches == [[0, 1, 2, 3]]
+    assert seconds < 5
+
+
+def test_partial_batch_is_dispatched_after_max_wait():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return items
+
+    async def scenario(batcher):
+        start = time.perf_counter()
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"))
+        return results, time.perf_counter() - start
+
+    results, seconds = _run_with_batcher(scenario, batch_fn, max_batch_size=8, max_wait_ms=50)
+    assert results == ["a", "b"]
+    assert batches == [["a", "b"]]
+    assert seconds >= 0.05
+
+
+def test_interactive_items_fill_batches_before_bulk_items():
+    batches = []
+    started, release = threading.Event(), threading.Event()
+
+    def batch_fn(items):
+        if items == ["blocker"]:
+            started.set()
+            release.wait(timeout=5)
+        batches.append(list(items))
+        return items
+
+    async def scenario(batcher):
+        blocker = asyncio.create_task(batcher.submit("blocker"))
+        while not started.is_set(): # Hold the only worker so the next items queue up
+            await asyncio.sleep(0.005)
+        waiting = [asyncio.create_task(batcher.submit(item, lane))
+                   for item, lane in (("bulk-1", BULK), ("bulk-2", BULK),
+                                      ("interactive-1", INTERACTIVE), ("interactive-2", INTERACTIVE))]
+        await asyncio.sleep(0.02)
+        release.set()
+        await asyncio.gather(blocker, *waiting)
+
+    _run_with_batcher(scenario, batch_fn, max_batch_size=2, max_wait_ms=1)
+    assert batches == [["blocker"], ["interactive-1", "interactive-2"], ["bulk-1", "bulk-2"]]
+
+
+def test_batches_run_concurrently_up_to_the_executor_workers():
+    started, release = threading.Event(), threading.Event()
+
+    def batch_fn(items):
+        if items == ["blocker"]:
+            started.set()
+            release.wait(timeout=5)
+        return items
+
+    async def scenario(batcher):
+        blocker = asyncio.create_task(batcher.submit("blocker"))
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+        # The second worker serves this batch while the first is still busy
+        result = await asyncio.wait_for(batcher.submit("next"), timeout=2)
+        release.set()
+        return result, await blocker
+
+    assert _run_with_batcher(scenario, batch_fn, max_workers=2, max_batch_size=1, max_wait_ms=1) == ("next", "blocker")
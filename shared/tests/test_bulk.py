@@ -0,0 +1,95 @@
+import asyncio
+import io
+import tarfile
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from service_common import bulk as bulk_module
+from service_common.bulk import Bulk
+from service_common.ingest import Ingest, UploadTooLargeError
+
+bulk = Bulk(Ingest("test_bulk"))
+
+
+def _upload(filename: str, data: bytes, content_type: str = "application/octet-stream") -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data), filename=filename,
+                      headers=Headers({"content-type": content_type}))
+
+
+def _zip(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _tar_gz(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _collect(files: list, max_items: int = bulk_module.BULK_MAX_ITEMS) -> list:
+    async def collect():
+        return [item async for item in bulk.iter_uploads(files, max_items)]
+    return asyncio.run(collect())
+
+
+MEMBERS = {"a.jpg": b"a", "notes.txt": b"skipped", "dir/b.png": b"b"}
+
+
+def test_archives_are_expanded_in_place_and_skip_non_images():
+    files = [_upload("first.jpg", b"1", "image/jpeg"), _upload("set.zip", _zip(MEMBERS)),
+             _upload("set.tar.gz", _tar_gz(MEMBERS)), _upload("last.jpg", b"2", "image/jpeg")]
+    assert _collect(files) == [
+        ("first.jpg", b"1"),
+        ("set.zip/a.jpg", b"a"), ("set.zip/dir/b.png", b"b"),
+        ("set.tar.gz/a.jpg", b"a"), ("set.tar.gz/dir/b.png", b"b"),
+        ("last.jpg", b"2"),
+    ]
+
+
+def test_oversized_members_and_broken_archives_fail_only_their_items(monkeypatch):
+    monkeypatch.setattr(bulk_module, "UPLOAD_MAX_BYTES", 4)
+    items = _collect([_upload("set.zip", _zip({"big.jpg": b"x" * 5, "ok.jpg": b"ok"})),
+                      _upload("broken.tar", b"not a tar")])
+    assert [name for name, _ in items] == ["set.zip/big.jpg", "set.zip/ok.jpg", "broken.tar"]
+    assert isinstance(items[0][1], UploadTooLargeError)
+    assert items[1][1] == b"ok"
+    assert isinstance(items[2][1], ValueError)
+
+
+def test_archive_members_count_towards_the_item_limit():
+    with pytest.raises(ValueError, match="limit of 2 images"):
+        _collect([_upload("set.zip", _zip({f"{i}.jpg": b"x" for i in range(3)}))], max_items=2)
+
+
+def test_results_are_yielded_in_input_order_whatever_order_they_finish_in():
+    async def process(data):
+        await asyncio.sleep(0.01 * (5 - int(data))) # Later items finish first
+        if data == b"2":
+            raise ValueError("Could not decode image")
+        return data.decode()
+
+    async def items():
+        yield "bad.jpg", UploadTooLargeError("too large")
+        for i in range(5):
+            yield f"{i}.jpg", str(i).encode()
+
+    async def collect():
+        return [item async for item in bulk.process_in_order(items(), process, max_in_flight=3)]
+
+    results = asyncio.run(collect())
+    assert [(index, filename) for index, filename, _ in results] == [
+        (0, "bad.jpg"), (1, "0.jpg"), (2, "1.jpg"), (3, "2.jpg"), (4, "3.jpg"), (5, "4.jpg")]
+    assert isinstance(results[0][2], UploadTooLargeError)
+    assert isinstance(results[3][2], ValueError)
+    assert [result for _, _, result in results[4:]] == ["3", "4"]
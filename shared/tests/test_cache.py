@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from service_common import cache
+
+
+def test_lru_evicts_least_recently_used_beyond_max_bytes():
+    value = {"objects": [{"label": "cat", "score": 0.9}] * 4}
+    entry_size = len("k0") + len(json.dumps(value, separators=(",", ":")))
+    lru = cache.LRUCache("test_cache", max_entries=100, max_bytes=entry_size * 3)
+    for i in range(3):
+        lru.set(f"k{i}", value)
+    lru.get("k0") # Now the most recently used
+    lru.set("k3", value)
+    assert lru.get("k1") is cache._MISSING
+    assert [lru.get(key) for key in ("k0", "k2", "k3")] == [value] * 3
+
+
+def test_lru_skips_results_larger_than_max_bytes():
+    lru = cache.LRUCache("test_cache", max_entries=100, max_bytes=64)
+    lru.set("small", {"caption": "a cat"})
+    lru.set("large", {"caption": "a cat " * 100})
+    assert lru.get("large") is cache._MISSING
+    assert lru.get("small") == {"caption": "a cat"}
+
+
+def test_concurrent_identical_requests_compute_once():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"caption": "a cat"}
+
+    async def run():
+        results = cache.ResultCache("test_cache", cache.LRUCache("test_cache"))
+        first = await asyncio.gather(*(results.get_or_compute("key", compute) for _ in range(5)))
+        again = await results.get_or_compute("key", compute)
+        return first, again
+
+    first, again = asyncio.run(run())
+    assert calls == [1]
+    assert first == [{"caption": "a cat"}] * 5
+    assert again == {"caption": "a cat"}
+
+
+def test_failed_computation_reaches_every_waiter_and_is_not_cached():
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("Could not decode image")
+
+    async def run():
+        results = cache.ResultCache("test_cache", cache.LRUCache("test_cache"))
+        outcomes = await asyncio.gather(*(results.get_or_compute("key", failing) for _ in range(3)),
+                                        return_exceptions=True)
+        retry = await results.get_or_compute("key", lambda: asyncio.sleep(0, result="ok"))
+        return outcomes, retry
+
+    outcomes, retry = asyncio.run(run())
+    assert calls == [1]
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert retry == "ok"
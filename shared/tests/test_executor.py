@@ -0,0 +1,34 @@
+import asyncio
+import threading
+
+import pytest
+
+from service_common.executor import INFERENCE_RETRY_AFTER_SECONDS, InferenceExecutor, QueueFullError
+
+
+def test_full_queue_rejects_with_retry_after():
+    release = threading.Event()
+
+    async def run():
+        executor = InferenceExecutor("test_executor", kind="thread", max_workers=1, max_queue_size=1)
+        executor.start()
+        try:
+            running = asyncio.create_task(executor.run(release.wait, 5))
+            await asyncio.sleep(0.02)
+            queued = asyncio.create_task(executor.run(lambda: "queued"))
+            await asyncio.sleep(0.02)
+            assert executor.queue_depth == 1
+
+            with pytest.raises(QueueFullError) as rejected:
+                await executor.run(lambda: "rejected")
+            # Already-admitted work queues instead of being rejected
+            unbounded = asyncio.create_task(executor.run(lambda: "unbounded", bounded=False))
+
+            release.set()
+            assert await asyncio.gather(running, queued, unbounded) == [True, "queued", "unbounded"]
+            return rejected.value
+        finally:
+            executor.shutdown()
+
+    error = asyncio.run(run())
+    assert error.retry_after == INFERENCE_RETRY_AFTER_SECONDS
@@ -0,0 +1,49 @@
+import io
+
+import numpy as np
+import pytest
+
+from service_common.ingest import NPY_CONTENT_TYPE, RAW_CONTENT_TYPE, Ingest
+
+ingest = Ingest("test_ingest")
+
+
+def _npy(array: np.ndarray) -> bytearray:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return bytearray(buffer.getvalue())
+
+
+def test_raw_frame_keeps_shape_and_pixels():
+    frame = np.arange(32 * 48 * 3, dtype=np.uint8).reshape(32, 48, 3)
+    decoded = ingest.decode_raw(bytearray(frame.tobytes()), RAW_CONTENT_TYPE, "32,48,3")
+    assert decoded.image.shape == (32, 48, 3)
+    assert decoded.image.dtype == np.uint8
+    assert decoded.original_size == (48, 32)
+    np.testing.assert_array_equal(decoded.image, frame)
+
+
+def test_npy_frame_keeps_shape_and_pixels():
+    frame = np.full((20, 30, 3), 7, dtype=np.uint8)
+    decoded = ingest.decode_raw(_npy(frame), NPY_CONTENT_TYPE)
+    assert decoded.image.shape == (20, 30, 3)
+    np.testing.assert_array_equal(decoded.image, frame)
+
+
+@pytest.mark.parametrize("body, content_type, shape", [
+    (bytearray(32 * 48 * 3 - 1), RAW_CONTENT_TYPE, "32,48,3"), # One byte short
+    (bytearray(32 * 48 * 3), RAW_CONTENT_TYPE, None),
+    (bytearray(32 * 48 * 3), RAW_CONTENT_TYPE, "32,x,3"),
+    (bytearray(32 * 48 * 4), RAW_CONTENT_TYPE, "32,48,4"),
+    (bytearray(32 * 48), RAW_CONTENT_TYPE, "32,48"),
+    (bytearray(8 * 8 * 3), RAW_CONTENT_TYPE, "8,8,3"),
+    (_npy(np.zeros((20, 30, 3), dtype=np.float32)), NPY_CONTENT_TYPE, None),
+    (_npy(np.asfortranarray(np.zeros((20, 30, 3), dtype=np.uint8))), NPY_CONTENT_TYPE, None),
+    (_npy(np.zeros((20, 30), dtype=np.uint8)), NPY_CONTENT_TYPE, None),
+    (bytearray(b"not a npy file"), NPY_CONTENT_TYPE, None),
+    (bytearray(32 * 48 * 3), "image/jpeg", "32,48,3"),
+], ids=["short", "no-shape", "bad-shape", "four-channels", "grayscale", "too-small", "float32", "fortran",
+        "npy-grayscale", "npy-garbage", "content-type"])
+def test_invalid_frames_are_rejected(body, content_type, shape):
+    with pytest.raises(ValueError):
+        ingest.decode_raw(body, content_type, shape)
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from service_common import jobs
+
+
+@pytest.fixture(params=["sqlite", "file"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return jobs.SqliteJobStore(str(tmp_path / "jobs.sqlite3"))
+    return jobs.FileJobStore(str(tmp_path / "jobs"))
+
+
+def test_expired_lease_is_requeued_with_remaining_items(store):
+    job = store.create(["a", "b", "c"])
+    assert store.claim("worker-1", lease_seconds=0.05) == job["job_id"]
+    store.record(job["job_id"], 0, result={"caption": "a"})
+    assert store.claim("worker-2", lease_seconds=60) is None # Still leased
+
+    time.sleep(0.1)
+    assert store.claim("worker-2", lease_seconds=60) == job["job_id"]
+    assert store.renew(job["job_id"], "worker-1", lease_seconds=60) is False
+    assert store.renew(job["job_id"], "worker-2", lease_seconds=60) is True
+    assert store.pending(job["job_id"], after=-1, limit=10) == [(1, "b"), (2, "c")]
+
+
+def test_item_recorded_twice_after_a_lost_lease_counts_once(store):
+    job = store.create(["a"])
+    store.claim("worker-1", lease_seconds=60)
+    store.record(job["job_id"], 0, result=1)
+    store.record(job["job_id"], 0, result=2)
+    assert store.get(job["job_id"])["completed"] == 1
+    assert store.results(job["job_id"], 0, 10)[0]["result"] == 1
+
+
+def test_finish_is_ignored_from_a_worker_that_lost_the_lease(store):
+    job = store.create(["a"])
+    store.claim("worker-1", lease_seconds=0.01)
+    time.sleep(0.05)
+    store.claim("worker-2", lease_seconds=60)
+    store.finish(job["job_id"], "worker-1", jobs.SUCCEEDED)
+    assert store.get(job["job_id"])["status"] == jobs.RUNNING
+    store.finish(job["job_id"], "worker-2", jobs.SUCCEEDED)
+    assert store.get(job["job_id"])["status"] == jobs.SUCCEEDED
+
+
+def test_cancel_reports_whether_the_job_was_cancelled(store):
+    job = store.create(["a"])
+    assert store.cancel(job["job_id"]) is True
+    assert store.get(job["job_id"])["status"] == jobs.CANCELLED
+    assert store.cancel(job["job_id"]) is False
+
+    finished = store.create(["b"])
+    store.claim("worker-1", lease_seconds=60)
+    store.finish(finished["job_id"], "worker-1", jobs.SUCCEEDED)
+    assert store.cancel(finished["job_id"]) is False
+    assert store.get(finished["job_id"])["status"] == jobs.SUCCEEDED
+    assert store.cancel("missing") is False
+
+
+def test_cancelled_job_stops_its_worker(store):
+    job = store.create(["a", "b"])
+    assert store.claim("worker-1", lease_seconds=60) == job["job_id"]
+    store.cancel(job["job_id"])
+    assert store.renew(job["job_id"], "worker-1", lease_seconds=60) is False
+    assert store.claim("worker-2", lease_seconds=60) is None
+
+
+def test_file_store_is_shared_between_instances(tmp_path):
+    # Two replicas mounting the same volume
+    first, second = jobs.FileJobStore(str(tmp_path)), jobs.FileJobStore(str(tmp_path))
+    job = first.create(["a", "b"])
+    assert second.get(job["job_id"])["status"] == jobs.QUEUED
+    assert second.claim("pod-2", lease_seconds=60) == job["job_id"]
+    assert first.claim("pod-1", lease_seconds=60) is None
+    second.record(job["job_id"], 0, result={"caption": "a"})
+    second.record(job["job_id"], 1, error="unreadable")
+    status = first.get(job["job_id"])
+    assert (status["status"], status["completed"], status["failed"]) == (jobs.RUNNING, 1, 1)
+    assert [item["status"] for item in first.results(job["job_id"], 0, 10)] == ["done", "error"]
@@ -0,0 +1,75 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from service_common import near_duplicate
+
+
+def _scene(shape="rectangle", foreground=(200, 30, 30), background=(40, 120, 200)) -> Image.Image:
+    image = Image.new("RGB", (640, 480), background)
+    draw = ImageDraw.Draw(image)
+    getattr(draw, shape)((200, 140, 440, 380), fill=foreground)
+    return image
+
+
+def _reencoded(image: Image.Image, quality: int) -> Image.Image:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+def _indexed(image: Image.Image) -> near_duplicate.NearDuplicateIndex:
+    index = near_duplicate.NearDuplicateIndex("test_near_duplicate", max_distance=near_duplicate.MAX_DISTANCE_LIMIT)
+    value, image_thumbnail = near_duplicate.fingerprint(image)
+    index.add("params", value, "original", image_thumbnail)
+    return index
+
+
+def test_disabled_by_default():
+    assert near_duplicate.NEAR_DUPLICATE_ENABLED is False
+    assert near_duplicate.NEAR_DUPLICATE_MAX_DISTANCE <= near_duplicate.MAX_DISTANCE_LIMIT
+
+
+def test_rejects_distances_beyond_the_limit():
+    with pytest.raises(ValueError):
+        near_duplicate.NearDuplicateIndex("test_near_duplicate", max_distance=near_duplicate.MAX_DISTANCE_LIMIT + 1)
+
+
+@pytest.mark.parametrize("copy", [
+    lambda image: image.resize((320, 240)),
+    lambda image: _reencoded(image, 60),
+    lambda image: _reencoded(image.resize((1024, 768)), 30),
+], ids=["resized", "jpeg60", "upscaled-jpeg30"])
+def test_matches_copies_of_the_same_image(copy):
+    index = _indexed(_scene())
+    value, image_thumbnail = near_duplicate.fingerprint(copy(_scene()))
+    assert index.lookup("params", value, image_thumbnail) is not None
+
+
+@pytest.mark.parametrize("other", [
+    _scene(foreground=(30, 30, 200)),
+    _scene(shape="ellipse"),
+], ids=["recoloured", "different-shape"])
+def test_distinct_images_with_a_similar_layout_do_not_match(other):
+    original = _scene()
+    value, image_thumbnail = near_duplicate.fingerprint(other)
+    # The layouts are close enough for dHash alone to call them duplicates
+    assert (value ^ near_duplicate.dhash(original)).bit_count() <= near_duplicate.MAX_DISTANCE_LIMIT
+    assert _indexed(original).lookup("params", value, image_thumbnail) is None
+
+
+@pytest.mark.parametrize("max_distance", range(near_duplicate.MAX_DISTANCE_LIMIT + 1))
+def test_matches_up_to_max_distance_bits_and_no_further(max_distance):
+    index = near_duplicate.NearDuplicateIndex("test_near_duplicate", max_distance=max_distance)
+    stored = 0x0123_4567_89AB_CDEF
+    index.add("params", stored, "original")
+    # Flip bits spread over different bands, so each probe has to find the entry through another band
+    flips = [0, 17, 33, 49]
+    at_limit = stored
+    for bit in flips[:max_distance]:
+        at_limit ^= 1 << bit
+    beyond = at_limit ^ (1 << flips[max_distance])
+    assert index.lookup("params", at_limit) == ("original", max_distance)
+    assert index.lookup("params", beyond) is None
+    assert index.lookup("other-params", stored) is None
@@ -0,0 +1,119 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+
+import httpx
+import pytest
+
+from service_common import serve
+
+MODEL_LOADER = '''
+import os
+
+model = None
+
+def import_runtime():
+    pass
+
+def load_model(warm_up=True):
+    global model
+    model = f"loaded in {os.getpid()}"
+'''
+
+MAIN = '''
+import os
+
+from fastapi import FastAPI
+
+from . import model_loader
+
+app = FastAPI()
+
+@app.get("/")
+def worker():
+    return {"pid": os.getpid(), "model": model_loader.model}
+'''
+
+
+def test_threads_are_split_evenly_unless_configured(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)))
+    assert serve._threads_per_worker(2) == 4
+    assert serve._threads_per_worker(16) == 1
+    monkeypatch.setattr(serve, "SERVE_THREADS_PER_WORKER", 3)
+    assert serve._threads_per_worker(2) == 3
+
+
+def test_stale_metrics_of_an_earlier_run_are_removed(tmp_path, monkeypatch):
+    (tmp_path / "counter_123.db").write_bytes(b"stale")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    serve._prepare_metrics_dir()
+    assert list(tmp_path.iterdir()) == []
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get(port: int) -> dict:
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            return httpx.get(f"http://127.0.0.1:{port}/", timeout=5).json()
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _workers(master: subprocess.Popen) -> list:
+    with open(f"/proc/{master.pid}/task/{master.pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+@pytest.fixture
+def prefork(tmp_path):
+    """Serves a stand-in service package with two prefork workers in a subprocess."""
+    package = tmp_path / "stand_in"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "model_loader.py").write_text(MODEL_LOADER)
+    (package / "main.py").write_text(MAIN)
+    port = _free_port()
+    script = textwrap.dedent(f"""
+        from service_common import serve
+        serve.serve_prefork("stand_in", "127.0.0.1", {port}, 2, lambda model_loader: True, lambda threads: None)
+    """)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path), *sys.path]),
+               PROMETHEUS_MULTIPROC_DIR=str(tmp_path / "metrics"), SERVE_RESTART_DELAY_SECONDS="0")
+    master = subprocess.Popen([sys.executable, "-c", script], env=env)
+    try:
+        yield master, port
+    finally:
+        if master.poll() is None:
+            master.kill()
+            master.wait()
+
+
+def test_workers_share_the_model_the_master_loaded(prefork):
+    master, port = prefork
+    response = _get(port)
+    assert response["model"] == f"loaded in {master.pid}"
+    assert response["pid"] != master.pid
+
+
+def test_dead_worker_is_replaced_and_sigterm_stops_all_workers(prefork):
+    master, port = prefork
+    worker = _get(port)["pid"]
+    os.kill(worker, signal.SIGKILL)
+    deadline = time.monotonic() + 30
+    while worker in _workers(master) or len(_workers(master)) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    master.send_signal(signal.SIGTERM)
+    assert master.wait(timeout=30) == 0
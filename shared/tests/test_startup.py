@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+from prometheus_client import REGISTRY
+
+from service_common.startup import Startup
+
+
+def test_ready_only_after_the_model_is_loaded_and_the_pipeline_started():
+    startup = Startup("test_startup_ready")
+    seen = []
+
+    def load():
+        seen.append(("load", startup.state, startup.is_ready()))
+
+    async def start_pipeline():
+        seen.append(("start", startup.state, startup.is_ready()))
+
+    assert startup.state == "starting"
+    asyncio.run(startup.run(load, start_pipeline))
+    assert seen == [("load", "loading", False), ("start", "loading", False)]
+    assert startup.is_ready()
+
+
+def test_failed_load_still_starts_the_pipeline_but_never_becomes_ready():
+    startup = Startup("test_startup_failed")
+    started = []
+
+    def load():
+        raise OSError("weights not found")
+
+    async def start_pipeline():
+        started.append(startup.state)
+
+    asyncio.run(startup.run(load, start_pipeline))
+    assert started == ["failed"]
+    assert startup.state == "failed" and not startup.is_ready()
+
+
+def test_load_runs_off_the_event_loop():
+    startup = Startup("test_startup_thread")
+    threads = []
+
+    async def start_pipeline():
+        pass
+
+    asyncio.run(startup.run(lambda: threads.append(threading.current_thread()), start_pipeline))
+    assert threads[0] is not threading.main_thread()
+
+
+def test_phase_moves_to_its_next_state():
+    startup = Startup("test_startup_phase")
+    with startup.phase("warmup", next_state="warming_up"):
+        assert startup.state == "warming_up"
+
+
+def test_prefetch_reads_every_file_under_a_directory(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "weights.bin").write_bytes(b"\0" * 1024)
+    (tmp_path / "config.json").write_text("{}")
+    startup = Startup("test_startup_prefetch")
+    thread = startup.prefetch([str(tmp_path), str(tmp_path / "missing.bin")]) # A missing file is only logged
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert REGISTRY.get_sample_value("test_startup_prefetch_startup_phase_seconds", {"phase": "prefetch"}) is not None